@@ -1,212 +1,861 @@
 import os
+import time
+import threading
+import collections
 import flask
 import boto.s3.connection
-import cx_Oracle
+import thumbnail_inventory
+import thumbnail_cache
+
+# cx_Oracle is only needed for the default connection pool; another 
+# database (SQLite, say) can be used with set_pool()
+try:
+    import cx_Oracle
+except ImportError:
+    cx_Oracle = None
+
+# Oracle session pool size; the maximum is DB_POOL_SIZE if it is set
+pool_min = 1
+default_pool_max = 8
+
+# seconds between summary refreshes; see create_app()
+default_summary_ttl = 300
+
+# seconds a request will wait for the first summary
+summary_wait = 60
+
+# Volumes to cache and seconds to keep them; see VolumeCache
+default_volume_cache_size = 1000
+default_volume_cache_ttl = 600
+
+# seconds a transaction that writes summary_changes may take to commit; 
+# see VolumeCache
+change_lag = 60
+
+structural_types = ('MR structural (MPRAGE)', 
+                    'MR structural (T1)', 
+                    'MR structural (FSPGR)')
+
+# scan types with their own bucket; the rest go in type Other
+known_types = ('MR structural (MPRAGE)', 
+               'MR structural (T1)', 
+               'MR structural (PD)', 
+               'MR structural (FSPGR)', 
+               'fMRI', 
+               'MR diffusion', 
+               'MR structural (T2)')
+
+# columns shown on the bucket pages
+page_cols = ('image_file', 
+             'subjectkey', 
+             'interview_age', 
+             'image03_id', 
+             'scan_type', 
+             'has_basic_check', 
+             'has_thumbnail', 
+             'has_derived_image03', 
+             'has_structural_qa', 
+             'has_time_series_qa')
+
+# rows per bucket page
+default_page_size = 100
+max_page_size = 1000
+
+class ConnectionPool:
+
+    """a stand-in for cx_Oracle.SessionPool that makes a new connection 
+    for each acquire(), for databases without session pools"""
+
+    def __init__(self, connect):
+        self.connect = connect
+        return
+
+    def acquire(self):
+        return self.connect()
+
+    def release(self, db):
+        db.close()
+        return
+
+db_pool = None
+db_pool_lock = threading.Lock()
+
+# 'oracle' (ROWNUM) or 'sqlite' (LIMIT); see limit_query()
+db_dialect = 'oracle'
+
+def set_pool(pool, dialect='oracle'):
+    """use pool (anything with acquire() and release()) for database 
+    connections"""
+    global db_pool, db_dialect
+    db_pool = pool
+    db_dialect = dialect
+    return
+
+def limit_query(query, n):
+    """return query limited to its first n rows"""
+    if db_dialect == 'oracle':
+        return 'SELECT * FROM (%s) WHERE ROWNUM <= %d' % (query, n)
+    return '%s LIMIT %d' % (query, n)
+
+def older_than(col, seconds):
+    """return a condition that the timestamp col is more than seconds 
+    old, by the database's clock"""
+    if db_dialect == 'oracle':
+        fmt = "%s < SYSTIMESTAMP - NUMTODSINTERVAL(%d, 'SECOND')"
+    else:
+        fmt = "%s < DATETIME('now', '-%d seconds')"
+    return fmt % (col, seconds)
+
+def get_pool():
+    """return the connection pool, creating an Oracle session pool on 
+    first use"""
+    global db_pool
+    with db_pool_lock:
+        if db_pool is None:
+            pool_max = int(os.environ.get('DB_POOL_SIZE', default_pool_max))
+            dsn = cx_Oracle.makedsn(os.environ['DB_HOST'], 
+                                    1521, 
+                                    os.environ['DB_SERVICE'])
+            db_pool = cx_Oracle.SessionPool(os.environ['DB_USER'], 
+                                            os.environ['DB_PASSWORD'], 
+                                            dsn, 
+                                            pool_min, 
+                                            pool_max, 
+                                            1, 
+                                            threaded=True)
+    return db_pool
 
 class DB:
 
     def __enter__(self):
-        self.db = cx_Oracle.connect(os.environ['DB_USER'], 
-                                    os.environ['DB_PASSWORD'], 
-                                    db_dsn)
-        self.c = self.db.cursor()
+        self.pool = get_pool()
+        self.db = self.pool.acquire()
+        try:
+            self.c = self.db.cursor()
+        except:
+            self.pool.release(self.db)
+            raise
         return self.c
 
     def __exit__(self, exc_type, exc_value, exc_traceback):
         try:
             self.c.close()
-            self.db.close()
+        except:
+            pass
+        try:
+            self.pool.release(self.db)
         except:
             pass
         return
 
+def classify(d):
+    """return the class of a (single image03) summary row"""
+    if d['scan_type'] in structural_types:
+        return 'Structural'
+    if d['scan_type'] == 'fMRI':
+        return 'Time Series'
+    if d['scan_type'] == 'MR diffusion':
+        return 'Diffusion'
+    return 'Other'
+
+def is_okay(d):
+    """return True if a summary row (with its class) has all its checks"""
+    if not d['has_basic_check']:
+        return False
+    if not d['has_thumbnail']:
+        return False
+    if not d['has_derived_image03']:
+        return False
+    if d['class'] == 'Structural' and not d['has_structural_qa']:
+        return False
+    if d['class'] == 'Time Series' and not d['has_time_series_qa']:
+        return False
+    return True
+
+def _sql_list(values):
+    """quote a list of constant strings for an IN clause"""
+    return ', '.join([ "'%s'" % v.replace("'", "''") for v in values ])
+
+# SQL for the buckets in Summary; these must agree with Summary._add(), 
+# classify(), and is_okay()
+
+single_mr_condition = "n_image03 = 1 AND image_modality = 'MR'"
+
+class_conditions = {'Structural': 'scan_type IN (%s)' % \
+                                  _sql_list(structural_types), 
+                    'Time Series': "scan_type = 'fMRI'", 
+                    'Diffusion': "scan_type = 'MR diffusion'", 
+                    'Other': '(scan_type IS NULL OR scan_type NOT IN (%s))' % \
+                             _sql_list(structural_types + \
+                                       ('fMRI', 'MR diffusion'))}
+
+okay_condition = 'has_basic_check = 1 ' + \
+                 'AND has_thumbnail = 1 ' + \
+                 'AND has_derived_image03 = 1'
+
+# the QA checks only apply to single MR rows
+mr_okay_condition = okay_condition + \
+                    ' AND (scan_type IS NULL ' + \
+                    'OR scan_type NOT IN (%s) ' % \
+                    _sql_list(structural_types) + \
+                    'OR has_structural_qa = 1) ' + \
+                    "AND (scan_type IS NULL OR scan_type <> 'fMRI' " + \
+                    'OR has_time_series_qa = 1)'
+
+def bucket_condition(kind, name):
+    """return (condition, parameters, okay condition) selecting the 
+    summary rows in a modality, class, or type bucket
+
+    raises KeyError if there is no such bucket"""
+    if kind == 'modality':
+        if name == 'MR':
+            return (single_mr_condition, {}, mr_okay_condition)
+        if name == 'Other':
+            condition = 'n_image03 = 1 AND (image_modality IS NULL ' + \
+                        "OR image_modality <> 'MR')"
+            return (condition, {}, okay_condition)
+    elif kind == 'class':
+        if name in class_conditions:
+            condition = '%s AND %s' % (single_mr_condition, 
+                                       class_conditions[name])
+            return (condition, {}, mr_okay_condition)
+    elif kind == 'type':
+        if name == 'Other':
+            condition = '%s AND (scan_type IS NULL OR scan_type NOT IN (%s))'
+            condition = condition % (single_mr_condition, 
+                                     _sql_list(known_types))
+            return (condition, {}, mr_okay_condition)
+        if name in known_types:
+            condition = '%s AND scan_type = :scan_type' % single_mr_condition
+            return (condition, {'scan_type': name}, mr_okay_condition)
+    raise KeyError('no %s bucket %s' % (kind, name))
+
+def _counts():
+    return {'total': 0, 'okay': 0, 'error': 0}
+
 class Summary:
 
+    """counts of the summary table by modality, class, and type
+
+    modalities, classes, and types map bucket names to {'total': n, 
+    'okay': n, 'error': n}, as do all and multiples.  the counts come 
+    from one aggregate query (one row for each combination of scan type 
+    and checks) rather than from reading the table; see Bucket for the 
+    rows themselves and SummaryCache for refreshing"""
+
+    group_cols = ('image_modality', 
+                  'scan_type', 
+                  'multiple', 
+                  'has_basic_check', 
+                  'has_thumbnail', 
+                  'has_derived_image03', 
+                  'has_structural_qa', 
+                  'has_time_series_qa')
+
     def __init__(self):
+        t0 = time.time()
+        self.all = _counts()
+        self.multiples = _counts()
+        self.modalities = {'MR': _counts(), 'Other': _counts()}
+        self.classes = {'Structural': _counts(), 
+                        'Time Series': _counts(), 
+                        'Diffusion': _counts(), 
+                        'Other': _counts()}
+        self.types = {'Other': _counts()}
+        for name in known_types:
+            self.types[name] = _counts()
+        exprs = list(self.group_cols)
+        exprs[2] = 'CASE WHEN n_image03 > 1 THEN 1 ELSE 0 END'
+        query = 'SELECT %s, COUNT(*) FROM summary GROUP BY %s' % \
+                (', '.join(exprs), ', '.join(exprs))
         with DB() as c:
-            c.execute("SELECT * FROM summary")
-            cols = [ el[0].lower() for el in c.description ]
-            self.all = []
-            self.multiples = []
-            self.modalities = {'MR': [], 'Other': []}
-            self.classes = {'Structural': [], 
-                            'Time Series': [], 
-                            'Diffusion': [], 
-                            'Other': []}
-            self.types = {'MR structural (MPRAGE)': [], 
-                          'MR structural (T1)': [], 
-                          'MR structural (PD)': [], 
-                          'MR structural (FSPGR)': [], 
-                          'fMRI': [], 
-                          'MR diffusion': [], 
-                          'MR structural (T2)': [], 
-                          'Other': []}
+            c.execute(query)
             for row in c:
-                d = dict(zip(cols, row))
-                self.all.append(d)
-                if d['n_image03'] > 1:
-                    d['class'] = None
-                    self.multiples.append(d)
-                else:
-                    if d['image_modality'] == 'MR':
-                        self.modalities['MR'].append(d)
-                        if d['scan_type'] in ('MR structural (MPRAGE)', 
-                                              'MR structural (T1)', 
-                                              'MR structural (FSPGR)'):
-                            d['class'] = 'Structural'
-                            self.classes['Structural'].append(d)
-                            self.types[d['scan_type']].append(d)
-                        elif d['scan_type'] == 'fMRI':
-                            d['class'] = 'Time Series'
-                            self.classes['Time Series'].append(d)
-                            self.types[d['scan_type']].append(d)
-                        elif d['scan_type'] == 'MR diffusion':
-                            d['class'] = 'Diffusion'
-                            self.classes['Diffusion'].append(d)
-                            self.types[d['scan_type']].append(d)
-                        elif d['scan_type'] in ('MR structural (T2)', 
-                                                'MR structural (PD)'):
-                            d['class'] = 'Other'
-                            self.classes['Other'].append(d)
-                            self.types[d['scan_type']].append(d)
-                        else:
-                            d['class'] = 'Other'
-                            self.classes['Other'].append(d)
-                            self.types['Other'].append(d)
-                    else:
-                        self.modalities['Other'].append(d)
+                self._add(dict(zip(self.group_cols, row[:-1])), row[-1])
+        self.build_time = time.time() - t0
         return
 
-    def split(self, image_modality=None, image_class=None, image_type=None):
-        if image_class:
-            (okay_l, error_l) = self._split(self.classes[image_class])
-        elif image_type:
-            (okay_l, error_l) = self._split(self.types[image_type])
-        elif image_modality:
-            (okay_l, error_l) = self._split(self.modalities[image_type])
+    def _add(self, d, n):
+        # _add(group, number of rows in the group)
+        buckets = [self.all]
+        if d['multiple']:
+            d['class'] = None
+            buckets.append(self.multiples)
+        elif d['image_modality'] == 'MR':
+            d['class'] = classify(d)
+            buckets.append(self.modalities['MR'])
+            buckets.append(self.classes[d['class']])
+            if d['scan_type'] in self.types:
+                buckets.append(self.types[d['scan_type']])
+            else:
+                buckets.append(self.types['Other'])
         else:
-            (okay_l, error_l) = self._split(self.all)
-        return (okay_l, error_l)
-
-    def _split(self, l):
-        # _split(list) -> (okay list, error list)
-        okay_l = []
-        error_l = []
-        for d in l:
-            if not d['has_basic_check']:
-                error_l.append(d)
-                continue
-            if not d['has_thumbnail']:
-                error_l.append(d)
-                continue
-            if not d['has_derived_image03']:
-                error_l.append(d)
-                continue
-            if d['class'] == 'Structural' and not d['has_structural_qa']:
-                error_l.append(d)
-                continue
-            if d['class'] == 'Time Series' and not d['has_time_series_qa']:
-                error_l.append(d)
+            d['class'] = None
+            buckets.append(self.modalities['Other'])
+        if is_okay(d):
+            status = 'okay'
+        else:
+            status = 'error'
+        for counts in buckets:
+            counts['total'] += n
+            counts[status] += n
+        return
+
+    def counts(self, kind, name):
+        """return the counts for a modality, class, or type bucket"""
+        if kind == 'modality':
+            return self.modalities[name]
+        if kind == 'class':
+            return self.classes[name]
+        if kind == 'type':
+            return self.types[name]
+        raise KeyError('no %s bucket %s' % (kind, name))
+
+class Bucket:
+
+    """the rows in a modality, class, or type bucket (see 
+    bucket_condition()), optionally only the okay or error rows
+
+    rows are read a page at a time in image_file order.  pages are 
+    keyed by the last image_file of the previous page rather than by 
+    offset, so (with the index on image_file) a page costs the same 
+    wherever it is in the bucket"""
+
+    def __init__(self, kind, name, status='all'):
+        (condition, params, okay) = bucket_condition(kind, name)
+        self.kind = kind
+        self.name = name
+        self.status = status
+        okay_expr = 'CASE WHEN %s THEN 1 ELSE 0 END' % okay
+        if status == 'okay':
+            condition = '%s AND %s = 1' % (condition, okay_expr)
+        elif status == 'error':
+            condition = '%s AND %s = 0' % (condition, okay_expr)
+        elif status != 'all':
+            raise ValueError('bad status %s' % status)
+        self.condition = condition
+        self.params = params
+        return
+
+    def page(self, after=None, n=default_page_size):
+        """return (rows, last image_file) for the n rows after image_file 
+        after (or the first n rows)
+
+        the last image_file is None if this is the last page"""
+        query = 'SELECT %s FROM summary WHERE %s' % (', '.join(page_cols), 
+                                                     self.condition)
+        params = dict(self.params)
+        if after is not None:
+            query += ' AND image_file > :after'
+            params['after'] = after
+        query = limit_query(query + ' ORDER BY image_file', n + 1)
+        with DB() as c:
+            c.execute(query, params)
+            rows = [ dict(zip(page_cols, row)) for row in c.fetchall() ]
+        if len(rows) > n:
+            rows = rows[:n]
+            return (rows, rows[-1]['image_file'])
+        return (rows, None)
+
+class SummaryCache:
+
+    """a Summary that is rebuilt by a background thread every ttl 
+    seconds
+
+    get() returns the current Summary without waiting for a refresh 
+    (except for the first); the refresh times and errors are kept for 
+    /metrics"""
+
+    def __init__(self, ttl, factory=Summary):
+        self.ttl = ttl
+        self.factory = factory
+        self.summary = None
+        self.loaded = threading.Event()
+        self.lock = threading.Lock()
+        self.thread = None
+        self.n_refreshes = 0
+        self.n_errors = 0
+        self.last_refresh = None
+        self.last_refresh_seconds = None
+        return
+
+    def refresh(self):
+        """build a new Summary and swap it in"""
+        t0 = time.time()
+        try:
+            summary = self.factory()
+        except:
+            with self.lock:
+                self.n_errors += 1
+            raise
+        t1 = time.time()
+        with self.lock:
+            self.summary = summary
+            self.n_refreshes += 1
+            self.last_refresh = t1
+            self.last_refresh_seconds = t1 - t0
+        self.loaded.set()
+        return summary
+
+    def _run(self):
+        while True:
+            try:
+                self.refresh()
+            except Exception, data:
+                print 'error refreshing summary: %s' % str(data)
+                # don't wait a full TTL to retry
+                time.sleep(min(self.ttl, 30))
                 continue
+            time.sleep(self.ttl)
+        return
+
+    def start(self):
+        """start the refresh thread if it isn't running"""
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run)
+                self.thread.daemon = True
+                self.thread.start()
         return
 
+    def get(self, timeout=None):
+        """return the current Summary, or None if the first one isn't 
+        ready within timeout seconds"""
+        self.start()
+        if not self.loaded.wait(timeout):
+            return None
+        return self.summary
+
+    def metrics(self):
+        """return a list of (name, type, help, value) for /metrics"""
+        with self.lock:
+            if self.summary is None:
+                n_rows = 0
+            else:
+                n_rows = self.summary.all['total']
+            if self.last_refresh is None:
+                age = None
+            else:
+                age = time.time() - self.last_refresh
+            return [('summary_refresh_seconds', 
+                     'gauge', 
+                     'duration of the last summary refresh', 
+                     self.last_refresh_seconds), 
+                    ('summary_age_seconds', 
+                     'gauge', 
+                     'time since the last summary refresh', 
+                     age), 
+                    ('summary_refreshes_total', 
+                     'counter', 
+                     'summary refreshes', 
+                     self.n_refreshes), 
+                    ('summary_refresh_errors_total', 
+                     'counter', 
+                     'failed summary refreshes', 
+                     self.n_errors), 
+                    ('summary_rows', 
+                     'gauge', 
+                     'rows in the summary', 
+                     n_rows)]
+
+def _unique(rows):
+    """return the distinct rows that aren't all NULL, in order"""
+    seen = set()
+    unique = []
+    for row in rows:
+        row = tuple(row)
+        if row in seen:
+            continue
+        seen.add(row)
+        for val in row:
+            if val is not None:
+                unique.append(row)
+                break
+    return unique
+
 class Volume:
 
+    """an image file with its image03 rows, derived image03 (or None), 
+    thumbnail link (or None), and QA (imaging_qa01) rows
+
+    everything is read with one query joining the three tables; the 
+    columns of each table in the result are found by the marker columns 
+    between them"""
+
+    query = """SELECT image03.*, 
+                      1 AS volume_derived_, 
+                      image03_derived.*, 
+                      1 AS volume_qa_, 
+                      imaging_qa01.* 
+                 FROM image03 
+                 LEFT JOIN image03_derived 
+                   ON image03_derived.image_file = image03.image_file 
+                 LEFT JOIN imaging_qa01 
+                   ON imaging_qa01.file_source = image03.image_file 
+                WHERE image03.image_file = :image_file"""
+
     def __init__(self, s3_link):
         self.s3_link = s3_link
-        query = "SELECT * FROM image03 WHERE image_file = :image_file"
-        query_params = {'image_file': s3_link}
-        (cols, rows) = self._db(query, query_params)
+        self.loaded = time.time()
+        with DB() as c:
+            c.execute(self.query, {'image_file': s3_link})
+            cols = [ el[0].lower() for el in c.description ]
+            rows = c.fetchall()
         if not rows:
             raise KeyError('%s not found' % s3_link)
-        self.image03_cols = cols
-        self.image03 = [ dict(zip(cols, row)) for row in rows ]
-        query = "SELECT * FROM image03_derived WHERE image_file = :image_file"
-        (cols, rows) = self._db(query, query_params)
-        if not rows:
-            self.image03_derived = None
-            self.thumbnail_link = None
-        else:
-            self.image03_derived = dict(zip(cols, rows[0]))
+        # the join repeats each row of a table for each matching row of 
+        # the others
+        di = cols.index('volume_derived_')
+        qi = cols.index('volume_qa_')
+        self.image03_cols = cols[:di]
+        self.image03 = [ dict(zip(self.image03_cols, row)) \
+                         for row in _unique([ r[:di] for r in rows ]) ]
+        derived = _unique([ r[di+1:qi] for r in rows ])
+        self.image03_derived = None
+        self.thumbnail_link = None
+        if derived:
+            self.image03_derived = dict(zip(cols[di+1:qi], derived[0]))
             if self.image03_derived['image_thumbnail_file']:
                 itf = self.image03_derived['image_thumbnail_file']
                 self.thumbnail_link = '/thumbnail/%s' % itf
+        qa_rows = _unique([ r[qi+1:] for r in rows ])
+        # only the QA columns with values
+        self.qa_cols = []
+        for (i, col) in enumerate(cols[qi+1:]):
+            for row in qa_rows:
+                if row[i] is not None:
+                    self.qa_cols.append(col)
+                    break
+        self.qa = [ dict(zip(cols[qi+1:], row)) for row in qa_rows ]
+        return
+
+class VolumeCache:
+
+    """Volumes by image file, bounded by number, least recently used 
+    first out
+
+    the store_* scripts (store_derived_image03 among them) add the image 
+    files they write to summary_changes, numbered by change_id; the 
+    changes are read at most every poll_interval seconds and the Volumes 
+    for the changed files are dropped.  a change_id is taken when a row 
+    is inserted rather than when it is committed, so a change can appear 
+    after one with a higher change_id: each poll reads the changes above 
+    a low-water mark (skipping those already seen), and the mark only 
+    moves past changes more than change_lag seconds old.  a Volume is 
+    also reread after ttl seconds regardless."""
+
+    def __init__(self, max_entries, ttl, poll_interval=10, factory=Volume):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.poll_interval = poll_interval
+        self.factory = factory
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.poll_lock = threading.Lock()
+        self.last_poll = None
+        # the low-water mark (every change up to it has been seen) and 
+        # the change_ids seen above it
+        self.low = None
+        self.seen = set()
+        # incremented by each poll; a Volume read across a poll isn't 
+        # cached, since the poll may have missed it
+        self.generation = 0
+        self.counts = {'cache': 0, 'db': 0}
+        return
+
+    def get(self, image_file):
+        """return the Volume for image_file; raises KeyError if it 
+        doesn't exist"""
+        self._poll_if_due()
+        with self.lock:
+            volume = self.entries.pop(image_file, None)
+            if volume and time.time() - volume.loaded < self.ttl:
+                self.entries[image_file] = volume
+                self.counts['cache'] += 1
+                return volume
+            generation = self.generation
+        volume = self.factory(image_file)
+        with self.lock:
+            self.counts['db'] += 1
+            if self.generation == generation:
+                self.entries[image_file] = volume
+                while len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+        return volume
+
+    def _poll_if_due(self):
+        now = time.time()
+        if self.last_poll is not None and \
+           now - self.last_poll < self.poll_interval:
+            return
+        # if another thread is polling, don't wait for it
+        if not self.poll_lock.acquire(False):
+            return
+        try:
+            self._poll()
+            self.last_poll = now
+        except Exception, data:
+            print 'error reading summary_changes: %s' % str(data)
+        finally:
+            self.poll_lock.release()
         return
 
-    def _db(self, query, query_params):
+    def _poll(self):
+        old = older_than('changed', change_lag)
         with DB() as c:
-            c.execute(query, query_params)
-            cols = [ el[0].lower() for el in c.description ]
+            if self.low is None:
+                query = 'SELECT MAX(change_id) FROM summary_changes WHERE %s'
+                c.execute(query % old)
+            else:
+                query = """SELECT MAX(change_id) 
+                             FROM summary_changes 
+                            WHERE change_id > :low 
+                              AND %s""" % old
+                c.execute(query, {'low': self.low})
+            low = c.fetchone()[0]
+            # the first poll drops everything, so it only needs the 
+            # changes above the new mark
+            if self.last_poll is None:
+                start = low
+            else:
+                start = self.low
+            if start is None:
+                c.execute("SELECT change_id, image_file FROM summary_changes")
+            else:
+                query = """SELECT change_id, image_file 
+                             FROM summary_changes 
+                            WHERE change_id > :low"""
+                c.execute(query, {'low': start})
             rows = c.fetchall()
-        return (cols, rows)
+        changed_files = set()
+        for (change_id, image_file) in rows:
+            if change_id not in self.seen:
+                self.seen.add(change_id)
+                changed_files.add(image_file)
+        if low is not None:
+            self.low = low
+            self.seen = set([ i for i in self.seen if i > low ])
+        with self.lock:
+            if self.last_poll is None:
+                self.entries.clear()
+            else:
+                for image_file in changed_files:
+                    self.entries.pop(image_file, None)
+            self.generation += 1
+        return
 
-db_dsn = cx_Oracle.makedsn(os.environ['DB_HOST'], 
-                           1521, 
-                           os.environ['DB_SERVICE'])
+# thumbnails are cached in memory and, if THUMBNAIL_CACHE_DIR is set, on 
+# disk (see thumbnail_cache.py); browsers may reuse them for 
+# thumbnail_max_age seconds before revalidating
+thumbnail_max_age = 3600
 
-app = flask.Flask(__name__)
+def s3_connect():
+    cf = boto.s3.connection.OrdinaryCallingFormat()
+    s3 = boto.s3.connection.S3Connection(os.environ['AWS_ACCESS_KEY_ID'], 
+                                         os.environ['AWS_SECRET_ACCESS_KEY'], 
+                                         calling_format=cf)
+    return s3
+
+class Dashboard:
+
+    """the state of a dashboard application: the summary cache, the 
+    volume cache, the thumbnail server, and the thumbnail inventory (or 
+    None)"""
+
+    def __init__(self, 
+                 summary_cache, 
+                 volume_cache, 
+                 thumbnail_server, 
+                 thumbnails):
+        self.summary_cache = summary_cache
+        self.volume_cache = volume_cache
+        self.thumbnail_server = thumbnail_server
+        self.thumbnails = thumbnails
+        return
+
+def create_app(config=None, pool=None, dialect='oracle', connect=s3_connect):
+
+    """return a dashboard application
+
+    settings are taken from config (a dictionary), then the environment: 
+    SUMMARY_TTL, VOLUME_CACHE_SIZE, VOLUME_CACHE_TTL, THUMBNAIL_MANIFEST 
+    (thumbnails that aren't in the manifest (see thumbnail_inventory.py) 
+    get a 404 without going to S3), THUMBNAIL_CACHE_DIR, and 
+    THUMBNAIL_CACHE_MB
+
+    pool and dialect are passed to set_pool() if pool is given; connect() 
+    returns a new S3 connection.  nothing connects to the database or S3 
+    until the first request, so this can be called before a server 
+    forks its workers.
+    """
+
+    if config is None:
+        config = {}
+    def setting(name, default=None):
+        return config.get(name, os.environ.get(name, default))
+
+    if pool is not None:
+        set_pool(pool, dialect)
+
+    app = flask.Flask(__name__)
+    app.register_blueprint(views)
+
+    manifest = setting('THUMBNAIL_MANIFEST')
+    if manifest:
+        thumbnails = thumbnail_inventory.Inventory(manifest)
+    else:
+        thumbnails = None
+    cache_dir = setting('THUMBNAIL_CACHE_DIR')
+    cache_size = int(setting('THUMBNAIL_CACHE_MB', 1024)) * 1024 * 1024
+    thumbnail_server = thumbnail_cache.ThumbnailCache(connect, 
+                                                      disk_dir=cache_dir, 
+                                                      disk_size=cache_size)
+    summary_ttl = float(setting('SUMMARY_TTL', default_summary_ttl))
+    volume_cache_size = int(setting('VOLUME_CACHE_SIZE', 
+                                    default_volume_cache_size))
+    volume_cache_ttl = float(setting('VOLUME_CACHE_TTL', 
+                                     default_volume_cache_ttl))
+    volume_cache = VolumeCache(volume_cache_size, volume_cache_ttl)
+    app.extensions['ndar_dashboard'] = Dashboard(SummaryCache(summary_ttl), 
+                                                 volume_cache, 
+                                                 thumbnail_server, 
+                                                 thumbnails)
+
+    return app
 
-#import time
-#t0 = time.time()
-#summary = Summary()
-#print time.time() - t0
+def _state():
+    return flask.current_app.extensions['ndar_dashboard']
 
-@app.route('/')
+views = flask.Blueprint('dashboard', __name__)
+
+@views.route('/')
 def index():
+    summary = _state().summary_cache.get(summary_wait)
+    if summary is None:
+        flask.abort(503)
     return flask.render_template('index.tmpl', summary=summary)
 
-@app.route('/time_series')
+@views.route('/metrics')
+def metrics():
+    state = _state()
+    lines = []
+    for (name, metric_type, help, value) in state.summary_cache.metrics():
+        if value is None:
+            continue
+        name = 'ndar_dashboard_' + name
+        lines.append('# HELP %s %s' % (name, help))
+        lines.append('# TYPE %s %s' % (name, metric_type))
+        lines.append('%s %s' % (name, repr(float(value))))
+    stats = state.thumbnail_server.stats()
+    name = 'ndar_dashboard_thumbnail_lookups_total'
+    lines.append('# HELP %s thumbnail lookups by source' % name)
+    lines.append('# TYPE %s counter' % name)
+    for source in ('memory', 'disk', 'revalidated', 's3'):
+        lines.append('%s{source="%s"} %d' % (name, source, stats[source]))
+    counts = state.volume_cache.counts
+    name = 'ndar_dashboard_volume_lookups_total'
+    lines.append('# HELP %s volume lookups by source' % name)
+    lines.append('# TYPE %s counter' % name)
+    for source in ('cache', 'db'):
+        lines.append('%s{source="%s"} %d' % (name, source, counts[source]))
+    return flask.Response('\n'.join(lines) + '\n', 
+                          status=200, 
+                          mimetype='text/plain')
+
+@views.route('/time_series')
 def time_series():
-    success = []
-    error = []
-    with DB() as c:
-        query = """SELECT *
-                     FROM summary 
-                    WHERE scan_type = 'fMRI' 
-                    ORDER BY image_file"""
-        c.execute(query)
-        cols = [ el[0].lower() for el in c.description ]
-        for row in c:
-            d = dict(zip(cols, row))
-            if d['has_time_series_qa']:
-                success.append(d)
-            else:
-                error.append(d)
+    return flask.redirect(flask.url_for('.bucket', kind='type', name='fMRI'))
+
+@views.route('/<any(modality, class, type):kind>/<name>')
+def bucket(kind, name):
+    args = flask.request.args
+    status = args.get('status', 'all')
+    try:
+        n = int(args.get('n', default_page_size))
+    except ValueError:
+        flask.abort(400)
+    n = max(1, min(n, max_page_size))
+    after = args.get('after')
+    try:
+        bucket = Bucket(kind, name, status)
+    except KeyError:
+        flask.abort(404)
+    except ValueError:
+        flask.abort(400)
+    summary = _state().summary_cache.get(summary_wait)
+    if summary is None:
+        flask.abort(503)
+    counts = summary.counts(kind, name)
+    (rows, last) = bucket.page(after, n)
+    if last is None:
+        next_url = None
+    else:
+        next_url = flask.url_for('.bucket', 
+                                 kind=kind, 
+                                 name=name, 
+                                 status=status, 
+                                 n=n, 
+                                 after=last, 
+                                 format=args.get('format'))
+    if args.get('format') == 'json':
+        return flask.jsonify(kind=kind, 
+                             name=name, 
+                             status=status, 
+                             counts=counts, 
+                             rows=rows, 
+                             after=last, 
+                             next=next_url)
     return flask.render_template('summary.tmpl', 
-                                 title='fMRI', 
-                                 success=success, 
-                                 error=error)
-    return
+                                 title=name, 
+                                 kind=kind, 
+                                 name=name, 
+                                 status=status, 
+                                 counts=counts, 
+                                 rows=rows, 
+                                 next_url=next_url)
 
-@app.route('/volume/<path:spec>')
+@views.route('/volume/<path:spec>')
 def volume(spec):
     try:
-        volume = Volume(spec)
+        volume = _state().volume_cache.get(spec)
     except KeyError:
         flask.abort(404)
     return flask.render_template('volume.tmpl', volume=volume)
 
-@app.route('/thumbnail/<path:spec>')
+@views.route('/thumbnail/<path:spec>')
 def thumbnail(spec):
     if not spec.startswith('s3://'):
         flask.abort(404)
     bucket_name = spec[5:].split('/')[0]
     key = spec[5+len(bucket_name)+1:]
-    cf = boto.s3.connection.OrdinaryCallingFormat()
-    s3 = boto.s3.connection.S3Connection(os.environ['AWS_ACCESS_KEY_ID'], 
-                                         os.environ['AWS_SECRET_ACCESS_KEY'], 
-                                         calling_format=cf)
-    bucket = s3.get_bucket(bucket_name)
-    k = bucket.get_key(key)
-    if k is None:
+    state = _state()
+    thumbnails = state.thumbnails
+    if thumbnails is not None and bucket_name == thumbnails.bucket:
+        if key.startswith(thumbnails.prefix):
+            thumbnails.reload_if_changed()
+            if key[len(thumbnails.prefix):] not in thumbnails:
+                flask.abort(404)
+    thumb = state.thumbnail_server.lookup(bucket_name, key)
+    if thumb is None:
         flask.abort(404)
-    resp = flask.Response(k.get_contents_as_string(), 
+    headers = {'ETag': '"%s"' % thumb.etag, 
+               'Cache-Control': 'max-age=%d' % thumbnail_max_age}
+    if thumb.etag in flask.request.if_none_match:
+        # a thumbnail that wasn't cached is already being read from S3; 
+        # finish reading it, which caches it and frees the connection
+        for data in thumb.chunks():
+            pass
+        return flask.Response(status=304, headers=headers)
+    headers['Content-Length'] = str(thumb.size)
+    resp = flask.Response(thumb.chunks(), 
                           status=200, 
-                          mimetype='image/png')
+                          mimetype='image/png', 
+                          headers=headers)
     return resp
 
-print 'ready'
-
-app.run(debug=True)
+# the development server; see serve_dashboard for production
+if __name__ == '__main__':
+    print 'ready'
+    create_app().run(debug=True, threaded=True)
 
 # eof
@@ -0,0 +1,49 @@
+"""running the dashboard under gunicorn
+
+each worker process builds its own application (and so its own Oracle 
+session pool, summary cache, and thumbnail cache) after it is forked; 
+with more than one thread, workers use the gthread worker class (which 
+needs the futures package under Python 2)
+
+see serve_dashboard and load_test_dashboard
+"""
+
+import gunicorn.app.base
+
+class Application(gunicorn.app.base.BaseApplication):
+
+    """a gunicorn application that calls factory() in each worker to 
+    build the WSGI application (by default, dashboard.create_app())"""
+
+    def __init__(self, options, factory=None):
+        self.options = options
+        self.factory = factory
+        gunicorn.app.base.BaseApplication.__init__(self)
+        return
+
+    def load_config(self):
+        for (name, value) in self.options.iteritems():
+            if value is not None:
+                self.cfg.set(name, value)
+        return
+
+    def load(self):
+        if self.factory is not None:
+            return self.factory()
+        import dashboard
+        return dashboard.create_app()
+
+def options(bind, workers, threads, timeout=120, access_log=None):
+    """return the gunicorn settings for Application"""
+    if threads > 1:
+        worker_class = 'gthread'
+    else:
+        worker_class = 'sync'
+    return {'bind': bind, 
+            'workers': workers, 
+            'threads': threads, 
+            'worker_class': worker_class, 
+            'timeout': timeout, 
+            'accesslog': access_log}
+
+# eof
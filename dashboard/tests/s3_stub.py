@@ -0,0 +1,105 @@
+"""an in-process stand-in for a boto S3 connection
+
+S3(objects) serves objects ({(bucket, key): data}); the ETag of an 
+object is the MD5 of its data.  requests is a list of (method, bucket, 
+key) shared by all the connections made from the same objects, so 
+tests can count HEADs (get_key()), GETs (open_read()), and LISTs 
+(list(), with the marker as the key).
+"""
+
+import hashlib
+import boto.exception
+
+last_modified = '2016-01-01T00:00:00.000Z'
+
+class Key:
+
+    def __init__(self, s3, bucket_name, name):
+        self.s3 = s3
+        self.bucket_name = bucket_name
+        self.name = name
+        self.key = name
+        self.etag = None
+        self.size = None
+        self.last_modified = None
+        self.data = None
+        return
+
+    def _set(self, data):
+        self.etag = '"%s"' % hashlib.md5(data).hexdigest()
+        self.size = len(data)
+        return
+
+    def open_read(self):
+        if self.data is not None:
+            return
+        self.s3.requests.append(('GET', self.bucket_name, self.name))
+        data = self.s3.objects.get((self.bucket_name, self.name))
+        if data is None:
+            raise boto.exception.S3ResponseError(404, 'Not Found')
+        self._set(data)
+        self.data = data
+        return
+
+    def read(self, size=None):
+        self.open_read()
+        if size is None:
+            size = len(self.data)
+        (data, self.data) = (self.data[:size], self.data[size:])
+        return data
+
+    def close(self):
+        return
+
+class Bucket:
+
+    def __init__(self, s3, name):
+        self.s3 = s3
+        self.name = name
+        return
+
+    def get_key(self, name):
+        self.s3.requests.append(('HEAD', self.name, name))
+        data = self.s3.objects.get((self.name, name))
+        if data is None:
+            return None
+        key = Key(self.s3, self.name, name)
+        key._set(data)
+        return key
+
+    def new_key(self, name):
+        return Key(self.s3, self.name, name)
+
+    def list(self, prefix='', marker=''):
+        """generate the keys after marker in order, as a listing does"""
+        self.s3.requests.append(('LIST', self.name, marker))
+        names = [ name for (bucket_name, name) in self.s3.objects 
+                  if bucket_name == self.name 
+                  and name.startswith(prefix) 
+                  and name > marker ]
+        for name in sorted(names):
+            key = Key(self.s3, self.name, name)
+            key._set(self.s3.objects[(self.name, name)])
+            key.last_modified = last_modified
+            yield key
+        return
+
+class S3:
+
+    def __init__(self, objects, requests):
+        self.objects = objects
+        self.requests = requests
+        self.closed = False
+        return
+
+    def get_bucket(self, name, validate=True):
+        return Bucket(self, name)
+
+    def close(self):
+        self.closed = True
+        return
+
+def etag(data):
+    return hashlib.md5(data).hexdigest()
+
+# eof
@@ -0,0 +1,60 @@
+"""a SQLite summary table for the Summary and Bucket tests
+
+the rows cover every bucket: MR and other modalities, multiple image03 
+rows, NULL scan types, scan types with and without their own bucket, and 
+every combination of checks
+"""
+
+import random
+import sqlite3
+import dashboard
+
+scan_types = dashboard.known_types + ('MR localizer', None)
+
+def create(fname, n_rows=500):
+    """create the summary table in fname and return its rows (as 
+    dictionaries)"""
+    rnd = random.Random(0)
+    rows = []
+    for i in xrange(n_rows):
+        row = {'image_file': 's3://bucket/%05d.zip' % rnd.randrange(100000), 
+               'n_image03': 1, 
+               'image03_id': i, 
+               'subjectkey': 'NDAR_INV%05d' % i, 
+               'interview_age': 120, 
+               'image_modality': rnd.choice(('MR', 'MR', 'MR', 'PET', None)), 
+               'scan_type': rnd.choice(scan_types)}
+        for col in ('has_basic_check', 
+                    'has_thumbnail', 
+                    'has_derived_image03', 
+                    'has_structural_qa', 
+                    'has_time_series_qa'):
+            row[col] = int(rnd.random() < 0.8)
+        if rnd.random() < 0.05:
+            # as create_summary stores an image file with several 
+            # image03 rows
+            for col in row:
+                if col != 'image_file':
+                    row[col] = None
+            row['n_image03'] = 2
+        rows.append(row)
+    # image files are unique
+    rows = dict([ (row['image_file'], row) for row in rows ]).values()
+    cols = rows[0].keys()
+    db = sqlite3.connect(fname)
+    db.execute('CREATE TABLE summary (%s)' % ', '.join(cols))
+    db.execute('CREATE UNIQUE INDEX summary_file ON summary (image_file)')
+    query = 'INSERT INTO summary (%s) VALUES (%s)' % \
+            (', '.join(cols), ', '.join([ ':%s' % col for col in cols ]))
+    db.executemany(query, rows)
+    db.commit()
+    db.close()
+    return rows
+
+def use(fname):
+    """make the dashboard use the database in fname"""
+    connect = lambda: sqlite3.connect(fname, check_same_thread=False)
+    dashboard.set_pool(dashboard.ConnectionPool(connect), 'sqlite')
+    return
+
+# eof
@@ -0,0 +1,118 @@
+import os
+import json
+import tempfile
+import shutil
+import nose.tools
+import dashboard
+import summary_db
+
+def setup():
+    global tempdir, rows, app
+    tempdir = tempfile.mkdtemp()
+    db_fname = os.path.join(tempdir, 'summary.db')
+    rows = summary_db.create(db_fname)
+    connect = lambda: None
+    app = dashboard.create_app({'THUMBNAIL_MANIFEST': None, 
+                                'THUMBNAIL_CACHE_DIR': None}, 
+                               connect=connect)
+    summary_db.use(db_fname)
+    return
+
+def teardown():
+    dashboard.set_pool(None)
+    shutil.rmtree(tempdir)
+    return
+
+def mr_files():
+    return sorted([ row['image_file'] for row in rows
+                    if row['n_image03'] == 1
+                    and row['image_modality'] == 'MR' ])
+
+def test_pages():
+    """pages are in image_file order and neither overlap nor skip rows"""
+    bucket = dashboard.Bucket('modality', 'MR')
+    files = mr_files()
+    for n in (1, 10, len(files) - 1, len(files), len(files) + 1):
+        pages = []
+        after = None
+        while True:
+            (page, after) = bucket.page(after, n)
+            pages.append([ row['image_file'] for row in page ])
+            if after is None:
+                break
+            nose.tools.assert_equal(after, pages[-1][-1])
+        nose.tools.assert_equal(sum(pages, []), files)
+        nose.tools.assert_true(all([ len(p) == n for p in pages[:-1] ]))
+        # no empty last page when the rows divide evenly
+        nose.tools.assert_true(0 < len(pages[-1]) <= n)
+    return
+
+def test_after():
+    bucket = dashboard.Bucket('modality', 'MR')
+    files = mr_files()
+    (page, after) = bucket.page(files[4], 3)
+    nose.tools.assert_equal([ row['image_file'] for row in page ], files[5:8])
+    nose.tools.assert_equal(after, files[7])
+    # an image file that isn't in the bucket works as well
+    (page, after) = bucket.page(files[4] + '0', 3)
+    nose.tools.assert_equal(page[0]['image_file'], files[5])
+    nose.tools.assert_equal(bucket.page(files[-1], 3), ([], None))
+    return
+
+def test_rows():
+    bucket = dashboard.Bucket('type', 'fMRI', 'error')
+    (page, after) = bucket.page(None, 1000)
+    nose.tools.assert_true(page)
+    for row in page:
+        nose.tools.assert_equal(sorted(row.keys()), 
+                                sorted(dashboard.page_cols))
+        nose.tools.assert_equal(row['scan_type'], 'fMRI')
+        nose.tools.assert_false(row['has_basic_check'] and
+                                row['has_thumbnail'] and
+                                row['has_derived_image03'] and
+                                row['has_time_series_qa'])
+    return
+
+def test_bad_buckets():
+    nose.tools.assert_raises(KeyError, dashboard.Bucket, 'type', 'none')
+    nose.tools.assert_raises(KeyError, dashboard.Bucket, 'kind', 'MR')
+    nose.tools.assert_raises(ValueError, 
+                             dashboard.Bucket, 
+                             'modality', 
+                             'MR', 
+                             'bogus')
+    return
+
+def test_json():
+    """the JSON pages, following the next links"""
+    client = app.test_client()
+    url = '/modality/MR?status=all&n=50&format=json'
+    files = []
+    while url:
+        resp = client.get(url)
+        nose.tools.assert_equal(resp.status_code, 200)
+        data = json.loads(resp.data)
+        nose.tools.assert_equal(data['counts']['total'], len(mr_files()))
+        files.extend([ row['image_file'] for row in data['rows'] ])
+        url = data['next']
+    nose.tools.assert_equal(files, mr_files())
+    return
+
+def test_views():
+    client = app.test_client()
+    nose.tools.assert_equal(client.get('/class/Structural').status_code, 200)
+    nose.tools.assert_equal(client.get('/type/none').status_code, 404)
+    resp = client.get('/modality/MR?status=bogus')
+    nose.tools.assert_equal(resp.status_code, 400)
+    nose.tools.assert_equal(client.get('/modality/MR?n=x').status_code, 400)
+    # n is limited to max_page_size
+    max_page_size = dashboard.max_page_size
+    dashboard.max_page_size = 5
+    try:
+        resp = client.get('/modality/MR?n=100000&format=json')
+    finally:
+        dashboard.max_page_size = max_page_size
+    nose.tools.assert_equal(len(json.loads(resp.data)['rows']), 5)
+    return
+
+# eof
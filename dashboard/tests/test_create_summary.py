@@ -0,0 +1,400 @@
+import os
+import sys
+import imp
+import sqlite3
+import nose.tools
+
+# create_summary is a script, not a module
+sys.dont_write_bytecode = True
+script = os.path.join(os.path.dirname(__file__), '..', 'create_summary')
+create_summary = imp.load_source('create_summary', script)
+
+old = '2000-01-01 00:00:00'
+
+class Key:
+
+    def __init__(self, key):
+        self.key = key
+        return
+
+class Bucket:
+
+    """the thumbnails in a bucket, as read_thumbnails() uses them"""
+
+    def __init__(self, keys):
+        self.keys = set(keys)
+        return
+
+    def get_key(self, key):
+        if key in self.keys:
+            return Key(key)
+        return None
+
+    def list(self, prefix=''):
+        return [ Key(k) for k in sorted(self.keys) if k.startswith(prefix) ]
+
+def setup():
+    create_summary.db_dialect = 'sqlite'
+    return
+
+def teardown():
+    create_summary.db_dialect = 'oracle'
+    return
+
+def create_tables():
+    db = sqlite3.connect(':memory:')
+    db.execute("""CREATE TABLE image03 (image_file VARCHAR, 
+                                        image03_id INTEGER, 
+                                        subjectkey VARCHAR, 
+                                        interview_age INTEGER, 
+                                        image_modality VARCHAR, 
+                                        scan_type VARCHAR)""")
+    db.execute("""CREATE TABLE imaging_qa01 (file_source VARCHAR, 
+                                             external_min FLOAT, 
+                                             input_pot_clipped_voxels FLOAT)
+               """)
+    db.execute('CREATE TABLE basic_check (image_file VARCHAR)')
+    db.execute('CREATE TABLE image03_derived (image_file VARCHAR)')
+    db.execute('CREATE TABLE summary (%s)' % \
+               ', '.join(create_summary.summary_cols))
+    db.execute('CREATE UNIQUE INDEX summary_file ON summary (image_file)')
+    db.execute("""CREATE TABLE summary_changes (change_id INTEGER 
+                                                          PRIMARY KEY 
+                                                          AUTOINCREMENT, 
+                                                image_file VARCHAR, 
+                                                changed TIMESTAMP 
+                                                        DEFAULT 
+                                                        CURRENT_TIMESTAMP)
+               """)
+    db.execute('CREATE TABLE summary_state (change_id INTEGER)')
+    return db
+
+def create_db():
+    db = create_tables()
+    rows = [('A', 1, 'NDAR_INV1', 120, 'MR', 'MR structural (T1)'), 
+            ('B', 2, 'NDAR_INV2', 130, 'MR', 'fMRI'), 
+            ('C', 3, 'NDAR_INV3', 140, 'MR', 'MR structural (T2)'), 
+            ('C', 4, 'NDAR_INV3', 140, 'MR', 'MR structural (T2)')]
+    db.executemany('INSERT INTO image03 VALUES (?, ?, ?, ?, ?, ?)', rows)
+    db.executemany('INSERT INTO imaging_qa01 VALUES (?, ?, ?)', 
+                   [('B', None, 5.0)])
+    db.executemany('INSERT INTO basic_check VALUES (?)', [('A', ), ('B', )])
+    db.commit()
+    return db
+
+def synthetic_db(n):
+    """return a database of create_summary.synthetic_tables(n) and the 
+    thumbnails"""
+    (image03, qa, basic_check, image03_derived, thumbnails) = \
+        create_summary.synthetic_tables(n)
+    db = create_tables()
+    for (image_file, rows) in image03.iteritems():
+        for row in rows:
+            db.execute('INSERT INTO image03 VALUES (?, ?, ?, ?, ?, ?)', 
+                       (image_file, 
+                        row['IMAGE03_ID'], 
+                        row['SUBJECTKEY'], 
+                        row['INTERVIEW_AGE'], 
+                        row['IMAGE_MODALITY'], 
+                        row['SCAN_TYPE']))
+    for (image_file, d) in qa.iteritems():
+        db.execute('INSERT INTO imaging_qa01 VALUES (?, ?, ?)', 
+                   (image_file, 
+                    d['has_structural_qa'] or None, 
+                    d['has_time_series_qa'] or None))
+    for image_file in basic_check:
+        db.execute('INSERT INTO basic_check VALUES (?)', (image_file, ))
+    for image_file in image03_derived:
+        db.execute('INSERT INTO image03_derived VALUES (?)', (image_file, ))
+    db.commit()
+    return (db, thumbnails)
+
+def list_summary(c, thumbnails):
+    """build the summary rows with the original create_summary's list 
+    lookups, as the reference for build_summary()"""
+    image03 = {}
+    c.execute("""SELECT image_file, 
+                        image03_id, 
+                        subjectkey, 
+                        interview_age, 
+                        image_modality, 
+                        scan_type 
+                   FROM image03""")
+    cols = [ el[0].upper() for el in c.description ]
+    for row in c:
+        row_dict = dict(zip(cols, row))
+        image03.setdefault(row_dict['IMAGE_FILE'], []).append(row_dict)
+    qa = {}
+    c.execute("""SELECT file_source, external_min, input_pot_clipped_voxels 
+                   FROM imaging_qa01""")
+    for (file_source, external_min, input_pot_clipped_voxels) in c:
+        d = {'has_structural_qa': 0, 
+             'has_time_series_qa': 0}
+        if external_min is not None:
+            d['has_structural_qa'] = 1
+        if input_pot_clipped_voxels is not None:
+            d['has_time_series_qa'] = 1
+        qa[file_source] = d
+    c.execute('SELECT image_file FROM basic_check')
+    basic_check = [ row[0] for row in c ]
+    c.execute('SELECT image_file FROM image03_derived')
+    image03_derived = [ row[0] for row in c ]
+    thumbnails = list(thumbnails)
+    all_params = []
+    for image_file in image03:
+        query_params = {'image_file': image_file, 
+                        'image03_id': None, 
+                        'subjectkey': None, 
+                        'interview_age': None, 
+                        'image_modality': None, 
+                        'scan_type': None, 
+                        'has_basic_check': None, 
+                        'has_thumbnail': None, 
+                        'has_derived_image03': None, 
+                        'has_structural_qa': None, 
+                        'has_time_series_qa': None}
+        query_params['n_image03'] = len(image03[image_file])
+        if len(image03[image_file]) > 1:
+            all_params.append(query_params)
+            continue
+        i03 = image03[image_file][0]
+        query_params['image03_id'] = i03['IMAGE03_ID']
+        query_params['subjectkey'] = i03['SUBJECTKEY']
+        query_params['interview_age'] = i03['INTERVIEW_AGE']
+        query_params['image_modality'] = i03['IMAGE_MODALITY']
+        query_params['scan_type'] = i03['SCAN_TYPE']
+        if image_file in basic_check:
+            query_params['has_basic_check'] = 1
+        else:
+            query_params['has_basic_check'] = 0
+        t = (i03['SUBJECTKEY'], i03['INTERVIEW_AGE'], i03['IMAGE03_ID'])
+        if t in thumbnails:
+            query_params['has_thumbnail'] = 1
+        else:
+            query_params['has_thumbnail'] = 0
+        if image_file in image03_derived:
+            query_params['has_derived_image03'] = 1
+        else:
+            query_params['has_derived_image03'] = 0
+        if image_file in qa:
+            file_qa = qa[image_file]
+            query_params['has_structural_qa'] = file_qa['has_structural_qa']
+            query_params['has_time_series_qa'] = file_qa['has_time_series_qa']
+        else:
+            query_params['has_structural_qa'] = 0
+            query_params['has_time_series_qa'] = 0
+        all_params.append(query_params)
+    return all_params
+
+def add_changes(db, image_files, changed=old):
+    for image_file in image_files:
+        db.execute("""INSERT INTO summary_changes (image_file, changed) 
+                      VALUES (?, ?)""", 
+                   (image_file, changed))
+    db.commit()
+    return
+
+def add_recent_change(db, image_file):
+    db.execute('INSERT INTO summary_changes (image_file) VALUES (?)', 
+               (image_file, ))
+    db.commit()
+    return
+
+bucket = Bucket(['thumbnails/NDAR_INV1-120-1.png', 
+                 'thumbnails/NDAR_INV4-150-5.png'])
+
+def get_thumbnails(image03):
+    return create_summary.read_thumbnails(bucket, image03)
+
+def rebuild(db):
+    """load the summary as create_summary does without --incremental"""
+    c = db.cursor()
+    high = create_summary.lagged_watermark(c, None)
+    all_params = create_summary.summary_rows(c, get_thumbnails)[1]
+    create_summary.load_summary(c, create_summary.insert_query, all_params)
+    if high is not None:
+        create_summary.write_watermark(c, high)
+    db.commit()
+    return
+
+def incremental(db):
+    """update the summary as create_summary --incremental does, 
+    returning the image files recomputed"""
+    c = db.cursor()
+    low = create_summary.read_watermark(c)
+    high = create_summary.lagged_watermark(c, low)
+    image_files = create_summary.changed_image_files(c, low)[0]
+    if image_files:
+        create_summary.update_summary(c, image_files, get_thumbnails)
+    if high is not None:
+        create_summary.write_watermark(c, high)
+    db.commit()
+    return image_files
+
+def summary(db):
+    """return the summary rows as a dictionary"""
+    cols = create_summary.summary_cols
+    c = db.cursor()
+    c.execute('SELECT %s FROM summary' % ', '.join(cols))
+    rows = [ dict(zip(cols, row)) for row in c ]
+    return dict([ (row['image_file'], row) for row in rows ])
+
+def expected_summary(db):
+    """return the summary rows a rebuild would give"""
+    all_params = create_summary.summary_rows(db.cursor(), get_thumbnails)[1]
+    return dict([ (params['image_file'], params) for params in all_params ])
+
+def test_watermark():
+    db = create_db()
+    c = db.cursor()
+    nose.tools.assert_equal(create_summary.read_watermark(c), None)
+    nose.tools.assert_equal(create_summary.lagged_watermark(c, None), None)
+    add_changes(db, ['A', 'B'])
+    # younger than change_retention but older than change_lag
+    db.execute("""INSERT INTO summary_changes (image_file, changed) 
+                  VALUES ('C', DATETIME('now', '-1 day'))""")
+    # might not have committed yet
+    add_recent_change(db, 'A')
+    nose.tools.assert_equal(create_summary.lagged_watermark(c, None), 3)
+    nose.tools.assert_equal(create_summary.lagged_watermark(c, 1), 3)
+    nose.tools.assert_equal(create_summary.lagged_watermark(c, 3), None)
+    create_summary.write_watermark(c, 2)
+    create_summary.write_watermark(c, 3)
+    c.execute('SELECT change_id FROM summary_state')
+    nose.tools.assert_equal(c.fetchall(), [(3, )])
+    nose.tools.assert_equal(create_summary.read_watermark(c), 3)
+    # the old changes behind the watermark are gone
+    c.execute('SELECT change_id FROM summary_changes ORDER BY change_id')
+    nose.tools.assert_equal(c.fetchall(), [(3, ), (4, )])
+    return
+
+def test_changed_image_files():
+    db = create_db()
+    c = db.cursor()
+    # everything is new
+    nose.tools.assert_equal(create_summary.changed_image_files(c, None), 
+                            (set(['A', 'B', 'C']), 0, 3))
+    rebuild(db)
+    nose.tools.assert_equal(create_summary.changed_image_files(c, None), 
+                            (set(), 0, 0))
+    add_changes(db, ['A', 'B', 'A'])
+    db.execute("""INSERT INTO image03 
+                  VALUES ('D', 5, 'NDAR_INV4', 150, 'MR', 'fMRI')""")
+    nose.tools.assert_equal(create_summary.changed_image_files(c, None), 
+                            (set(['A', 'B', 'D']), 3, 1))
+    nose.tools.assert_equal(create_summary.changed_image_files(c, 2), 
+                            (set(['A', 'D']), 1, 1))
+    return
+
+def test_rebuild():
+    db = create_db()
+    rebuild(db)
+    rows = summary(db)
+    nose.tools.assert_equal(sorted(rows), ['A', 'B', 'C'])
+    nose.tools.assert_equal(rows['A']['has_thumbnail'], 1)
+    nose.tools.assert_equal(rows['A']['has_basic_check'], 1)
+    nose.tools.assert_equal(rows['A']['has_structural_qa'], 0)
+    nose.tools.assert_equal(rows['B']['has_thumbnail'], 0)
+    nose.tools.assert_equal(rows['B']['has_time_series_qa'], 1)
+    nose.tools.assert_equal(rows['C']['n_image03'], 2)
+    nose.tools.assert_equal(rows['C']['image03_id'], None)
+    return
+
+def test_incremental():
+    """the MERGE path (as an SQLite upsert): changed image files are 
+    recomputed, new ones added, and removed ones deleted"""
+    db = create_db()
+    rebuild(db)
+    db.execute("INSERT INTO imaging_qa01 VALUES ('A', 1.0, NULL)")
+    db.execute("DELETE FROM image03 WHERE image_file = 'B'")
+    db.execute("""INSERT INTO image03 
+                  VALUES ('D', 5, 'NDAR_INV4', 150, 'MR', 'fMRI')""")
+    db.execute("DELETE FROM image03 WHERE image03_id = 4")
+    db.commit()
+    add_changes(db, ['A', 'B', 'C'])
+    nose.tools.assert_equal(incremental(db), set(['A', 'B', 'C', 'D']))
+    rows = summary(db)
+    nose.tools.assert_equal(rows, expected_summary(db))
+    nose.tools.assert_equal(sorted(rows), ['A', 'C', 'D'])
+    nose.tools.assert_equal(rows['A']['has_structural_qa'], 1)
+    nose.tools.assert_equal(rows['C']['n_image03'], 1)
+    nose.tools.assert_equal(rows['C']['image03_id'], 3)
+    nose.tools.assert_equal(rows['D']['has_thumbnail'], 1)
+    # the watermark moved past the changes, which were old enough to 
+    # delete
+    c = db.cursor()
+    nose.tools.assert_equal(create_summary.read_watermark(c), 3)
+    c.execute('SELECT COUNT(*) FROM summary_changes')
+    nose.tools.assert_equal(c.fetchone()[0], 0)
+    nose.tools.assert_equal(incremental(db), set())
+    return
+
+def test_incremental_lag():
+    """a change that might not have committed is recomputed until the 
+    watermark can move past it"""
+    db = create_db()
+    rebuild(db)
+    add_changes(db, ['A'])
+    add_recent_change(db, 'B')
+    add_recent_change(db, 'C')
+    nose.tools.assert_equal(incremental(db), set(['A', 'B', 'C']))
+    c = db.cursor()
+    nose.tools.assert_equal(create_summary.read_watermark(c), 1)
+    # the later changes are picked up again, and are idempotent
+    nose.tools.assert_equal(incremental(db), set(['B', 'C']))
+    nose.tools.assert_equal(create_summary.read_watermark(c), 1)
+    nose.tools.assert_equal(summary(db), expected_summary(db))
+    db.execute("UPDATE summary_changes SET changed = ?", (old, ))
+    db.commit()
+    nose.tools.assert_equal(incremental(db), set(['B', 'C']))
+    nose.tools.assert_equal(create_summary.read_watermark(c), 3)
+    nose.tools.assert_equal(incremental(db), set())
+    return
+
+def test_build_summary():
+    """the hashed joins give the rows the list lookups did"""
+    (db, thumbnails) = synthetic_db(2000)
+    c = db.cursor()
+    get_thumbnails = lambda image03: thumbnails
+    all_params = create_summary.summary_rows(c, get_thumbnails)[1]
+    key = lambda params: params['image_file']
+    expected = sorted(list_summary(c, thumbnails), key=key)
+    nose.tools.assert_equal(sorted(all_params, key=key), expected)
+    # every kind of row is covered
+    multiples = [ p for p in expected if p['n_image03'] > 1 ]
+    nose.tools.assert_true(len(multiples) > 0)
+    singles = [ p for p in expected if p['n_image03'] == 1 ]
+    for col in ('has_basic_check', 
+                'has_thumbnail', 
+                'has_derived_image03', 
+                'has_structural_qa'):
+        values = set([ p[col] for p in singles ])
+        nose.tools.assert_equal(values, set([0, 1]), col)
+    return
+
+def test_build_summary_tables():
+    """build_summary() on the synthetic tables directly, as --benchmark 
+    runs it"""
+    tables = create_summary.synthetic_tables(1000)
+    (image03, qa, basic_check, image03_derived, thumbnails) = tables
+    all_params = create_summary.build_summary(*tables)
+    nose.tools.assert_equal(len(all_params), len(image03))
+    for params in all_params:
+        image_file = params['image_file']
+        rows = image03[image_file]
+        nose.tools.assert_equal(params['n_image03'], len(rows))
+        if len(rows) > 1:
+            nose.tools.assert_equal(params['has_basic_check'], None)
+            continue
+        t = (rows[0]['SUBJECTKEY'], 
+             rows[0]['INTERVIEW_AGE'], 
+             rows[0]['IMAGE03_ID'])
+        nose.tools.assert_equal(params['has_thumbnail'], 
+                                int(t in thumbnails))
+        nose.tools.assert_equal(params['has_basic_check'], 
+                                int(image_file in basic_check))
+        nose.tools.assert_equal(params['has_derived_image03'], 
+                                int(image_file in image03_derived))
+    return
+
+# eof
@@ -0,0 +1,144 @@
+import os
+import tempfile
+import shutil
+import sqlite3
+import nose.tools
+import dashboard
+import summary_db
+
+statuses = {'all': 'total', 'okay': 'okay', 'error': 'error'}
+
+def setup():
+    global tempdir, db_fname, rows
+    tempdir = tempfile.mkdtemp()
+    db_fname = os.path.join(tempdir, 'summary.db')
+    rows = summary_db.create(db_fname)
+    summary_db.use(db_fname)
+    return
+
+def teardown():
+    dashboard.set_pool(None)
+    shutil.rmtree(tempdir)
+    return
+
+def all_buckets():
+    buckets = [('modality', 'MR'), ('modality', 'Other')]
+    for name in ('Structural', 'Time Series', 'Diffusion', 'Other'):
+        buckets.append(('class', name))
+    for name in dashboard.known_types + ('Other', ):
+        buckets.append(('type', name))
+    return buckets
+
+def row_buckets(row):
+    """return the buckets a row is in and whether it is okay"""
+    d = dict(row)
+    if d['n_image03'] != 1:
+        return ([], False)
+    if d['image_modality'] != 'MR':
+        d['class'] = None
+        return ([('modality', 'Other')], dashboard.is_okay(d))
+    d['class'] = dashboard.classify(d)
+    if d['scan_type'] in dashboard.known_types:
+        type_name = d['scan_type']
+    else:
+        type_name = 'Other'
+    buckets = [('modality', 'MR'), ('class', d['class']), ('type', type_name)]
+    return (buckets, dashboard.is_okay(d))
+
+def expected_files(kind, name, status):
+    files = set()
+    for row in rows:
+        (buckets, okay) = row_buckets(row)
+        if (kind, name) not in buckets:
+            continue
+        if status == 'okay' and not okay:
+            continue
+        if status == 'error' and okay:
+            continue
+        files.add(row['image_file'])
+    return files
+
+def test_counts():
+    summary = dashboard.Summary()
+    nose.tools.assert_equal(summary.all['total'], len(rows))
+    n_multiples = len([ row for row in rows if row['n_image03'] > 1 ])
+    nose.tools.assert_true(n_multiples > 0)
+    nose.tools.assert_equal(summary.multiples['total'], n_multiples)
+    for (kind, name) in all_buckets():
+        counts = summary.counts(kind, name)
+        for (status, key) in statuses.iteritems():
+            n = len(expected_files(kind, name, status))
+            nose.tools.assert_equal(counts[key], n, (kind, name, status))
+    return
+
+def test_buckets():
+    """the counts match the rows read a page at a time"""
+    summary = dashboard.Summary()
+    for (kind, name) in all_buckets():
+        for (status, key) in statuses.iteritems():
+            bucket = dashboard.Bucket(kind, name, status)
+            files = []
+            after = None
+            while True:
+                (page, after) = bucket.page(after, 17)
+                files.extend([ row['image_file'] for row in page ])
+                if after is None:
+                    break
+            nose.tools.assert_equal(len(files), 
+                                    summary.counts(kind, name)[key])
+            nose.tools.assert_equal(set(files), 
+                                    expected_files(kind, name, status))
+    return
+
+def test_cache_refresh():
+    cache = dashboard.SummaryCache(600)
+    summary = cache.refresh()
+    nose.tools.assert_equal(summary.all['total'], len(rows))
+    db = sqlite3.connect(db_fname)
+    db.execute("""INSERT INTO summary (image_file, n_image03, image_modality) 
+                  VALUES ('s3://bucket/new.zip', 1, 'PET')""")
+    db.commit()
+    try:
+        summary = cache.refresh()
+    finally:
+        db.execute("""DELETE FROM summary 
+                       WHERE image_file = 's3://bucket/new.zip'""")
+        db.commit()
+        db.close()
+    nose.tools.assert_equal(summary.all['total'], len(rows) + 1)
+    nose.tools.assert_true(cache.summary is summary)
+    metrics = dict([ (m[0], m[3]) for m in cache.metrics() ])
+    nose.tools.assert_equal(metrics['summary_refreshes_total'], 2)
+    nose.tools.assert_equal(metrics['summary_refresh_errors_total'], 0)
+    nose.tools.assert_equal(metrics['summary_rows'], len(rows) + 1)
+    nose.tools.assert_true(metrics['summary_refresh_seconds'] >= 0)
+    return
+
+def test_cache_errors():
+    """a failed refresh is counted and keeps the last Summary"""
+    results = [dashboard.Summary]
+    def factory():
+        return results.pop(0)()
+    cache = dashboard.SummaryCache(600, factory)
+    summary = cache.refresh()
+    results.append(lambda: 1 / 0)
+    nose.tools.assert_raises(ZeroDivisionError, cache.refresh)
+    nose.tools.assert_true(cache.summary is summary)
+    metrics = dict([ (m[0], m[3]) for m in cache.metrics() ])
+    nose.tools.assert_equal(metrics['summary_refreshes_total'], 1)
+    nose.tools.assert_equal(metrics['summary_refresh_errors_total'], 1)
+    nose.tools.assert_equal(metrics['summary_rows'], len(rows))
+    return
+
+def test_cache_get():
+    """get() waits for the first Summary from the refresh thread"""
+    cache = dashboard.SummaryCache(600)
+    summary = cache.get(10)
+    nose.tools.assert_equal(summary.all['total'], len(rows))
+    nose.tools.assert_true(cache.thread.is_alive())
+    # a failing first refresh leaves get() with nothing
+    cache = dashboard.SummaryCache(600, lambda: 1 / 0)
+    nose.tools.assert_equal(cache.get(0.1), None)
+    return
+
+# eof
@@ -0,0 +1,187 @@
+import os
+import time
+import tempfile
+import shutil
+import nose.tools
+import thumbnail_cache
+import dashboard
+import s3_stub
+
+bucket = 'thumbs'
+
+def setup():
+    global tempdir
+    tempdir = tempfile.mkdtemp()
+    return
+
+def teardown():
+    shutil.rmtree(tempdir)
+    return
+
+def new_cache(objects, requests, **kwargs):
+    connect = lambda: s3_stub.S3(objects, requests)
+    return thumbnail_cache.ThumbnailCache(connect, **kwargs)
+
+def read(thumb):
+    return ''.join(thumb.chunks())
+
+def test_miss():
+    """a miss is a single GET, and the thumbnail is then cached"""
+    data = os.urandom(100000)
+    objects = {(bucket, 'a.png'): data}
+    requests = []
+    cache = new_cache(objects, requests)
+    thumb = cache.lookup(bucket, 'a.png')
+    nose.tools.assert_equal(thumb.etag, s3_stub.etag(data))
+    nose.tools.assert_equal(thumb.size, len(data))
+    nose.tools.assert_equal(read(thumb), data)
+    nose.tools.assert_equal(requests, [('GET', bucket, 'a.png')])
+    thumb = cache.lookup(bucket, 'a.png')
+    nose.tools.assert_equal(read(thumb), data)
+    nose.tools.assert_equal(len(requests), 1)
+    stats = cache.stats()
+    nose.tools.assert_equal((stats['s3'], stats['memory']), (1, 1))
+    # the connection went back to the pool
+    nose.tools.assert_equal(len(cache.pool.connections), 1)
+    return
+
+def test_missing():
+    requests = []
+    cache = new_cache({}, requests)
+    nose.tools.assert_equal(cache.lookup(bucket, 'none.png'), None)
+    nose.tools.assert_equal(requests, [('GET', bucket, 'none.png')])
+    return
+
+def test_revalidate():
+    """a stale entry is revalidated with a HEAD and counted once"""
+    data = os.urandom(1000)
+    objects = {(bucket, 'a.png'): data}
+    requests = []
+    cache = new_cache(objects, requests, max_age=0)
+    read(cache.lookup(bucket, 'a.png'))
+    thumb = cache.lookup(bucket, 'a.png')
+    nose.tools.assert_equal(read(thumb), data)
+    nose.tools.assert_equal(requests, [('GET', bucket, 'a.png'), 
+                                       ('HEAD', bucket, 'a.png')])
+    stats = cache.stats()
+    counts = (stats['s3'], stats['memory'], stats['revalidated'])
+    nose.tools.assert_equal(counts, (1, 0, 1))
+    return
+
+def test_changed():
+    """a stale entry whose ETag has changed is downloaded again"""
+    objects = {(bucket, 'a.png'): 'old'}
+    requests = []
+    cache = new_cache(objects, requests, max_age=0)
+    read(cache.lookup(bucket, 'a.png'))
+    objects[(bucket, 'a.png')] = 'new'
+    thumb = cache.lookup(bucket, 'a.png')
+    nose.tools.assert_equal(thumb.etag, s3_stub.etag('new'))
+    nose.tools.assert_equal(read(thumb), 'new')
+    nose.tools.assert_equal([ r[0] for r in requests ], ['GET', 'HEAD', 'GET'])
+    nose.tools.assert_equal(cache.stats()['s3'], 2)
+    return
+
+def test_aborted():
+    """a stream that isn't read to the end isn't cached and its 
+    connection isn't reused"""
+    data = os.urandom(3 * thumbnail_cache.chunk_size)
+    objects = {(bucket, 'a.png'): data}
+    cache = new_cache(objects, [])
+    chunks = cache.lookup(bucket, 'a.png').chunks()
+    chunks.next()
+    chunks.close()
+    nose.tools.assert_equal(cache.memory.get('s3://thumbs/a.png'), None)
+    nose.tools.assert_equal(cache.pool.connections, [])
+    return
+
+def test_lookup_error():
+    """a connection that fails before the GET is closed, not pooled"""
+    connections = []
+    def connect():
+        s3 = s3_stub.S3({}, [])
+        def get_bucket(name, validate=True):
+            raise IOError('connection reset')
+        s3.get_bucket = get_bucket
+        connections.append(s3)
+        return s3
+    cache = thumbnail_cache.ThumbnailCache(connect)
+    nose.tools.assert_raises(IOError, cache.lookup, bucket, 'a.png')
+    nose.tools.assert_equal(len(connections), 1)
+    nose.tools.assert_true(connections[0].closed)
+    nose.tools.assert_equal(cache.pool.connections, [])
+    return
+
+def test_lru():
+    cache = thumbnail_cache.MemoryCache(16 * 1000)
+    # an entry over 1/16 of the cache isn't kept
+    cache.put('big', 'big', 'x' * 1001, 0)
+    nose.tools.assert_equal(cache.entries.keys(), [])
+    for i in xrange(20):
+        cache.put(i, str(i), 'x' * 1000, 0)
+    nose.tools.assert_equal(cache.entries.keys(), range(4, 20))
+    nose.tools.assert_equal(cache.size, 16000)
+    # a get() makes an entry the most recently used
+    cache.get(4)
+    cache.put(20, '20', 'x' * 1000, 0)
+    nose.tools.assert_equal(cache.entries.keys(), range(6, 20) + [4, 20])
+    return
+
+def test_disk():
+    """a second cache on the same directory reads from disk"""
+    disk_dir = os.path.join(tempdir, 'disk')
+    data = os.urandom(1000)
+    objects = {(bucket, 'a.png'): data}
+    requests = []
+    read(new_cache(objects, requests, disk_dir=disk_dir).lookup(bucket, 
+                                                                'a.png'))
+    cache = new_cache(objects, requests, disk_dir=disk_dir)
+    thumb = cache.lookup(bucket, 'a.png')
+    nose.tools.assert_equal(thumb.etag, s3_stub.etag(data))
+    nose.tools.assert_equal(read(thumb), data)
+    nose.tools.assert_equal(len(requests), 1)
+    stats = cache.stats()
+    nose.tools.assert_equal((stats['disk'], stats['memory']), (1, 0))
+    nose.tools.assert_equal(stats['disk_bytes'], 1000)
+    # now in memory
+    cache.lookup(bucket, 'a.png')
+    nose.tools.assert_equal(cache.stats()['memory'], 1)
+    return
+
+def test_disk_eviction():
+    disk = thumbnail_cache.DiskCache(os.path.join(tempdir, 'evict'), 10000)
+    now = time.time()
+    for i in xrange(10):
+        disk.put('k%d' % i, 'e%d' % i, 'x' * 1500)
+        # oldest first
+        os.utime(disk._path('k%d' % i), (now - 100 + i, now - 100 + i))
+    # evicted down to 90%
+    nose.tools.assert_true(disk.size <= 9000)
+    kept = [ i for i in xrange(10) if disk.get('k%d' % i) ]
+    nose.tools.assert_equal(kept, range(10 - len(kept), 10))
+    nose.tools.assert_equal(disk.get('k9')[0], 'e9')
+    return
+
+def test_not_modified():
+    """a 304 for a thumbnail that wasn't cached still reads and caches it"""
+    data = os.urandom(1000)
+    objects = {(bucket, 'a.png'): data}
+    requests = []
+    connect = lambda: s3_stub.S3(objects, requests)
+    app = dashboard.create_app({'THUMBNAIL_MANIFEST': None, 
+                                'THUMBNAIL_CACHE_DIR': None}, 
+                               connect=connect)
+    client = app.test_client()
+    url = '/thumbnail/s3://%s/a.png' % bucket
+    headers = {'If-None-Match': '"%s"' % s3_stub.etag(data)}
+    resp = client.get(url, headers=headers)
+    nose.tools.assert_equal(resp.status_code, 304)
+    resp = client.get(url)
+    nose.tools.assert_equal(resp.status_code, 200)
+    nose.tools.assert_equal(resp.data, data)
+    nose.tools.assert_equal(requests, [('GET', bucket, 'a.png')])
+    thumbnail_server = app.extensions['ndar_dashboard'].thumbnail_server
+    nose.tools.assert_equal(len(thumbnail_server.pool.connections), 1)
+    return
+
+# eof
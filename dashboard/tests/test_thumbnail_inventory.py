@@ -0,0 +1,223 @@
+import os
+import random
+import tempfile
+import shutil
+import nose.tools
+import thumbnail_inventory
+import s3_stub
+
+bucket_name = 'bucket'
+prefix = 'thumbnails/'
+
+def setup():
+    global tempdir
+    tempdir = tempfile.mkdtemp()
+    return
+
+def teardown():
+    shutil.rmtree(tempdir)
+    return
+
+class Bucket:
+
+    """thumbnails in the stub S3, spread over the default shards"""
+
+    def __init__(self, n=500):
+        rnd = random.Random(n)
+        self.objects = {}
+        self.requests = []
+        self.connections = []
+        for i in xrange(n):
+            if i % 2:
+                guid = 'NDAR_INV%08d' % rnd.randrange(10**8)
+            else:
+                guid = 'NDAR%s%07d' % (rnd.choice('ABCXYZ'), 
+                                       rnd.randrange(10**7))
+            self.put('%s-%d-%d.png' % (guid, 100 + i % 50, i))
+        # a key on a shard boundary, a key that isn't a thumbnail, and 
+        # keys outside the prefix
+        self.put('NDAR_INVA')
+        self.put('README')
+        self.objects[(bucket_name, 'other/NDAR_INV1-1-1.png')] = 'x'
+        self.objects[('other', '%sNDAR_INV1-1-1.png' % prefix)] = 'x'
+        return
+
+    def put(self, key):
+        self.objects[(bucket_name, prefix + key)] = 'png data for %s' % key
+        return
+
+    def delete(self, key):
+        del self.objects[(bucket_name, prefix + key)]
+        return
+
+    def keys(self):
+        """return the keys (after the prefix) that are in S3"""
+        return set([ name[len(prefix):] for (b, name) in self.objects
+                     if b == bucket_name and name.startswith(prefix) ])
+
+    def connect(self):
+        s3 = s3_stub.S3(self.objects, self.requests)
+        self.connections.append(s3)
+        return s3
+
+    def lists(self):
+        """return the markers listed from since the last call"""
+        markers = [ key for (method, b, key) in self.requests
+                    if method == 'LIST' ]
+        self.requests[:] = []
+        return markers
+
+def inventory(fname='manifest'):
+    return thumbnail_inventory.Inventory(os.path.join(tempdir, fname), 
+                                         bucket_name, 
+                                         prefix)
+
+def test_sharded_listing():
+    """each shard is listed once and the shards together give the keys"""
+    b = Bucket()
+    inv = inventory('sharded')
+    n_shards = len(thumbnail_inventory.default_boundaries) + 1
+    nose.tools.assert_equal(len(inv.shards), n_shards)
+    nose.tools.assert_equal(inv.refresh(n_threads=4, connect=b.connect), 
+                            n_shards)
+    nose.tools.assert_equal(set(inv.keys), b.keys())
+    # the keys span several shards
+    used = set([ inv.shard_index(key) for key in inv.keys ])
+    nose.tools.assert_true(len(used) > 10)
+    markers = b.lists()
+    nose.tools.assert_equal(len(markers), n_shards)
+    nose.tools.assert_equal(sorted(markers), 
+                            sorted([ prefix + (s[0] or '')
+                                     for s in inv.shards ]))
+    nose.tools.assert_equal(len(b.connections), 4)
+    nose.tools.assert_true(all([ s3.closed for s3 in b.connections ]))
+    # the boundary key is in the shard that ends with it
+    i = inv.shard_index('NDAR_INVA')
+    nose.tools.assert_equal(inv.shards[i][1], 'NDAR_INVA')
+    nose.tools.assert_equal(inv.keys['NDAR_INVA'], 
+                            (len('png data for NDAR_INVA'), 
+                             s3_stub.last_modified))
+    # tuples() skips keys that aren't thumbnail names
+    tuples = inv.tuples()
+    nose.tools.assert_equal(len(tuples), len(b.keys()) - 2)
+    nose.tools.assert_true(('NDAR_INVA', 1, 1) not in tuples)
+    return
+
+def test_save_load():
+    b = Bucket()
+    inv = inventory('save')
+    inv.refresh(connect=b.connect)
+    b.lists()
+    inv.save()
+    loaded = inventory('save')
+    nose.tools.assert_equal(loaded.keys, inv.keys)
+    nose.tools.assert_equal(len(loaded.shards), len(inv.shards))
+    for (s1, s2) in zip(loaded.shards, inv.shards):
+        nose.tools.assert_equal(s1[:2], s2[:2])
+        nose.tools.assert_almost_equal(s1[2], s2[2], places=5)
+    nose.tools.assert_equal(loaded.mtime, inv.mtime)
+    nose.tools.assert_equal(loaded.tuples(), inv.tuples())
+    # a loaded manifest is up to date
+    nose.tools.assert_equal(loaded.refresh(3600, connect=b.connect), 0)
+    nose.tools.assert_equal(b.lists(), [])
+    return
+
+def test_load_errors():
+    inv = inventory('errors')
+    inv.save()
+    fname = inv.fname
+    nose.tools.assert_raises(thumbnail_inventory.ManifestError, 
+                             thumbnail_inventory.Inventory, 
+                             fname, 
+                             'other_bucket', 
+                             prefix)
+    open(fname, 'a').write('key\tbad_size\tx\t\n')
+    nose.tools.assert_raises(thumbnail_inventory.ManifestError, inventory, 
+                             'errors')
+    open(fname, 'w').write('bucket\t%s\nprefix\t%s\n' % (bucket_name, prefix))
+    nose.tools.assert_raises(thumbnail_inventory.ManifestError, inventory, 
+                             'errors')
+    return
+
+def test_rebalance():
+    b = Bucket(2000)
+    inv = inventory('rebalance')
+    inv.refresh(connect=b.connect)
+    keys = dict(inv.keys)
+    inv.rebalance(16)
+    nose.tools.assert_equal(len(inv.shards), 16)
+    nose.tools.assert_equal([ s[2] for s in inv.shards ], [0] * 16)
+    # the shards split the keys evenly
+    counts = [0] * len(inv.shards)
+    for key in keys:
+        counts[inv.shard_index(key)] += 1
+    nose.tools.assert_true(max(counts) - min(counts) <= 2, counts)
+    b.lists()
+    nose.tools.assert_equal(inv.refresh(connect=b.connect), 16)
+    nose.tools.assert_equal(len(b.lists()), 16)
+    nose.tools.assert_equal(inv.keys, keys)
+    # too few keys to balance
+    inv.rebalance(1000)
+    nose.tools.assert_equal(len(inv.shards), 
+                            len(thumbnail_inventory.default_boundaries) + 1)
+    return
+
+def test_reload_if_changed():
+    b = Bucket()
+    inv = inventory('reload')
+    nose.tools.assert_false(inv.reload_if_changed())
+    inv.save()
+    nose.tools.assert_false(inv.reload_if_changed())
+    other = inventory('reload')
+    other.refresh(connect=b.connect)
+    other.save()
+    # as if the save were later
+    os.utime(other.fname, (inv.mtime + 10, inv.mtime + 10))
+    nose.tools.assert_true(inv.reload_if_changed())
+    nose.tools.assert_equal(inv.keys, other.keys)
+    nose.tools.assert_false(inv.reload_if_changed())
+    return
+
+def test_incremental_refresh():
+    """only the stale shards are listed again"""
+    b = Bucket()
+    inv = inventory('incremental')
+    inv.refresh(connect=b.connect)
+    b.lists()
+    # a new key in a stale shard, and a deleted key in a fresh one
+    new_key = 'NDAR_INV00000000-120-99999.png'
+    b.put(new_key)
+    stale = inv.shard_index(new_key)
+    inv.shards[stale][2] = 0
+    fresh_keys = [ k for k in inv.keys if inv.shard_index(k) != stale ]
+    deleted_key = fresh_keys[0]
+    b.delete(deleted_key)
+    nose.tools.assert_equal(inv.refresh(3600, connect=b.connect), 1)
+    nose.tools.assert_equal(b.lists(), [prefix + (inv.shards[stale][0] or '')])
+    nose.tools.assert_true(new_key in inv)
+    nose.tools.assert_true(deleted_key in inv)
+    nose.tools.assert_true(inv.shards[stale][2] > 0)
+    # a full refresh picks up the deletion
+    n_shards = len(inv.shards)
+    nose.tools.assert_equal(inv.refresh(connect=b.connect), n_shards)
+    nose.tools.assert_false(deleted_key in inv)
+    nose.tools.assert_equal(set(inv.keys), b.keys())
+    # a key added by hand stays until its shard is listed
+    inv.add('NDAR_INV99999999-120-1.png')
+    nose.tools.assert_true(('NDAR_INV99999999', 120, 1) in inv.tuples())
+    inv.refresh(3600, connect=b.connect)
+    nose.tools.assert_true('NDAR_INV99999999-120-1.png' in inv)
+    return
+
+def test_refresh_error():
+    """a failed listing leaves the inventory as it was"""
+    b = Bucket()
+    inv = inventory('refresh_error')
+    def connect():
+        raise IOError('no connection')
+    nose.tools.assert_raises(IOError, inv.refresh, connect=connect)
+    nose.tools.assert_equal(inv.keys, {})
+    nose.tools.assert_equal(set([ s[2] for s in inv.shards ]), set([0]))
+    return
+
+# eof
@@ -0,0 +1,131 @@
+import os
+import tempfile
+import shutil
+import sqlite3
+import nose.tools
+import dashboard
+
+def setup():
+    global tempdir, db_fname
+    tempdir = tempfile.mkdtemp()
+    db_fname = os.path.join(tempdir, 'test.db')
+    db = sqlite3.connect(db_fname)
+    db.execute("""CREATE TABLE image03 (image03_id INTEGER, 
+                                        image_file VARCHAR, 
+                                        subjectkey VARCHAR, 
+                                        scan_type VARCHAR)""")
+    db.execute("""CREATE TABLE image03_derived (image_file VARCHAR, 
+                                                image_thumbnail_file VARCHAR, 
+                                                image_num_dimensions INTEGER)
+               """)
+    db.execute("""CREATE TABLE imaging_qa01 (file_source VARCHAR, 
+                                             snr FLOAT, 
+                                             external_min FLOAT, 
+                                             input_pot_clipped_voxels FLOAT)
+               """)
+    db.execute("""CREATE TABLE summary_changes (change_id INTEGER 
+                                                          PRIMARY KEY 
+                                                          AUTOINCREMENT, 
+                                                image_file VARCHAR, 
+                                                changed TIMESTAMP 
+                                                        DEFAULT 
+                                                        CURRENT_TIMESTAMP)
+               """)
+    db.executemany('INSERT INTO image03 VALUES (?, ?, ?, ?)', 
+                   [(1, 'A', 'NDAR_INV1', 'MR structural (T1)'), 
+                    (2, 'A', 'NDAR_INV1', 'MR structural (T1)'), 
+                    (3, 'B', 'NDAR_INV2', 'fMRI')])
+    db.executemany('INSERT INTO image03_derived VALUES (?, ?, ?)', 
+                   [('A', 's3://thumbs/a.png', 3)])
+    db.executemany('INSERT INTO imaging_qa01 VALUES (?, ?, ?, ?)', 
+                   [('A', 10.0, 1.0, None), 
+                    ('A', None, None, 5.0), 
+                    ('B', 3.0, None, None)])
+    # a change from before the dashboard started
+    db.execute("""INSERT INTO summary_changes (image_file, changed) 
+                  VALUES ('B', '2000-01-01 00:00:00')""")
+    db.commit()
+    db.close()
+    connect = lambda: sqlite3.connect(db_fname, check_same_thread=False)
+    dashboard.set_pool(dashboard.ConnectionPool(connect), 'sqlite')
+    return
+
+def teardown():
+    dashboard.set_pool(None)
+    shutil.rmtree(tempdir)
+    return
+
+def execute(*statements):
+    """run statements (query, params) in a transaction"""
+    db = sqlite3.connect(db_fname)
+    for (query, params) in statements:
+        db.execute(query, params)
+    db.commit()
+    db.close()
+    return
+
+def test_volume():
+    """the joined rows are deduplicated"""
+    volume = dashboard.Volume('A')
+    ids = sorted([ row['image03_id'] for row in volume.image03 ])
+    nose.tools.assert_equal(ids, [1, 2])
+    nose.tools.assert_equal(volume.image03_cols, 
+                            ['image03_id', 
+                             'image_file', 
+                             'subjectkey', 
+                             'scan_type'])
+    nose.tools.assert_equal(volume.image03_derived['image_num_dimensions'], 3)
+    nose.tools.assert_equal(volume.thumbnail_link, 
+                            '/thumbnail/s3://thumbs/a.png')
+    nose.tools.assert_equal(len(volume.qa), 2)
+    volume = dashboard.Volume('B')
+    nose.tools.assert_equal(len(volume.image03), 1)
+    nose.tools.assert_equal(volume.image03_derived, None)
+    nose.tools.assert_equal(volume.thumbnail_link, None)
+    nose.tools.assert_equal(volume.qa_cols, ['file_source', 'snr'])
+    nose.tools.assert_raises(KeyError, dashboard.Volume, 'none')
+    return
+
+def test_derived_write():
+    """a derived image03 write drops the cached Volume"""
+    cache = dashboard.VolumeCache(10, 600, poll_interval=0)
+    a = cache.get('A')
+    b = cache.get('B')
+    nose.tools.assert_true(cache.get('A') is a)
+    # as store_derived_image03 writes it
+    query = """UPDATE image03_derived 
+                  SET image_thumbnail_file = 's3://thumbs/a2.png' 
+                WHERE image_file = 'A'"""
+    execute((query, ()), 
+            ('INSERT INTO summary_changes (image_file) VALUES (?)', ('A', )))
+    a2 = cache.get('A')
+    nose.tools.assert_false(a2 is a)
+    nose.tools.assert_equal(a2.thumbnail_link, 
+                            '/thumbnail/s3://thumbs/a2.png')
+    nose.tools.assert_true(cache.get('B') is b)
+    # the change is only applied once
+    nose.tools.assert_true(cache.get('A') is a2)
+    nose.tools.assert_equal(cache.counts, {'cache': 3, 'db': 3})
+    return
+
+def test_late_commit():
+    """a change committed after one with a higher change_id is seen"""
+    cache = dashboard.VolumeCache(10, 600, poll_interval=0)
+    a = cache.get('A')
+    b = cache.get('B')
+    # the old change is behind the mark
+    nose.tools.assert_true(cache.low >= 1)
+    low = cache.low
+    query = 'INSERT INTO summary_changes (change_id, image_file) VALUES (?, ?)'
+    execute((query, (low + 100, 'B')))
+    nose.tools.assert_false(cache.get('B') is b)
+    # inserted before the change above but committed after it
+    execute((query, (low + 50, 'A')))
+    nose.tools.assert_false(cache.get('A') is a)
+    # recent changes don't move the mark
+    nose.tools.assert_equal(cache.low, low)
+    nose.tools.assert_true(low + 50 in cache.seen)
+    nose.tools.assert_true(low + 100 in cache.seen)
+    return
+
+# eof
@@ -0,0 +1,360 @@
+"""caching proxy for the dashboard thumbnails
+
+a summary page shows hundreds of thumbnails, so the dashboard doesn't 
+go to S3 for each one.  thumbnails are kept in a bounded in-memory LRU 
+cache and (if a directory is given) a bounded disk cache, keyed by 
+bucket and key and tagged with the S3 ETag.  an entry older than 
+max_age is revalidated with a HEAD request and only downloaded again 
+if its ETag has changed; a thumbnail that isn't cached takes a single 
+GET, whose response gives its ETag and size.
+
+S3 connections are kept in a pool shared by the request threads. 
+thumbnails that aren't cached are streamed to the client as they are 
+read from S3 and cached once they have been read completely.
+
+the disk cache directory has a file for each thumbnail, named by the 
+SHA-1 of s3://<bucket>/<key>, and a .etag file with its ETag; files are 
+written to a temporary name and renamed, so several dashboard 
+processes can share a directory.
+"""
+
+import os
+import time
+import hashlib
+import threading
+import tempfile
+import collections
+import boto.exception
+
+# bytes per read from S3 or the disk cache
+chunk_size = 64 * 1024
+
+default_memory_size = 64 * 1024 * 1024
+default_disk_size = 1024 * 1024 * 1024
+default_max_age = 3600
+
+class Thumbnail:
+
+    """a thumbnail to serve
+
+    etag is the S3 ETag (without quotes); chunks() generates the data"""
+
+    def __init__(self, etag, size, chunks):
+        self.etag = etag
+        self.size = size
+        self.chunks = chunks
+        return
+
+class MemoryCache:
+
+    """LRU cache of (etag, data, time checked), bounded by total size"""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.size = 0
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+        return
+
+    def get(self, key):
+        with self.lock:
+            try:
+                entry = self.entries.pop(key)
+            except KeyError:
+                return None
+            self.entries[key] = entry
+            return entry
+
+    def put(self, key, etag, data, checked):
+        # don't let one object push out much of the cache
+        if len(data) > self.max_size // 16:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.size -= len(self.entries.pop(key)[1])
+            self.entries[key] = (etag, data, checked)
+            self.size += len(data)
+            while self.size > self.max_size:
+                (old_key, old_entry) = self.entries.popitem(last=False)
+                self.size -= len(old_entry[1])
+        return
+
+class DiskCache:
+
+    """cache of thumbnails in a directory, bounded by total size
+
+    entries are evicted oldest (by modification time, which is updated 
+    when an entry is used or revalidated) first"""
+
+    def __init__(self, dir, max_size):
+        self.dir = dir
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        if not os.path.isdir(dir):
+            os.makedirs(dir)
+        self.size = sum([ size for (mtime, size, path) in self._files() ])
+        return
+
+    def _path(self, key):
+        if isinstance(key, unicode):
+            key = key.encode('utf-8')
+        return os.path.join(self.dir, hashlib.sha1(key).hexdigest())
+
+    def _files(self):
+        """return (mtime, size, path) for the data files"""
+        files = []
+        for name in os.listdir(self.dir):
+            if name.endswith('.etag') or name.startswith('.'):
+                continue
+            path = os.path.join(self.dir, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            files.append((st.st_mtime, st.st_size, path))
+        return files
+
+    def get(self, key):
+        """return (etag, path, size, time checked) or None"""
+        path = self._path(key)
+        try:
+            etag = open(path + '.etag').read().strip()
+            st = os.stat(path)
+        except (IOError, OSError):
+            return None
+        return (etag, path, st.st_size, st.st_mtime)
+
+    def touch(self, key):
+        """mark an entry as used (and checked) now"""
+        try:
+            os.utime(self._path(key), None)
+        except OSError:
+            pass
+        return
+
+    def put(self, key, etag, data):
+        path = self._path(key)
+        try:
+            (fd, tmp_path) = tempfile.mkstemp(dir=self.dir, prefix='.')
+            os.write(fd, data)
+            os.close(fd)
+            fo = open(tmp_path + '.etag', 'w')
+            fo.write(etag + '\n')
+            fo.close()
+            try:
+                old_size = os.path.getsize(path)
+            except OSError:
+                old_size = 0
+            # the data last, so get() never pairs new data with an old 
+            # ETag
+            os.rename(tmp_path + '.etag', path + '.etag')
+            os.rename(tmp_path, path)
+        except (IOError, OSError):
+            return
+        with self.lock:
+            self.size += len(data) - old_size
+            if self.size > self.max_size:
+                self._evict()
+        return
+
+    def _evict(self):
+        # down to 90% so we don't evict on every put
+        files = sorted(self._files())
+        self.size = sum([ f[1] for f in files ])
+        for (mtime, size, path) in files:
+            if self.size <= self.max_size * 0.9:
+                break
+            for p in (path, path + '.etag'):
+                try:
+                    os.unlink(p)
+                except OSError:
+                    pass
+            self.size -= size
+        return
+
+class ConnectionPool:
+
+    """idle S3 connections, shared by threads
+
+    get() returns an idle connection (or makes a new one with connect()); 
+    put() returns a connection to the pool.  A connection that has had an 
+    error should be closed rather than returned.
+    """
+
+    def __init__(self, connect):
+        self.connect = connect
+        self.connections = []
+        self.lock = threading.Lock()
+        return
+
+    def get(self):
+        with self.lock:
+            if self.connections:
+                return self.connections.pop()
+        return self.connect()
+
+    def put(self, conn):
+        with self.lock:
+            self.connections.append(conn)
+        return
+
+class ThumbnailCache:
+
+    """the thumbnail serving layer
+
+    connect() returns a new S3 connection; disk_dir (if given) is the 
+    disk cache directory"""
+
+    def __init__(self, 
+                 connect, 
+                 memory_size=default_memory_size, 
+                 disk_dir=None, 
+                 disk_size=default_disk_size, 
+                 max_age=default_max_age):
+        self.pool = ConnectionPool(connect)
+        self.memory = MemoryCache(memory_size)
+        if disk_dir:
+            self.disk = DiskCache(disk_dir, disk_size)
+        else:
+            self.disk = None
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.counts = {'memory': 0, 'disk': 0, 'revalidated': 0, 's3': 0}
+        return
+
+    def _count(self, what):
+        with self.lock:
+            self.counts[what] += 1
+        return
+
+    def _close(self, s3):
+        try:
+            s3.close()
+        except:
+            pass
+        return
+
+    def lookup(self, bucket_name, key_name):
+        """return a Thumbnail for s3://bucket_name/key_name, or None if 
+        it doesn't exist
+
+        each lookup is counted once, by where the thumbnail came from"""
+        cache_key = 's3://%s/%s' % (bucket_name, key_name)
+        now = time.time()
+        cached = self._cached(cache_key)
+        if cached:
+            (thumb, data, checked, source) = cached
+            if now - checked < self.max_age:
+                self._count(source)
+                return thumb
+            # time to check that the cached copy is current
+            etag = self._head(bucket_name, key_name)
+            if etag is None:
+                return None
+            if etag == thumb.etag:
+                self._count('revalidated')
+                self.memory.put(cache_key, etag, data, now)
+                if self.disk:
+                    self.disk.touch(cache_key)
+                return thumb
+        # not cached, or changed; the GET response gives the ETag and 
+        # size, so this is the only request
+        s3 = self.pool.get()
+        try:
+            key = s3.get_bucket(bucket_name, validate=False).new_key(key_name)
+            key.open_read()
+        except boto.exception.S3ResponseError, data:
+            # the error body has been read, so the connection can be 
+            # used again
+            self.pool.put(s3)
+            if data.status == 404:
+                return None
+            raise
+        except:
+            self._close(s3)
+            raise
+        self._count('s3')
+        etag = key.etag.strip('"')
+        stream = lambda: self._stream(cache_key, s3, key, etag)
+        return Thumbnail(etag, key.size, stream)
+
+    def _head(self, bucket_name, key_name):
+        """return the ETag of a key (from a HEAD request), or None if it 
+        doesn't exist"""
+        s3 = self.pool.get()
+        try:
+            key = s3.get_bucket(bucket_name, validate=False).get_key(key_name)
+        except:
+            self._close(s3)
+            raise
+        self.pool.put(s3)
+        if key is None:
+            return None
+        return key.etag.strip('"')
+
+    def _cached(self, cache_key):
+        """return (Thumbnail, data, time checked, source) from the memory 
+        or disk cache, or None; source is 'memory' or 'disk'"""
+        entry = self.memory.get(cache_key)
+        if entry:
+            (etag, data, checked) = entry
+            return (Thumbnail(etag, len(data), lambda: iter([data])), 
+                    data, 
+                    checked, 
+                    'memory')
+        if not self.disk:
+            return None
+        entry = self.disk.get(cache_key)
+        if not entry:
+            return None
+        (etag, path, size, checked) = entry
+        try:
+            data = open(path, 'rb').read()
+        except IOError:
+            return None
+        if len(data) != size:
+            # replaced since get()
+            return None
+        self.memory.put(cache_key, etag, data, checked)
+        return (Thumbnail(etag, size, lambda: iter([data])), 
+                data, 
+                checked, 
+                'disk')
+
+    def _stream(self, cache_key, s3, key, etag):
+        """generate the data for a key opened with open_read() on s3, 
+        caching it if all of it is read"""
+        parts = []
+        done = False
+        try:
+            while True:
+                data = key.read(chunk_size)
+                if not data:
+                    break
+                parts.append(data)
+                yield data
+            done = True
+        finally:
+            if done:
+                key.close()
+                self.pool.put(s3)
+            else:
+                # the client went away or the read failed; the rest of 
+                # the response is still on the connection
+                self._close(s3)
+        data = ''.join(parts)
+        self.memory.put(cache_key, etag, data, time.time())
+        if self.disk:
+            self.disk.put(cache_key, etag, data)
+        return
+
+    def stats(self):
+        """return counts of lookups by source and the cache sizes"""
+        with self.lock:
+            stats = dict(self.counts)
+        stats['memory_bytes'] = self.memory.size
+        if self.disk:
+            stats['disk_bytes'] = self.disk.size
+        return stats
+
+# eof
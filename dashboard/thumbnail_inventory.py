@@ -0,0 +1,355 @@
+"""inventory of the dashboard thumbnails in S3
+
+the thumbnails are s3://NITRC_data/thumbnails/<subjectkey>-<age>-<id>.png; 
+listing them is the slow part of create_summary, so we keep a local 
+manifest of the keys.  the key space is split into shards that are 
+listed in parallel (each shard is a marker and an end key), and the 
+manifest records when each shard was last listed, so a refresh only 
+needs to list the shards that are out of date.
+
+the manifest is a text file:
+
+    bucket <bucket name>
+    prefix <prefix>
+    shard <start> <end> <time listed>
+    ...
+    key <key> <size> <last modified>
+    ...
+
+fields are separated by tabs; an empty start or end is unbounded and 
+a shard that has never been listed has a time of 0.  shard <start> 
+<end> covers the keys (after the prefix) k with start < k <= end.
+
+to refresh a manifest from the command line:
+
+    python thumbnail_inventory.py [--max-age SECONDS] [--full] manifest
+"""
+
+import sys
+import os
+import time
+import bisect
+import threading
+import Queue
+import boto.s3.connection
+
+default_bucket = 'NITRC_data'
+default_prefix = 'thumbnails/'
+
+# parallel shard listings
+default_threads = 16
+
+# shards for a new manifest; the keys start with NDAR subject GUIDs 
+# (NDARxxxxxxxx or NDAR_INVxxxxxxxx)
+guid_chars = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+default_boundaries = [ 'NDAR%s' % c for c in guid_chars ] + \
+                     [ 'NDAR_INV%s' % c for c in guid_chars ]
+
+# shards to use when a full refresh rebalances the boundaries
+n_balanced_shards = 64
+
+class ManifestError(Exception):
+
+    """error reading a manifest"""
+
+def s3_connect():
+    """connect to S3 using the credentials in the environment"""
+    cf = boto.s3.connection.OrdinaryCallingFormat()
+    s3 = boto.s3.connection.S3Connection(os.environ['AWS_ACCESS_KEY_ID'], 
+                                         os.environ['AWS_SECRET_ACCESS_KEY'], 
+                                         calling_format=cf)
+    return s3
+
+def parse_key(key):
+    """parse a key (after the prefix) into (subjectkey, interview_age, 
+    image03_id), returning None if the key is not a thumbnail name"""
+    if not key.endswith('.png'):
+        return None
+    parts = key[:-4].split('-')
+    if len(parts) != 3:
+        return None
+    try:
+        return (parts[0], int(parts[1]), int(parts[2]))
+    except ValueError:
+        return None
+
+class Inventory:
+
+    """the thumbnail keys in a bucket, kept in a manifest file
+
+    keys maps keys (after the prefix) to (size, last modified); shards 
+    is a sorted list of [start, end, time listed] with start and end 
+    None for the first and last shards
+    """
+
+    def __init__(self, fname, bucket=default_bucket, prefix=default_prefix):
+        self.fname = fname
+        self.bucket = bucket
+        self.prefix = prefix
+        self.keys = {}
+        self.mtime = None
+        self.set_boundaries(default_boundaries)
+        if os.path.exists(fname):
+            self.load()
+        return
+
+    def set_boundaries(self, boundaries):
+        """set the shards from a sorted list of boundaries, discarding the 
+        shard listing times"""
+        edges = [None] + list(boundaries) + [None]
+        self.shards = []
+        for i in xrange(len(edges)-1):
+            self.shards.append([edges[i], edges[i+1], 0])
+        self._starts = [ s[0] for s in self.shards[1:] ]
+        return
+
+    def shard_index(self, key):
+        """return the index of the shard key is in"""
+        # shard i+1 starts after self._starts[i]
+        return bisect.bisect_left(self._starts, key)
+
+    def load(self):
+        """read the manifest"""
+        bucket = None
+        prefix = None
+        shards = []
+        keys = {}
+        mtime = os.stat(self.fname).st_mtime
+        fo = open(self.fname)
+        try:
+            for (lineno, line) in enumerate(fo):
+                fields = line.rstrip('\n').split('\t')
+                try:
+                    if fields[0] == 'bucket':
+                        bucket = fields[1]
+                    elif fields[0] == 'prefix':
+                        prefix = fields[1]
+                    elif fields[0] == 'shard':
+                        shards.append([fields[1] or None, 
+                                       fields[2] or None, 
+                                       float(fields[3])])
+                    elif fields[0] == 'key':
+                        keys[fields[1]] = (int(fields[2]), fields[3])
+                    else:
+                        raise ValueError('unknown record %s' % fields[0])
+                except (IndexError, ValueError), data:
+                    msg = '%s line %d: %s' % (self.fname, lineno+1, str(data))
+                    raise ManifestError(msg)
+        finally:
+            fo.close()
+        if not shards:
+            raise ManifestError('%s: no shards' % self.fname)
+        if bucket != self.bucket or prefix != self.prefix:
+            fmt = '%s: manifest is for s3://%s/%s'
+            raise ManifestError(fmt % (self.fname, bucket, prefix))
+        self.shards = shards
+        self._starts = [ s[0] for s in self.shards[1:] ]
+        self.keys = keys
+        self.mtime = mtime
+        return
+
+    def reload_if_changed(self):
+        """reload the manifest if it has changed on disk since we read it; 
+        returns True if it was reloaded"""
+        try:
+            mtime = os.stat(self.fname).st_mtime
+        except OSError:
+            return False
+        if mtime == self.mtime:
+            return False
+        self.load()
+        return True
+
+    def save(self):
+        """write the manifest (atomically)"""
+        tmp_fname = '%s.tmp.%d' % (self.fname, os.getpid())
+        fo = open(tmp_fname, 'w')
+        try:
+            fo.write('bucket\t%s\n' % self.bucket)
+            fo.write('prefix\t%s\n' % self.prefix)
+            for (start, end, listed) in self.shards:
+                fo.write('shard\t%s\t%s\t%f\n' % (start or '', 
+                                                   end or '', 
+                                                   listed))
+            for key in sorted(self.keys):
+                (size, last_modified) = self.keys[key]
+                fo.write('key\t%s\t%d\t%s\n' % (key, size, last_modified))
+        finally:
+            fo.close()
+        os.rename(tmp_fname, self.fname)
+        self.mtime = os.stat(self.fname).st_mtime
+        return
+
+    def rebalance(self, n_shards=n_balanced_shards):
+        """pick shard boundaries that split the current keys evenly
+
+        the shard listing times are discarded, so this should be followed 
+        by a full refresh
+        """
+        keys = sorted(self.keys)
+        if len(keys) < n_shards * 10:
+            self.set_boundaries(default_boundaries)
+            return
+        boundaries = []
+        for i in xrange(1, n_shards):
+            b = keys[i * len(keys) // n_shards]
+            if not boundaries or b > boundaries[-1]:
+                boundaries.append(b)
+        self.set_boundaries(boundaries)
+        return
+
+    def _list_shard(self, bucket, start, end):
+        """list the keys in a shard, returning a dictionary like self.keys"""
+        keys = {}
+        marker = self.prefix + (start or '')
+        for k in bucket.list(prefix=self.prefix, marker=marker):
+            key = k.key[len(self.prefix):]
+            if end is not None and key > end:
+                break
+            if not key:
+                continue
+            keys[key] = (k.size, k.last_modified)
+        return keys
+
+    def refresh(self, max_age=None, n_threads=default_threads, 
+                connect=s3_connect):
+
+        """list the shards that were last listed more than max_age seconds 
+        ago (all shards if max_age is None) and update the keys
+
+        each thread makes its own connection with connect(); returns the 
+        number of shards listed
+        """
+
+        now = time.time()
+        if max_age is None:
+            stale = range(len(self.shards))
+        else:
+            stale = [ i for (i, s) in enumerate(self.shards)
+                      if now - s[2] > max_age ]
+        if not stale:
+            return 0
+
+        work = Queue.Queue()
+        for i in stale:
+            work.put(i)
+        results = {}
+        errors = []
+        lock = threading.Lock()
+
+        def worker():
+            s3 = None
+            try:
+                s3 = connect()
+                bucket = s3.get_bucket(self.bucket, validate=False)
+                while True:
+                    try:
+                        i = work.get_nowait()
+                    except Queue.Empty:
+                        break
+                    (start, end, listed) = self.shards[i]
+                    t0 = time.time()
+                    keys = self._list_shard(bucket, start, end)
+                    with lock:
+                        results[i] = (t0, keys)
+            except Exception, data:
+                with lock:
+                    errors.append(data)
+            finally:
+                if s3:
+                    s3.close()
+            return
+
+        threads = []
+        for i in xrange(min(n_threads, len(stale))):
+            t = threading.Thread(target=worker)
+            t.start()
+            threads.append(t)
+        for t in threads:
+            t.join()
+        if errors:
+            raise errors[0]
+
+        # replace the keys in the listed shards
+        keys = {}
+        for (key, value) in self.keys.iteritems():
+            if self.shard_index(key) not in results:
+                keys[key] = value
+        for (i, (t0, shard_keys)) in results.iteritems():
+            keys.update(shard_keys)
+            self.shards[i][2] = t0
+        self.keys = keys
+
+        return len(results)
+
+    def add(self, key, size=0, last_modified=''):
+        """add a key (after the prefix) that we know has been written"""
+        self.keys[key] = (size, last_modified)
+        return
+
+    def __contains__(self, key):
+        return key in self.keys
+
+    def tuples(self):
+        """return the set of (subjectkey, interview_age, image03_id) for 
+        the thumbnails"""
+        thumbnails = set()
+        for key in self.keys:
+            t = parse_key(key)
+            if t is not None:
+                thumbnails.add(t)
+        return thumbnails
+
+if __name__ == '__main__':
+
+    import argparse
+
+    progname = os.path.basename(sys.argv[0])
+
+    description = 'Refresh the thumbnail manifest.'
+    parser = argparse.ArgumentParser(description=description)
+
+    parser.add_argument('manifest', 
+                        help='manifest file (created if it does not exist)')
+    parser.add_argument('--max-age', 
+                        type=float, 
+                        default=None, 
+                        help='only list shards older than this (seconds)')
+    parser.add_argument('--full', 
+                        default=False, 
+                        action='store_true', 
+                        help='rebalance the shards and list them all')
+    parser.add_argument('--threads', 
+                        type=int, 
+                        default=default_threads, 
+                        help='parallel listings (default %d)' % \
+                             default_threads)
+
+    args = parser.parse_args()
+
+    for var in ('AWS_ACCESS_KEY_ID', 'AWS_SECRET_ACCESS_KEY'):
+        if var not in os.environ:
+            sys.stderr.write('%s: %s not set\n' % (progname, var))
+            sys.exit(1)
+
+    try:
+        inventory = Inventory(args.manifest)
+    except ManifestError, data:
+        sys.stderr.write('%s: %s\n' % (progname, str(data)))
+        sys.exit(1)
+
+    if args.full:
+        inventory.rebalance()
+        max_age = None
+    else:
+        max_age = args.max_age
+
+    t0 = time.time()
+    n = inventory.refresh(max_age, args.threads)
+    inventory.save()
+    fmt = 'listed %d of %d shards in %.1f s; %d keys'
+    print fmt % (n, len(inventory.shards), time.time()-t0, len(inventory.keys))
+
+    sys.exit(0)
+
+# eof
@@ -0,0 +1,14 @@
+"""WSGI entry point for the dashboard
+
+for servers that import an application object, e.g.:
+
+    gunicorn --workers 4 --threads 8 wsgi:application
+
+see serve_dashboard and dashboard.create_app() for the settings
+"""
+
+import dashboard
+
+application = dashboard.create_app()
+
+# eof
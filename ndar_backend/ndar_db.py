@@ -0,0 +1,330 @@
+# See file COPYING distributed with ndar-backend for copyright and license.
+
+"""database writes for the store_* scripts
+
+by default a Writer connects to the database (using DB_HOST, DB_SERVICE, 
+DB_USER, and DB_PASSWORD) and inserts its records in one transaction.
+
+if NDAR_SPOOL_DIR is set, a Writer instead writes its records to a file 
+in the spool directory and load_spool() (run by the load_spool script) 
+later inserts them in batches, so thousands of jobs don't each open 
+their own connection.  the spool directory has:
+
+    tmp/     files being written
+    new/     files waiting to be loaded
+    failed/  files that could not be loaded (with a .error file)
+    lock     held while loading
+
+each spool file has an ID that is recorded in the same transaction as 
+its records, so a file that is loaded again (after a crash, say) is 
+skipped rather than inserted twice:
+
+    CREATE TABLE spool_loaded (spool_id VARCHAR2(128) PRIMARY KEY, 
+                               loaded TIMESTAMP 
+                                      DEFAULT SYSTIMESTAMP 
+                                      NOT NULL)
+
+spool files are written with marshal, so they should be loaded by the 
+same Python version that wrote them.
+"""
+
+import os
+import time
+import socket
+import marshal
+import fcntl
+import uuid
+
+spool_env = 'NDAR_SPOOL_DIR'
+
+db_vars = ('DB_HOST', 'DB_SERVICE', 'DB_USER', 'DB_PASSWORD')
+
+spool_suffix = '.spool'
+
+spool_format = 1
+
+# IDs per IN (...) list; Oracle allows at most 1000
+in_list_size = 1000
+
+class DBError(Exception):
+
+    """error writing to the database or the spool"""
+
+def spool_dir():
+    """return the spool directory from the environment (or None)"""
+    return os.environ.get(spool_env) or None
+
+def missing_environment():
+    """return the environment variables a Writer needs that aren't set"""
+    if spool_dir():
+        return []
+    return [ var for var in db_vars if var not in os.environ ]
+
+def connect():
+    """connect to the database using the environment"""
+    import cx_Oracle
+    dsn = cx_Oracle.makedsn(os.environ['DB_HOST'], 
+                            1521, 
+                            os.environ['DB_SERVICE'])
+    return cx_Oracle.connect(os.environ['DB_USER'], 
+                             os.environ['DB_PASSWORD'], 
+                             dsn)
+
+def insert_query(table, cols):
+    """return the INSERT statement for the given table and columns"""
+    return 'INSERT INTO %s (%s) VALUES (%s)' % \
+           (table, 
+            ', '.join(cols), 
+            ', '.join([ ':%s' % col for col in cols ]))
+
+class Writer:
+
+    """records to write to the database (from a store_* run, say)
+
+    records are added with insert() and written with commit(), either 
+    directly to the database or to the spool (if dir or NDAR_SPOOL_DIR 
+    is given)
+    """
+
+    def __init__(self, dir=None):
+        if dir is None:
+            dir = spool_dir()
+        self.spool_dir = dir
+        # list of (table, params)
+        self.records = []
+        return
+
+    def insert(self, table, params):
+        self.records.append((table, dict(params)))
+        return
+
+    def commit(self):
+        """write the records; returns the spool file name in spool mode"""
+        if self.spool_dir:
+            return self._spool()
+        try:
+            db = connect()
+        except Exception, data:
+            raise DBError('error connecting to database: %s' % str(data))
+        try:
+            c = db.cursor()
+            _execute_records(c, self.records)
+            c.close()
+            db.commit()
+        except Exception, data:
+            db.close()
+            raise DBError('error writing to database: %s' % str(data))
+        db.close()
+        self.records = []
+        return None
+
+    def _spool(self):
+        # the time first so the files load in order
+        spool_id = '%s-%s-%d-%s' % (time.strftime('%Y%m%d%H%M%S'), 
+                                    socket.gethostname(), 
+                                    os.getpid(), 
+                                    uuid.uuid4().hex[:8])
+        fname = spool_id + spool_suffix
+        try:
+            make_spool_dirs(self.spool_dir)
+            tmp_path = os.path.join(self.spool_dir, 'tmp', fname)
+            fo = open(tmp_path, 'wb')
+            marshal.dump({'format': spool_format, 
+                          'id': spool_id, 
+                          'records': self.records}, fo)
+            fo.flush()
+            os.fsync(fo.fileno())
+            fo.close()
+            path = os.path.join(self.spool_dir, 'new', fname)
+            os.rename(tmp_path, path)
+        except (IOError, OSError), data:
+            raise DBError('error writing to spool: %s' % str(data))
+        self.records = []
+        return path
+
+def make_spool_dirs(dir):
+    for subdir in ('tmp', 'new', 'failed'):
+        path = os.path.join(dir, subdir)
+        if not os.path.isdir(path):
+            try:
+                os.makedirs(path)
+            except OSError:
+                # another job may have made it
+                if not os.path.isdir(path):
+                    raise
+    return
+
+def read_spool_file(path):
+    """return the ID and records from a spool file"""
+    fo = open(path, 'rb')
+    try:
+        data = marshal.load(fo)
+    finally:
+        fo.close()
+    if not isinstance(data, dict) or data.get('format') != spool_format:
+        raise ValueError('%s: unknown spool file format' % path)
+    return (data['id'], data['records'])
+
+class SpoolLock:
+
+    """exclusive lock on a spool directory, so only one loader runs"""
+
+    def __init__(self, dir):
+        self.fo = open(os.path.join(dir, 'lock'), 'a')
+        return
+
+    def __enter__(self):
+        try:
+            fcntl.flock(self.fo, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError:
+            raise DBError('another loader is running')
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        fcntl.flock(self.fo, fcntl.LOCK_UN)
+        self.fo.close()
+        return
+
+def _execute_records(c, records):
+    """insert records (a list of (table, params)) using executemany()"""
+    # group the records by table and columns, keeping the tables in the 
+    # order they are first seen
+    groups = {}
+    order = []
+    for (table, params) in records:
+        key = (table, tuple(sorted(params)))
+        if key not in groups:
+            groups[key] = []
+            order.append(key)
+        groups[key].append(params)
+    for key in order:
+        (table, cols) = key
+        c.executemany(insert_query(table, cols), groups[key])
+    return
+
+def _loaded_ids(c, spool_ids):
+    """return the subset of spool_ids already in spool_loaded"""
+    loaded = set()
+    for i in xrange(0, len(spool_ids), in_list_size):
+        chunk = spool_ids[i:i+in_list_size]
+        params = {}
+        for (j, spool_id) in enumerate(chunk):
+            params['id%d' % j] = spool_id
+        binds = ', '.join([ ':id%d' % j for j in xrange(len(chunk)) ])
+        query = 'SELECT spool_id FROM spool_loaded WHERE spool_id IN (%s)'
+        c.execute(query % binds, params)
+        loaded.update([ row[0] for row in c ])
+    return loaded
+
+def _insert_files(db, files):
+    """insert the records from files (a list of (path, ID, records)) and 
+    record the IDs, all in one transaction"""
+    c = db.cursor()
+    try:
+        records = []
+        for (path, spool_id, file_records) in files:
+            records.extend(file_records)
+        _execute_records(c, records)
+        query = 'INSERT INTO spool_loaded (spool_id) VALUES (:spool_id)'
+        c.executemany(query, [ {'spool_id': f[1]} for f in files ])
+        db.commit()
+    except:
+        db.rollback()
+        raise
+    finally:
+        c.close()
+    return
+
+def _fail(dir, path, error):
+    """move a spool file that can't be loaded to failed/"""
+    base = os.path.basename(path)
+    os.rename(path, os.path.join(dir, 'failed', base))
+    fo = open(os.path.join(dir, 'failed', base + '.error'), 'w')
+    fo.write('%s\n' % error)
+    fo.close()
+    return
+
+def load_spool(db, dir, batch_size=500, log=None):
+
+    """load the files in a spool directory into the database
+
+    db is a DB-API connection that takes named (:name) parameters, such 
+    as a cx_Oracle or sqlite3 connection; files are loaded batch_size at 
+    a time with executemany() and removed once they are committed
+
+    if a batch fails, its files are loaded one at a time and the ones 
+    that fail on their own are moved to failed/; errors that also break 
+    a trivial query (a lost connection, say) are raised, leaving the 
+    files to be loaded later
+
+    returns (files loaded, files already loaded, files failed)
+    """
+
+    if log is None:
+        log = lambda msg: None
+
+    make_spool_dirs(dir)
+    n_loaded = 0
+    n_skipped = 0
+    n_failed = 0
+
+    with SpoolLock(dir):
+
+        new_dir = os.path.join(dir, 'new')
+        names = sorted([ name for name in os.listdir(new_dir)
+                         if name.endswith(spool_suffix) ])
+
+        for i in xrange(0, len(names), batch_size):
+
+            files = []
+            for name in names[i:i+batch_size]:
+                path = os.path.join(new_dir, name)
+                try:
+                    (spool_id, records) = read_spool_file(path)
+                except Exception, data:
+                    log('%s: %s' % (name, str(data)))
+                    _fail(dir, path, str(data))
+                    n_failed += 1
+                    continue
+                files.append((path, spool_id, records))
+
+            c = db.cursor()
+            loaded = _loaded_ids(c, [ f[1] for f in files ])
+            c.close()
+            for f in files:
+                if f[1] in loaded:
+                    os.unlink(f[0])
+                    n_skipped += 1
+            files = [ f for f in files if f[1] not in loaded ]
+            if not files:
+                continue
+
+            try:
+                _insert_files(db, files)
+            except Exception, data:
+                log('batch failed (%s); loading files singly' % str(data))
+            else:
+                for f in files:
+                    os.unlink(f[0])
+                n_loaded += len(files)
+                log('loaded %d files' % len(files))
+                continue
+
+            for f in files:
+                try:
+                    _insert_files(db, [f])
+                except Exception, data:
+                    # make sure it's this file and not the connection
+                    c = db.cursor()
+                    c.execute('SELECT COUNT(*) FROM spool_loaded WHERE 1 = 0')
+                    c.close()
+                    log('%s: %s' % (os.path.basename(f[0]), str(data)))
+                    _fail(dir, f[0], str(data))
+                    n_failed += 1
+                else:
+                    os.unlink(f[0])
+                    n_loaded += 1
+
+    return (n_loaded, n_skipped, n_failed)
+
+# eof
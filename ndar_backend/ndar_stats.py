@@ -0,0 +1,184 @@
+# See file COPYING distributed with ndar-backend for copyright and license.
+
+"""reading FreeSurfer (aseg.stats) and FIRST (first.stats) results
+
+this is the parsing shared by store_recon_all_results, 
+store_first_all_results, and ingest_stats.  stats files are checked the 
+same way everywhere: ColHeaders must have StructName and Volume_mm3, 
+data lines must follow ColHeaders, volumes must be numbers, and at 
+least one structure of interest must be present.
+"""
+
+import os
+
+# FreeSurfer structure name -> database column name
+aseg_cols = {'Left-Lateral-Ventricle': 'left_lateral_ventricle', 
+             'Left-Inf-Lat-Vent': 'left_inf_lat_vent', 
+             'Left-Cerebellum-Cortex': 'left_cerebellum_cortex', 
+             'Left-Thalamus-Proper': 'left_thalamus_proper', 
+             'Left-Caudate': 'left_caudate', 
+             'Left-Putamen': 'left_putamen', 
+             'Left-Pallidum': 'left_pallidum', 
+             'Brain-Stem': 'brain_stem', 
+             'Left-Hippocampus': 'left_hippocampus', 
+             'Left-Amygdala': 'left_amygdala', 
+             'CSF': 'csf', 
+             'Left-Accumbens-area': 'left_accumbens_area', 
+             'Left-VentralDC': 'left_ventraldc', 
+             'Right-Lateral-Ventricle': 'right_lateral_ventricle', 
+             'Right-Inf-Lat-Vent': 'right_inf_lat_vent', 
+             'Right-Cerebellum-Cortex': 'right_cerebellum_cortex', 
+             'Right-Thalamus-Proper': 'right_thalamus_proper', 
+             'Right-Caudate': 'right_caudate', 
+             'Right-Putamen': 'right_putamen', 
+             'Right-Pallidum': 'right_pallidum', 
+             'Right-Hippocampus': 'right_hippocampus', 
+             'Right-Amygdala': 'right_amygdala', 
+             'Right-Accumbens-area': 'right_accumbens_area', 
+             'Right-VentralDC': 'right_ventraldc', 
+             'Optic-Chiasm': 'optic_chiasm', 
+             'Left-Cerebellum-White-Matter': 'left_cerebellum_wht_mtr', 
+             '3rd-Ventricle': 'third_ventricle', 
+             '4th-Ventricle': 'fourth_ventricle', 
+             'Right-Cerebellum-White-Matter': 'right_cerebellum_wht_mtr', 
+             '5th-Ventricle': 'fifth_ventricle'}
+
+# FIRST structure name -> database column name
+first_cols = {'Left-Thalamus-Proper': 'left_thalamus_proper', 
+              'Left-Caudate': 'left_caudate', 
+              'Left-Putamen': 'left_putamen', 
+              'Left-Pallidum': 'left_pallidum', 
+              'Brain-Stem': 'brain_stem', 
+              'Left-Hippocampus': 'left_hippocampus', 
+              'Left-Amygdala': 'left_amygdala', 
+              'CSF': 'csf', 
+              'Left-Accumbens-area': 'left_accumbens_area', 
+              'Right-Thalamus-Proper': 'right_thalamus_proper', 
+              'Right-Caudate': 'right_caudate', 
+              'Right-Putamen': 'right_putamen', 
+              'Right-Pallidum': 'right_pallidum', 
+              'Right-Hippocampus': 'right_hippocampus', 
+              'Right-Amygdala': 'right_amygdala', 
+              'Right-Accumbens-area': 'right_accumbens_area'}
+
+# database column name -> FIRST file name
+first_files = (('brain_stem_file', 'first-BrStem_first.vtk'), 
+               ('left_accumbens_area_file', 'first-L_Accu_first.vtk'), 
+               ('left_amygdala_file', 'first-L_Amyg_first.vtk'), 
+               ('left_caudate_file', 'first-L_Caud_first.vtk'), 
+               ('left_hippocampus_file', 'first-L_Hipp_first.vtk'), 
+               ('left_pallidum_file', 'first-L_Pall_first.vtk'), 
+               ('left_putamen_file', 'first-L_Puta_first.vtk'), 
+               ('left_thalamus_proper_file', 'first-L_Thal_first.vtk'), 
+               ('right_accumbens_area_file', 'first-R_Accu_first.vtk'), 
+               ('right_amygdala_file', 'first-R_Amyg_first.vtk'), 
+               ('right_caudate_file', 'first-R_Caud_first.vtk'), 
+               ('right_hippocampus_file', 'first-R_Hipp_first.vtk'), 
+               ('right_pallidum_file', 'first-R_Pall_first.vtk'), 
+               ('right_putamen_file', 'first-R_Puta_first.vtk'), 
+               ('right_thalamus_proper_file', 'first-R_Thal_first.vtk'))
+
+first_stats_name = 'first.stats'
+
+class StatsError(Exception):
+
+    """error in a stats file"""
+
+def parse_stats(fo, cols, fname):
+
+    """parse a stats file
+
+    fo is an open file (or any iterable of lines), cols maps structure 
+    names to database column names, and fname is used in error messages
+
+    returns (vols, missing) where vols maps each column in cols to its 
+    volume (None if the structure is missing) and missing is a sorted 
+    list of the missing structure names; raises StatsError if the file 
+    is bad or has none of the structures
+    """
+
+    vols = {}
+    name_index = None
+    for (line_no, line) in enumerate(fo):
+        if line.startswith('#'):
+            if line.startswith('# ColHeaders'):
+                headers = line.split()[2:]
+                for col in ('StructName', 'Volume_mm3'):
+                    if col not in headers:
+                        raise StatsError('%s not in ColHeaders' % col)
+                name_index = headers.index('StructName')
+                vol_index = headers.index('Volume_mm3')
+            continue
+        if name_index is None:
+            fmt = 'data before ColHeaders on line %d of %s'
+            raise StatsError(fmt % (line_no+1, fname))
+        row = line.split()
+        if len(row) <= name_index:
+            continue
+        col = cols.get(row[name_index])
+        if col is None:
+            continue
+        try:
+            vols[col] = float(row[vol_index])
+        except (IndexError, ValueError):
+            fmt = 'bad volume on line %d of %s'
+            raise StatsError(fmt % (line_no+1, fname))
+
+    missing = []
+    for (struct_name, col) in cols.iteritems():
+        if col not in vols:
+            missing.append(struct_name)
+            vols[col] = None
+    if len(missing) == len(cols):
+        raise StatsError('no structures of interest found in %s' % fname)
+    missing.sort()
+
+    return (vols, missing)
+
+def read_aseg(fname):
+    """read an aseg.stats file; returns (vols, missing structures)"""
+    try:
+        fo = open(fname)
+    except IOError, data:
+        raise StatsError(str(data))
+    try:
+        return parse_stats(fo, aseg_cols, fname)
+    finally:
+        fo.close()
+
+def first_file_params(names):
+    """return (params, missing files) for the FIRST files, given the 
+    names of the files present
+
+    params maps the file columns to the file names (or None)"""
+    params = {}
+    missing = []
+    for (col, fname) in first_files:
+        if fname in names:
+            params[col] = fname
+        else:
+            params[col] = None
+            missing.append(fname)
+    return (params, missing)
+
+def read_first(first_dir):
+    """read the results in a FIRST directory
+
+    returns (params, missing structures, missing files), where params 
+    has the volume and file columns"""
+    if not os.path.isdir(first_dir):
+        raise StatsError('%s: not a directory' % first_dir)
+    (params, missing_files) = first_file_params(set(os.listdir(first_dir)))
+    stats_file = os.path.join(first_dir, first_stats_name)
+    try:
+        fo = open(stats_file)
+    except IOError, data:
+        raise StatsError(str(data))
+    try:
+        (vols, missing_structures) = parse_stats(fo, first_cols, stats_file)
+    finally:
+        fo.close()
+    params.update(vols)
+    return (params, missing_structures, missing_files)
+
+# eof
@@ -0,0 +1,99 @@
+# See file COPYING distributed with ndar-backend for copyright and license.
+
+"""structural QA statistics for all tissue classes in one pass over the 
+volume
+
+this replaces fslmaths (to make the masks) and fslstats (once per mask) 
+in run_structural_qa; each <class>.stats file has the output of 
+fslstats -R -r -m -s -v:
+
+    min max robust_min robust_max mean std voxels volume
+
+the robust range is taken as the 2nd and 98th percentiles of the masked 
+voxels, which can differ slightly from the histogram-based estimate 
+fslstats makes.
+
+write_stats() is used by the structural_qa_stats script and by the 
+nipype workflow in unsupported/qa.py; store_structural_qa reads the 
+files it writes.
+"""
+
+import os
+import numpy
+import nibabel
+
+# tissue classes in the FAST label map (fast -t 1)
+seg_labels = (('csf', 1), 
+              ('gm', 2), 
+              ('wm', 3))
+
+def load(fname):
+    """load a volume as a 3-D numpy array, also returning the voxel volume
+
+    a 4-D volume with a single frame is taken as 3-D; raises ValueError 
+    for any other shape
+    """
+    im = nibabel.load(fname)
+    data = numpy.asarray(im.get_data())
+    if data.ndim == 4 and data.shape[3] == 1:
+        data = data[..., 0]
+    if data.ndim != 3:
+        fmt = '%s: expected a 3-D volume, found shape %s'
+        raise ValueError(fmt % (fname, data.shape))
+    voxel_volume = numpy.prod(im.get_header().get_zooms()[:3])
+    return (data, voxel_volume)
+
+def stats(values, voxel_volume):
+    """return the fslstats -R -r -m -s -v output for the masked values"""
+    n = values.size
+    if not n:
+        return [0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0, 0.0]
+    (robust_min, robust_max) = numpy.percentile(values, (2, 98))
+    if n > 1:
+        std = values.std(ddof=1)
+    else:
+        std = 0.0
+    return [values.min(), 
+            values.max(), 
+            robust_min, 
+            robust_max, 
+            values.mean(), 
+            std, 
+            n, 
+            n * voxel_volume]
+
+def write_stats(volume, outskin_mask, brain_mask, seg, output_dir):
+    """write <class>.stats for each tissue class to output_dir, returning 
+    the list of file names
+
+    raises ValueError if a volume isn't 3-D or a mask or the label map 
+    doesn't match the volume
+    """
+    (vol, voxel_volume) = load(volume)
+    outskin = load(outskin_mask)[0]
+    brain = load(brain_mask)[0]
+    seg = load(seg)[0]
+    for (name, im) in (('outskin mask', outskin), 
+                       ('brain mask', brain), 
+                       ('label map', seg)):
+        if im.shape != vol.shape:
+            fmt = '%s shape %s does not match volume shape %s'
+            raise ValueError(fmt % (name, im.shape, vol.shape))
+    vol = vol.astype(numpy.float64)
+    seg = numpy.rint(seg).astype(numpy.int32)
+    # external is the complement of the outer skin mask 
+    # (fslmaths -sub 1 -mul -1)
+    masks = [('external', outskin != 1), ('brain', brain != 0)]
+    for (c, label) in seg_labels:
+        masks.append((c, seg == label))
+    fnames = []
+    for (c, mask) in masks:
+        fname = os.path.join(output_dir, '%s.stats' % c)
+        vals = stats(vol[mask], voxel_volume)
+        fo = open(fname, 'w')
+        fo.write('%.6f %.6f %.6f %.6f %.6f %.6f %d %.6f \n' % tuple(vals))
+        fo.close()
+        fnames.append(fname)
+    return fnames
+
+# eof
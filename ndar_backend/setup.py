@@ -10,7 +10,10 @@ setup(name='ndar-backend',
       author='Christian Haselgrove', 
       author_email='christian.haselgrove@umassmed.edu', 
       url='https://github.com/chaselgrove/ndar/ndar_backend', 
-      scripts=['store_first_all_results', 
+      py_modules=['ndar_db', 'ndar_stats', 'ndar_structural_qa'], 
+      scripts=['ingest_stats', 
+               'load_spool', 
+               'store_first_all_results', 
                'store_recon_all_results', 
                'store_structural_qa'], 
       classifiers=['Development Status :: 3 - Alpha', 
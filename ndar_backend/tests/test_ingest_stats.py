@@ -0,0 +1,227 @@
+import os
+import sys
+import imp
+import zipfile
+import tempfile
+import shutil
+import boto.exception
+import boto.s3.prefix
+import nose.tools
+import ndar_stats
+
+# ingest_stats is a script, not a module
+sys.dont_write_bytecode = True
+script = os.path.join(os.path.dirname(__file__), '..', 'ingest_stats')
+ingest_stats = imp.load_source('ingest_stats', script)
+
+subj_id = 'NDAR_INV00000001-120-1'
+header = '# ColHeaders  Index SegId NVoxels Volume_mm3 StructName\n'
+aseg = header + '  1  4  100  5000  Left-Lateral-Ventricle\n'
+first = header + '  1  16  100  20000  Brain-Stem\n'
+
+def setup():
+    global tempdir
+    tempdir = tempfile.mkdtemp()
+    return
+
+def teardown():
+    shutil.rmtree(tempdir)
+    return
+
+def write_zip(name, members):
+    """write a zip file of (name, data) pairs, returning its path"""
+    path = os.path.join(tempdir, name)
+    zf = zipfile.ZipFile(path, 'w')
+    for (member_name, data) in members:
+        zf.writestr(member_name, data)
+    zf.close()
+    return path
+
+class Key:
+
+    def __init__(self, objects, name):
+        self.objects = objects
+        self.name = name
+        self.size = len(objects.get(name, ''))
+        return
+
+    def get_contents_as_string(self, headers=None):
+        if self.name not in self.objects:
+            raise boto.exception.S3ResponseError(404, 'Not Found')
+        return self.objects[self.name]
+
+class Bucket:
+
+    """just enough of a boto bucket for find_s3() and read_s3_dir()"""
+
+    name = 'bucket'
+
+    def __init__(self, objects):
+        self.objects = objects
+        return
+
+    def new_key(self, name):
+        return Key(self.objects, name)
+
+    def list(self, prefix='', delimiter=''):
+        prefixes = set()
+        for name in sorted(self.objects):
+            if not name.startswith(prefix):
+                continue
+            rest = name[len(prefix):]
+            if delimiter in rest:
+                p = prefix + rest.split(delimiter)[0] + delimiter
+                if p not in prefixes:
+                    prefixes.add(p)
+                    yield boto.s3.prefix.Prefix(self, p)
+            else:
+                yield Key(self.objects, name)
+        return
+
+def test_parse_subj_id():
+    nose.tools.assert_equal(ingest_stats.parse_subj_id(subj_id), 
+                            ('NDAR_INV00000001', 120, 1))
+    for bad in ('NDAR_INV00000001-120', 
+                '-120-1', 
+                'NDAR_INV00000001-x-1', 
+                'bogus_subject-120-1'):
+        nose.tools.assert_equal(ingest_stats.parse_subj_id(bad), None)
+    return
+
+def test_read_zip_recon_all():
+    path = write_zip('recon_all.zip', 
+                     [('%s/stats/aseg.stats' % subj_id, aseg), 
+                      ('%s/mri/aseg.mgz' % subj_id, 'x')])
+    zf = zipfile.ZipFile(path)
+    (params, 
+     missing_structures, 
+     missing_files) = ingest_stats.read_zip(zf, subj_id, 'recon_all', path)
+    nose.tools.assert_equal(params['left_lateral_ventricle'], 5000.0)
+    nose.tools.assert_equal(len(missing_structures), 
+                            len(ndar_stats.aseg_cols) - 1)
+    nose.tools.assert_equal(missing_files, [])
+    # no FIRST results in a recon-all zip
+    try:
+        ingest_stats.read_zip(zf, subj_id, 'first_all', path)
+    except ndar_stats.StatsError, exc:
+        msg = 'no %s/first.stats in %s' % (subj_id, path)
+        nose.tools.assert_equal(str(exc), msg)
+    else:
+        raise AssertionError('no StatsError')
+    return
+
+def test_read_zip_first_all():
+    path = write_zip('first_all.zip', 
+                     [('%s/first.stats' % subj_id, first), 
+                      ('%s/first-BrStem_first.vtk' % subj_id, ''), 
+                      ('%s/sub/first-L_Accu_first.vtk' % subj_id, ''), 
+                      ('other/first-L_Amyg_first.vtk', '')])
+    zf = zipfile.ZipFile(path)
+    (params, 
+     missing_structures, 
+     missing_files) = ingest_stats.read_zip(zf, subj_id, 'first_all', path)
+    nose.tools.assert_equal(params['brain_stem'], 20000.0)
+    nose.tools.assert_equal(params['brain_stem_file'], 
+                            'first-BrStem_first.vtk')
+    # only files directly in the subject directory count
+    nose.tools.assert_equal(params['left_accumbens_area_file'], None)
+    nose.tools.assert_equal(params['left_amygdala_file'], None)
+    nose.tools.assert_equal(len(missing_files), 
+                            len(ndar_stats.first_files) - 1)
+    return
+
+def test_read_subject():
+    """errors come back as strings rather than being raised"""
+    path = write_zip('%s.zip' % subj_id, 
+                     [('%s/stats/aseg.stats' % subj_id, aseg)])
+    result = ingest_stats.read_subject((subj_id, 'zip', path, None, 
+                                        'recon_all'))
+    nose.tools.assert_equal(result[0], subj_id)
+    nose.tools.assert_equal(result[1]['left_lateral_ventricle'], 5000.0)
+    nose.tools.assert_equal(result[4], None)
+    bad = os.path.join(tempdir, 'bad.zip')
+    open(bad, 'w').write('not a zip file')
+    result = ingest_stats.read_subject((subj_id, 'zip', bad, None, 
+                                        'recon_all'))
+    nose.tools.assert_equal(result[:4], (subj_id, None, None, None))
+    nose.tools.assert_equal(result[4], 'File is not a zip file')
+    return
+
+def test_find_local():
+    dir = tempfile.mkdtemp(dir=tempdir)
+    os.mkdir(os.path.join(dir, subj_id))
+    open(os.path.join(dir, 'NDAR_INV00000002-120-2.zip'), 'w').write('')
+    open(os.path.join(dir, 'README'), 'w').write('')
+    nose.tools.assert_equal(list(ingest_stats.find_local(dir)), 
+                            [(subj_id, 
+                              'dir', 
+                              os.path.join(dir, subj_id), 
+                              None), 
+                             ('NDAR_INV00000002-120-2', 
+                              'zip', 
+                              os.path.join(dir, 
+                                           'NDAR_INV00000002-120-2.zip'), 
+                              None)])
+    return
+
+def test_s3_dirs():
+    """subject directories on S3 are found and read as well as zips"""
+    objects = {'results/%s/stats/aseg.stats' % subj_id: aseg, 
+               'results/%s/mri/aseg.mgz' % subj_id: 'x', 
+               'results/NDAR_INV00000002-120-2.zip': 'zip data', 
+               'results/NDAR_INV00000003-120-3/mri/aseg.mgz': 'x', 
+               'results/README': '', 
+               'other/NDAR_INV00000004-120-4.zip': ''}
+    bucket = Bucket(objects)
+    found = list(ingest_stats.find_s3(bucket, 'results/'))
+    nose.tools.assert_equal(sorted(found), 
+                            [('NDAR_INV00000001-120-1', 
+                              's3dir', 
+                              'results/NDAR_INV00000001-120-1/', 
+                              None), 
+                             ('NDAR_INV00000002-120-2', 
+                              's3', 
+                              'results/NDAR_INV00000002-120-2.zip', 
+                              8), 
+                             ('NDAR_INV00000003-120-3', 
+                              's3dir', 
+                              'results/NDAR_INV00000003-120-3/', 
+                              None)])
+    (params, 
+     missing_structures, 
+     missing_files) = ingest_stats.read_s3_dir(bucket, 
+                                               'results/%s/' % subj_id, 
+                                               'recon_all')
+    nose.tools.assert_equal(params['left_lateral_ventricle'], 5000.0)
+    nose.tools.assert_equal(missing_files, [])
+    # no stats file
+    try:
+        ingest_stats.read_s3_dir(bucket, 
+                                 'results/NDAR_INV00000003-120-3/', 
+                                 'recon_all')
+    except ndar_stats.StatsError, exc:
+        msg = 'no s3://bucket/results/NDAR_INV00000003-120-3/stats/aseg.stats'
+        nose.tools.assert_equal(str(exc), msg)
+    else:
+        raise AssertionError('no StatsError')
+    return
+
+def test_s3_dir_first_all():
+    subj_prefix = 'results/%s/' % subj_id
+    objects = {subj_prefix + 'first.stats': first, 
+               subj_prefix + 'first-BrStem_first.vtk': '', 
+               subj_prefix + 'sub/first-L_Accu_first.vtk': ''}
+    (params, 
+     missing_structures, 
+     missing_files) = ingest_stats.read_s3_dir(Bucket(objects), 
+                                               subj_prefix, 
+                                               'first_all')
+    nose.tools.assert_equal(params['brain_stem'], 20000.0)
+    nose.tools.assert_equal(params['brain_stem_file'], 
+                            'first-BrStem_first.vtk')
+    nose.tools.assert_equal(params['left_accumbens_area_file'], None)
+    nose.tools.assert_equal(len(missing_files), 
+                            len(ndar_stats.first_files) - 1)
+    return
+
+# eof
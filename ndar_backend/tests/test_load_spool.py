@@ -0,0 +1,237 @@
+import os
+import shutil
+import tempfile
+import sqlite3
+import nose.tools
+import ndar_db
+
+def setup():
+    global tempdir
+    tempdir = tempfile.mkdtemp()
+    return
+
+def teardown():
+    shutil.rmtree(tempdir)
+    return
+
+def new_db():
+    db = sqlite3.connect(':memory:')
+    db.execute("""CREATE TABLE spool_loaded (spool_id VARCHAR PRIMARY KEY, 
+                                             loaded TIMESTAMP 
+                                                    DEFAULT CURRENT_TIMESTAMP 
+                                                    NOT NULL)""")
+    db.execute("""CREATE TABLE basic_check (image_file VARCHAR NOT NULL, 
+                                            stdout VARCHAR)""")
+    db.execute('CREATE TABLE summary_changes (image_file VARCHAR)')
+    db.commit()
+    return db
+
+def new_spool():
+    return tempfile.mkdtemp(dir=tempdir)
+
+def spool(dir, image_file, stdout='ok'):
+    """spool a file as store_basic_check does"""
+    writer = ndar_db.Writer(dir)
+    writer.insert('basic_check', {'image_file': image_file, 'stdout': stdout})
+    writer.insert('summary_changes', {'image_file': image_file})
+    return writer.commit()
+
+def listdir(dir, subdir):
+    return sorted(os.listdir(os.path.join(dir, subdir)))
+
+def rows(db, table):
+    return sorted(db.execute('SELECT * FROM %s' % table).fetchall())
+
+class FlakyConnection:
+
+    """a connection whose inserts fail (as after a lost connection) 
+    while down is set"""
+
+    def __init__(self, db):
+        self.db = db
+        self.down = False
+        return
+
+    def cursor(self):
+        return FlakyCursor(self, self.db.cursor())
+
+    def commit(self):
+        self.db.commit()
+        return
+
+    def rollback(self):
+        self.db.rollback()
+        return
+
+class FlakyCursor:
+
+    def __init__(self, connection, c):
+        self.connection = connection
+        self.c = c
+        return
+
+    def __iter__(self):
+        return iter(self.c)
+
+    def _check(self, query):
+        if self.connection.down and not query.startswith('SELECT spool_id '):
+            raise sqlite3.OperationalError('connection lost')
+        return
+
+    def execute(self, query, params=()):
+        self._check(query)
+        return self.c.execute(query, params)
+
+    def executemany(self, query, params):
+        self._check(query)
+        return self.c.executemany(query, params)
+
+    def close(self):
+        self.c.close()
+        return
+
+def test_spool():
+    dir = new_spool()
+    path = spool(dir, 's3://b/a.zip')
+    nose.tools.assert_equal(os.path.dirname(path), os.path.join(dir, 'new'))
+    nose.tools.assert_true(path.endswith(ndar_db.spool_suffix))
+    nose.tools.assert_equal(listdir(dir, 'tmp'), [])
+    (spool_id, records) = ndar_db.read_spool_file(path)
+    nose.tools.assert_equal(os.path.basename(path), 
+                            spool_id + ndar_db.spool_suffix)
+    nose.tools.assert_equal(records, 
+                            [('basic_check', 
+                              {'image_file': 's3://b/a.zip', 'stdout': 'ok'}), 
+                             ('summary_changes', 
+                              {'image_file': 's3://b/a.zip'})])
+    return
+
+def test_load():
+    """files are loaded in batches and removed from the spool"""
+    dir = new_spool()
+    db = new_db()
+    image_files = [ 's3://b/%d.zip' % i for i in xrange(5) ]
+    for image_file in image_files:
+        spool(dir, image_file)
+    messages = []
+    counts = ndar_db.load_spool(db, dir, 2, messages.append)
+    nose.tools.assert_equal(counts, (5, 0, 0))
+    nose.tools.assert_equal(messages, ['loaded 2 files', 
+                                       'loaded 2 files', 
+                                       'loaded 1 files'])
+    nose.tools.assert_equal(rows(db, 'basic_check'), 
+                            [ (f, 'ok') for f in image_files ])
+    nose.tools.assert_equal(rows(db, 'summary_changes'), 
+                            [ (f, ) for f in image_files ])
+    nose.tools.assert_equal(len(rows(db, 'spool_loaded')), 5)
+    nose.tools.assert_equal(listdir(dir, 'new'), [])
+    # nothing left to do
+    nose.tools.assert_equal(ndar_db.load_spool(db, dir), (0, 0, 0))
+    return
+
+def test_dedupe():
+    """a file that is loaded again (after a crash between the commit 
+    and the unlink, say) is skipped"""
+    dir = new_spool()
+    db = new_db()
+    path = spool(dir, 's3://b/a.zip')
+    copy = os.path.join(tempdir, 'copy')
+    shutil.copy(path, copy)
+    nose.tools.assert_equal(ndar_db.load_spool(db, dir), (1, 0, 0))
+    shutil.move(copy, path)
+    spool(dir, 's3://b/b.zip')
+    nose.tools.assert_equal(ndar_db.load_spool(db, dir), (1, 1, 0))
+    nose.tools.assert_equal(rows(db, 'basic_check'), 
+                            [('s3://b/a.zip', 'ok'), ('s3://b/b.zip', 'ok')])
+    nose.tools.assert_equal(listdir(dir, 'new'), [])
+    return
+
+def test_dedupe_in_lists():
+    """the loaded IDs are looked up an IN (...) list at a time"""
+    dir = new_spool()
+    db = new_db()
+    paths = [ spool(dir, 's3://b/%d.zip' % i) for i in xrange(5) ]
+    copies = []
+    for path in paths:
+        copies.append(os.path.join(tempdir, os.path.basename(path)))
+        shutil.copy(path, copies[-1])
+    ndar_db.load_spool(db, dir)
+    for (path, copy) in zip(paths, copies):
+        shutil.move(copy, path)
+    in_list_size = ndar_db.in_list_size
+    ndar_db.in_list_size = 2
+    try:
+        nose.tools.assert_equal(ndar_db.load_spool(db, dir), (0, 5, 0))
+    finally:
+        ndar_db.in_list_size = in_list_size
+    nose.tools.assert_equal(len(rows(db, 'basic_check')), 5)
+    return
+
+def test_bad_file():
+    """a file that fails in its batch is retried alone and moved to 
+    failed/ without losing the rest of the batch"""
+    dir = new_spool()
+    db = new_db()
+    spool(dir, 's3://b/a.zip')
+    # image_file is NOT NULL
+    bad = spool(dir, None)
+    spool(dir, 's3://b/c.zip')
+    messages = []
+    counts = ndar_db.load_spool(db, dir, log=messages.append)
+    nose.tools.assert_equal(counts, (2, 0, 1))
+    nose.tools.assert_true(messages[0].startswith('batch failed'))
+    # the failed batch was rolled back, so nothing is in twice
+    nose.tools.assert_equal(rows(db, 'basic_check'), 
+                            [('s3://b/a.zip', 'ok'), ('s3://b/c.zip', 'ok')])
+    nose.tools.assert_equal(len(rows(db, 'spool_loaded')), 2)
+    name = os.path.basename(bad)
+    nose.tools.assert_equal(listdir(dir, 'failed'), [name, name + '.error'])
+    nose.tools.assert_equal(listdir(dir, 'new'), [])
+    return
+
+def test_unreadable():
+    dir = new_spool()
+    db = new_db()
+    spool(dir, 's3://b/a.zip')
+    fo = open(os.path.join(dir, 'new', 'bogus' + ndar_db.spool_suffix), 'w')
+    fo.write('not marshal data')
+    fo.close()
+    nose.tools.assert_equal(ndar_db.load_spool(db, dir), (1, 0, 1))
+    nose.tools.assert_equal(listdir(dir, 'failed'), 
+                            ['bogus.spool', 'bogus.spool.error'])
+    return
+
+def test_retry():
+    """a lost connection leaves the files for the next load"""
+    dir = new_spool()
+    db = FlakyConnection(new_db())
+    for i in xrange(3):
+        spool(dir, 's3://b/%d.zip' % i)
+    names = listdir(dir, 'new')
+    db.down = True
+    nose.tools.assert_raises(sqlite3.OperationalError, 
+                             ndar_db.load_spool, 
+                             db, 
+                             dir)
+    nose.tools.assert_equal(listdir(dir, 'new'), names)
+    nose.tools.assert_equal(listdir(dir, 'failed'), [])
+    nose.tools.assert_equal(rows(db.db, 'basic_check'), [])
+    db.down = False
+    nose.tools.assert_equal(ndar_db.load_spool(db, dir), (3, 0, 0))
+    nose.tools.assert_equal(len(rows(db.db, 'basic_check')), 3)
+    nose.tools.assert_equal(listdir(dir, 'new'), [])
+    return
+
+def test_lock():
+    """only one loader runs on a spool at a time"""
+    dir = new_spool()
+    spool(dir, 's3://b/a.zip')
+    with ndar_db.SpoolLock(dir):
+        nose.tools.assert_raises(ndar_db.DBError, 
+                                 ndar_db.load_spool, 
+                                 new_db(), 
+                                 dir)
+    nose.tools.assert_equal(len(listdir(dir, 'new')), 1)
+    return
+
+# eof
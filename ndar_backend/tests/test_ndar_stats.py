@@ -0,0 +1,122 @@
+import os
+import tempfile
+import shutil
+import nose.tools
+import ndar_stats
+
+cols = {'Left-Caudate': 'left_caudate', 
+        'Right-Caudate': 'right_caudate', 
+        'CSF': 'csf'}
+
+header = '# ColHeaders  Index SegId NVoxels Volume_mm3 StructName\n'
+
+def setup():
+    global tempdir
+    tempdir = tempfile.mkdtemp()
+    return
+
+def teardown():
+    shutil.rmtree(tempdir)
+    return
+
+def row(name, volume):
+    return '  1  11  100  %s  %s\n' % (volume, name)
+
+def check_error(lines, msg):
+    """parse_stats() raises StatsError with the message msg"""
+    try:
+        ndar_stats.parse_stats(lines, cols, 'test.stats')
+    except ndar_stats.StatsError, exc:
+        nose.tools.assert_equal(str(exc), msg)
+    else:
+        raise AssertionError('no StatsError')
+    return
+
+def test_parse_stats():
+    lines = ['# Title Segmentation Statistics\n', 
+             header, 
+             row('Left-Caudate', '3500.5'), 
+             row('Right-Caudate', '3600'), 
+             row('CSF', '1000'), 
+             row('Left-Putamen', '4000'), 
+             '\n']
+    (vols, missing) = ndar_stats.parse_stats(lines, cols, 'test.stats')
+    nose.tools.assert_equal(vols, {'left_caudate': 3500.5, 
+                                   'right_caudate': 3600.0, 
+                                   'csf': 1000.0})
+    nose.tools.assert_equal(missing, [])
+    return
+
+def test_missing_structures():
+    lines = [header, row('Right-Caudate', '3600')]
+    (vols, missing) = ndar_stats.parse_stats(lines, cols, 'test.stats')
+    nose.tools.assert_equal(vols, {'left_caudate': None, 
+                                   'right_caudate': 3600.0, 
+                                   'csf': None})
+    nose.tools.assert_equal(missing, ['CSF', 'Left-Caudate'])
+    return
+
+def test_no_structures():
+    check_error([header], 'no structures of interest found in test.stats')
+    check_error([header, row('Left-Putamen', '4000')], 
+                'no structures of interest found in test.stats')
+    return
+
+def test_col_headers():
+    check_error(['# ColHeaders  Index SegId NVoxels StructName\n', 
+                 row('CSF', '1000')], 
+                'Volume_mm3 not in ColHeaders')
+    check_error(['# ColHeaders  Index SegId NVoxels Volume_mm3\n'], 
+                'StructName not in ColHeaders')
+    return
+
+def test_data_before_col_headers():
+    check_error(['# Title\n', row('CSF', '1000'), header], 
+                'data before ColHeaders on line 2 of test.stats')
+    return
+
+def test_bad_volume():
+    check_error([header, row('CSF', '1000'), row('Left-Caudate', 'x')], 
+                'bad volume on line 3 of test.stats')
+    # no volume for a structure of interest
+    check_error(['# ColHeaders  StructName Volume_mm3\n', 'Left-Caudate\n'], 
+                'bad volume on line 2 of test.stats')
+    return
+
+def test_read_aseg():
+    fname = os.path.join(tempdir, 'aseg.stats')
+    open(fname, 'w').write(header + row('Left-Lateral-Ventricle', '5000'))
+    (vols, missing) = ndar_stats.read_aseg(fname)
+    nose.tools.assert_equal(vols['left_lateral_ventricle'], 5000.0)
+    nose.tools.assert_equal(len(missing), len(ndar_stats.aseg_cols) - 1)
+    nose.tools.assert_raises(ndar_stats.StatsError, 
+                             ndar_stats.read_aseg, 
+                             os.path.join(tempdir, 'none.stats'))
+    return
+
+def test_read_first():
+    first_dir = os.path.join(tempdir, 'first')
+    os.mkdir(first_dir)
+    nose.tools.assert_raises(ndar_stats.StatsError, 
+                             ndar_stats.read_first, 
+                             first_dir)
+    fname = os.path.join(first_dir, ndar_stats.first_stats_name)
+    open(fname, 'w').write(header + row('Brain-Stem', '20000'))
+    open(os.path.join(first_dir, 'first-BrStem_first.vtk'), 'w').write('')
+    (params, 
+     missing_structures, 
+     missing_files) = ndar_stats.read_first(first_dir)
+    nose.tools.assert_equal(params['brain_stem'], 20000.0)
+    nose.tools.assert_equal(params['brain_stem_file'], 
+                            'first-BrStem_first.vtk')
+    nose.tools.assert_equal(params['left_caudate_file'], None)
+    nose.tools.assert_equal(len(missing_structures), 
+                            len(ndar_stats.first_cols) - 1)
+    nose.tools.assert_equal(len(missing_files), 
+                            len(ndar_stats.first_files) - 1)
+    nose.tools.assert_raises(ndar_stats.StatsError, 
+                             ndar_stats.read_first, 
+                             fname)
+    return
+
+# eof
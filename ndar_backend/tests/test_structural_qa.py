@@ -0,0 +1,101 @@
+import os
+import tempfile
+import shutil
+import numpy
+import nibabel
+import nose.tools
+import ndar_structural_qa
+
+def setup():
+    global tempdir
+    tempdir = tempfile.mkdtemp()
+    return
+
+def teardown():
+    shutil.rmtree(tempdir)
+    return
+
+def save(data, name):
+    fname = os.path.join(tempdir, name)
+    nibabel.save(nibabel.Nifti1Image(data, numpy.diag([2, 2, 2, 1])), fname)
+    return fname
+
+def volumes(shape=(10, 10, 10)):
+    """return the volume, outer skin mask, brain mask, and label map"""
+    rnd = numpy.random.RandomState(0)
+    vol = rnd.uniform(0, 100, shape).astype(numpy.float32)
+    outskin = numpy.zeros(shape[:3], numpy.uint8)
+    outskin[2:8, 2:8, 2:8] = 1
+    brain = numpy.zeros(shape[:3], numpy.uint8)
+    brain[3:7, 3:7, 3:7] = 1
+    seg = numpy.zeros(shape[:3], numpy.uint8)
+    seg[3:7, 3:7, 3:7] = rnd.randint(1, 4, (4, 4, 4))
+    return (save(vol, 'vol.nii.gz'), 
+            save(outskin, 'outskin.nii.gz'), 
+            save(brain, 'brain.nii.gz'), 
+            save(seg, 'seg.nii.gz'))
+
+def read_stats(fname):
+    return [ float(v) for v in open(fname).read().split() ]
+
+def test_write_stats():
+    in_files = volumes()
+    output_dir = tempfile.mkdtemp(dir=tempdir)
+    fnames = ndar_structural_qa.write_stats(*(in_files + (output_dir, )))
+    nose.tools.assert_equal([ os.path.basename(f) for f in fnames ], 
+                            ['external.stats', 
+                             'brain.stats', 
+                             'csf.stats', 
+                             'gm.stats', 
+                             'wm.stats'])
+    vol = nibabel.load(in_files[0]).get_data()
+    brain = nibabel.load(in_files[2]).get_data() != 0
+    seg = nibabel.load(in_files[3]).get_data()
+    # min max robust_min robust_max mean std voxels volume
+    values = read_stats(fnames[1])
+    nose.tools.assert_almost_equal(values[0], vol[brain].min(), places=4)
+    nose.tools.assert_almost_equal(values[1], vol[brain].max(), places=4)
+    nose.tools.assert_almost_equal(values[4], vol[brain].mean(), places=4)
+    nose.tools.assert_almost_equal(values[5], 
+                                   vol[brain].std(ddof=1), 
+                                   places=4)
+    nose.tools.assert_equal(values[6:], [64, 512])
+    # external is everything outside the outer skin mask
+    nose.tools.assert_equal(read_stats(fnames[0])[6], 1000 - 216)
+    # the tissue classes partition the brain
+    n = sum([ read_stats(f)[6] for f in fnames[2:] ])
+    nose.tools.assert_equal(n, 64)
+    nose.tools.assert_equal(read_stats(fnames[3])[6], (seg == 2).sum())
+    return
+
+def test_stats_empty():
+    values = ndar_structural_qa.stats(numpy.zeros(0), 8.0)
+    nose.tools.assert_equal(values, [0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0, 0.0])
+    return
+
+def test_4d():
+    """a single-frame 4-D volume is taken as 3-D"""
+    in_files = volumes((10, 10, 10, 1))
+    (data, voxel_volume) = ndar_structural_qa.load(in_files[0])
+    nose.tools.assert_equal(data.shape, (10, 10, 10))
+    nose.tools.assert_equal(voxel_volume, 8)
+    output_dir = tempfile.mkdtemp(dir=tempdir)
+    fnames = ndar_structural_qa.write_stats(*(in_files + (output_dir, )))
+    nose.tools.assert_equal(len(fnames), 5)
+    return
+
+def test_bad_shapes():
+    in_files = volumes((10, 10, 10, 3))
+    nose.tools.assert_raises(ValueError, ndar_structural_qa.load, in_files[0])
+    in_files = volumes()
+    small = save(numpy.zeros((5, 5, 5), numpy.uint8), 'small.nii.gz')
+    nose.tools.assert_raises(ValueError, 
+                             ndar_structural_qa.write_stats, 
+                             in_files[0], 
+                             small, 
+                             in_files[2], 
+                             in_files[3], 
+                             tempdir)
+    return
+
+# eof
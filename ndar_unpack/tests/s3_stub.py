@@ -0,0 +1,134 @@
+"""a local S3 stub for the download tests
+
+Server serves objects (HEAD and GET, with Range and If-Match) at 
+http://127.0.0.1:<port>/<bucket>/<key>.  Faults can be injected: 
+truncate is a list of byte counts, and each GET takes the next one (if 
+any) and closes the connection after sending that many bytes; 
+replace_after_head replaces an object's data after it is first HEADed, 
+as if it were overwritten during a download.  Requests are recorded as 
+(method, path, headers).
+"""
+
+import threading
+import hashlib
+import BaseHTTPServer
+import SocketServer
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        return
+
+    def _object(self):
+        path = self.path.split('?')[0]
+        return self.server.objects.get(path.lstrip('/'))
+
+    def _headers(self, status, length, etag=None, extra=None):
+        self.send_response(status)
+        self.send_header('Content-Length', str(length))
+        if etag:
+            self.send_header('ETag', '"%s"' % etag)
+        for (name, value) in (extra or {}).iteritems():
+            self.send_header(name, value)
+        self.end_headers()
+        return
+
+    def _error(self, status, code):
+        body = '<Error><Code>%s</Code><Message>%s</Message></Error>' % \
+               (code, code)
+        self._headers(status, len(body), extra={'Content-Type': 'text/xml'})
+        self.wfile.write(body)
+        return
+
+    def do_HEAD(self):
+        self.server.record(self)
+        path = self.path.split('?')[0].strip('/')
+        if '/' not in path:
+            # the bucket
+            self._headers(200, 0)
+            return
+        data = self._object()
+        if data is None:
+            self._headers(404, 0)
+            return
+        etag = self.server.etag(path)
+        self._headers(200, len(data), etag)
+        if path in self.server.replace_after_head:
+            new_data = self.server.replace_after_head.pop(path)
+            self.server.objects[path] = new_data
+        return
+
+    def do_GET(self):
+        self.server.record(self)
+        path = self.path.split('?')[0].strip('/')
+        data = self._object()
+        if data is None:
+            self._error(404, 'NoSuchKey')
+            return
+        etag = self.server.etag(path)
+        if_match = self.headers.get('If-Match')
+        if if_match and if_match.strip('"') != etag:
+            self._error(412, 'PreconditionFailed')
+            return
+        status = 200
+        extra = {}
+        byte_range = self.headers.get('Range')
+        if byte_range:
+            (start, end) = byte_range.split('=')[1].split('-')
+            (start, end) = (int(start), min(int(end), len(data)-1))
+            extra['Content-Range'] = 'bytes %d-%d/%d' % (start, 
+                                                         end, 
+                                                         len(data))
+            data = data[start:end+1]
+            status = 206
+        self._headers(status, len(data), etag, extra)
+        with self.server.lock:
+            if self.server.truncate:
+                n = self.server.truncate.pop(0)
+                data = data[:n]
+                self.close_connection = True
+        self.wfile.write(data)
+        return
+
+class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), Handler)
+        self.objects = {}
+        # path -> ETag, to serve an ETag that doesn't match the data
+        self.etags = {}
+        self.truncate = []
+        self.replace_after_head = {}
+        self.requests = []
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return
+
+    @property
+    def endpoint(self):
+        return 'http://127.0.0.1:%d' % self.server_address[1]
+
+    def etag(self, path):
+        if path in self.etags:
+            return self.etags[path]
+        return hashlib.md5(self.objects[path]).hexdigest()
+
+    def record(self, handler):
+        with self.lock:
+            self.requests.append((handler.command, 
+                                  handler.path, 
+                                  dict(handler.headers)))
+        return
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        return
+
+# eof
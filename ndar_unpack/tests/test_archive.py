@@ -0,0 +1,129 @@
+import os
+import sys
+import imp
+import random
+import zipfile
+import tempfile
+import shutil
+import StringIO
+import nose.tools
+import dicom.dataset
+
+# ndar_unpack is a script, not a module
+sys.dont_write_bytecode = True
+script = os.path.join(os.path.dirname(__file__), '..', 'ndar_unpack')
+ndar_unpack = imp.load_source('ndar_unpack', script)
+
+series_uid = '1.2.3.4.5'
+n_slices = 4
+# random pixel data doesn't compress, so the members stay large
+pixel_bytes = 512 * 1024
+
+def setup():
+    global tempdir, zip_fname, member_data
+    tempdir = tempfile.mkdtemp()
+    ndar_unpack.output_level = ndar_unpack.SILENT
+    zip_fname = os.path.join(tempdir, 'dicom.zip')
+    member_data = {}
+    zf = zipfile.ZipFile(zip_fname, 'w', zipfile.ZIP_DEFLATED)
+    # write the slices in reverse order so the index has to sort them
+    for i in reversed(xrange(n_slices)):
+        name = 'series/slice_%d.dcm' % i
+        member_data[name] = dicom_data(i + 1)
+        zf.writestr(name, member_data[name])
+    zf.close()
+    return
+
+def teardown():
+    shutil.rmtree(tempdir)
+    return
+
+def dicom_data(instance_number):
+    """return a DICOM file with pixel_bytes of pixel data"""
+    meta = dicom.dataset.Dataset()
+    meta.MediaStorageSOPClassUID = '1.2.840.10008.5.1.4.1.1.4'
+    meta.MediaStorageSOPInstanceUID = '%s.%d' % (series_uid, instance_number)
+    meta.TransferSyntaxUID = '1.2.840.10008.1.2.1'
+    meta.ImplementationClassUID = '1.2.3.4'
+    ds = dicom.dataset.FileDataset('slice', 
+                                   {}, 
+                                   file_meta=meta, 
+                                   preamble='\0' * 128)
+    ds.is_little_endian = True
+    ds.is_implicit_VR = False
+    ds.SeriesInstanceUID = series_uid
+    ds.InstanceNumber = instance_number
+    ds.ImagePositionPatient = [0, 0, instance_number]
+    ds.Rows = 512
+    ds.Columns = pixel_bytes // 1024
+    ds.BitsAllocated = 16
+    ds.PixelData = os.urandom(pixel_bytes)
+    ds[0x7fe00010].VR = 'OW'
+    fo = StringIO.StringIO()
+    ds.save_as(fo)
+    return fo.getvalue()
+
+def open_archive():
+    unpacked_dir = tempfile.mkdtemp(dir=tempdir)
+    return ndar_unpack.Archive(zip_fname, unpacked_dir, True)
+
+def test_header():
+    archive = open_archive()
+    for name in sorted(archive.names):
+        fo = archive.open_seekable(name)
+        do = ndar_unpack.read_dicom_header(fo)
+        nose.tools.assert_equal(str(do.SeriesInstanceUID), series_uid)
+        nose.tools.assert_equal(fo.size, len(member_data[name]))
+        # only the header (and a read's worth after it) was decompressed
+        nose.tools.assert_true(fo.n_read < pixel_bytes // 10)
+        fo.close()
+    nose.tools.assert_equal(archive.extracted, set())
+    nose.tools.assert_equal(os.listdir(archive.unpacked_dir), [])
+    archive.close()
+    return
+
+def test_dicom_data():
+    archive = open_archive()
+    data_tempdir = os.path.dirname(archive.unpacked_dir)
+    data = ndar_unpack.DICOMData(data_tempdir, archive)
+    files = [ d['file'] for d in data.index ]
+    expected = [ 'series/slice_%d.dcm' % i for i in xrange(n_slices) ]
+    nose.tools.assert_equal(files, expected)
+    nose.tools.assert_equal(data.first_header.InstanceNumber, 1)
+    nose.tools.assert_equal(archive.extracted, set())
+    archive.close()
+    return
+
+def test_seek():
+    archive = open_archive()
+    name = 'series/slice_0.dcm'
+    data = member_data[name]
+    fo = archive.open_seekable(name)
+    ref = StringIO.StringIO(data)
+    rnd = random.Random(0)
+    for i in xrange(200):
+        op = rnd.choice(('read', 'seek_set', 'seek_cur', 'seek_end'))
+        if op == 'read':
+            n = rnd.choice((-1, 0, 1, 100, 20000))
+            nose.tools.assert_equal(fo.read(n), ref.read(n))
+        elif op == 'seek_set':
+            offset = rnd.randrange(len(data) + 100)
+            fo.seek(offset)
+            ref.seek(offset)
+        elif op == 'seek_cur':
+            offset = rnd.randrange(-ref.tell(), 50000)
+            fo.seek(offset, 1)
+            ref.seek(offset, 1)
+        else:
+            offset = -rnd.randrange(len(data))
+            fo.seek(offset, 2)
+            ref.seek(offset, 2)
+        nose.tools.assert_equal(fo.tell(), ref.tell())
+    fo.seek(0)
+    nose.tools.assert_equal(fo.read(), data)
+    nose.tools.assert_raises(IOError, fo.seek, -1)
+    fo.close()
+    archive.close()
+    return
+
+# eof
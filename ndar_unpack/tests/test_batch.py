@@ -0,0 +1,142 @@
+import os
+import sys
+import imp
+import json
+import tempfile
+import shutil
+import subprocess
+import numpy
+import nibabel
+import nose.tools
+
+# ndar_unpack is a script, not a module
+sys.dont_write_bytecode = True
+script = os.path.join(os.path.dirname(__file__), '..', 'ndar_unpack')
+ndar_unpack = imp.load_source('ndar_unpack', script)
+
+def setup():
+    global tempdir, good, bad
+    tempdir = tempfile.mkdtemp()
+    good = os.path.join(tempdir, 'good.nii.gz')
+    data = numpy.arange(120).reshape((4, 5, 6)).astype(numpy.int16)
+    nibabel.save(nibabel.Nifti1Image(data, numpy.eye(4)), good)
+    bad = os.path.join(tempdir, 'bad.nii.gz')
+    open(bad, 'w').write('not a volume\n')
+    return
+
+def teardown():
+    shutil.rmtree(tempdir)
+    return
+
+def manifest(rows):
+    """write a manifest of tab-separated rows in a new directory, 
+    returning the directory"""
+    dir = tempfile.mkdtemp(dir=tempdir)
+    fo = open(os.path.join(dir, 'manifest'), 'w')
+    for row in rows:
+        fo.write('%s\n' % '\t'.join(row))
+    fo.close()
+    return dir
+
+def run_batch(dir, *extra_args):
+    """run ndar_unpack --batch on dir/manifest, returning the exit value 
+    and the results by line number"""
+    results_fname = os.path.join(dir, 'results')
+    po = subprocess.Popen([sys.executable, 
+                           script, 
+                           '--batch', os.path.join(dir, 'manifest'), 
+                           '--results', results_fname, 
+                           '--jobs', '2'] + list(extra_args), 
+                          stdout=subprocess.PIPE, 
+                          stderr=subprocess.PIPE)
+    (stdout, stderr) = po.communicate()
+    results = {}
+    if os.path.exists(results_fname):
+        for line in open(results_fname):
+            result = json.loads(line)
+            results[result['line']] = result
+    return (po.returncode, results)
+
+def test_batch():
+    dir = manifest([(good, '-v', os.path.join(tempdir, 'out1.nii.gz')), 
+                    ('# a comment', ), 
+                    (bad, '-v', os.path.join(tempdir, 'out2.nii.gz')), 
+                    ('', ), 
+                    (good, '-v', os.path.join(tempdir, 'out3.txt')), 
+                    (good, '--bogus')])
+    (ev, results) = run_batch(dir)
+    nose.tools.assert_equal(ev, 1)
+    nose.tools.assert_equal(sorted(results), [1, 3, 5, 6])
+    for result in results.itervalues():
+        nose.tools.assert_equal(sorted(result), 
+                                ['cache', 'error', 'exit', 'format', 
+                                 'input', 'line', 'timings'])
+    # the good row
+    result = results[1]
+    nose.tools.assert_equal(result['exit'], 0)
+    nose.tools.assert_equal(result['input'], good)
+    nose.tools.assert_equal(result['error'], None)
+    nose.tools.assert_equal(result['format'], 'NIfTI-1 (gzipped)')
+    nose.tools.assert_true('total' in result['timings'])
+    out = nibabel.load(os.path.join(tempdir, 'out1.nii.gz'))
+    nose.tools.assert_equal(out.shape, (4, 5, 6))
+    # bad data
+    result = results[3]
+    nose.tools.assert_equal(result['exit'], 3)
+    nose.tools.assert_equal(result['input'], bad)
+    nose.tools.assert_true(result['error'].startswith('bad data'))
+    nose.tools.assert_false(os.path.exists(os.path.join(tempdir, 
+                                                        'out2.nii.gz')))
+    # bad arguments are caught before the row is run
+    result = results[5]
+    nose.tools.assert_equal(result['exit'], 1)
+    nose.tools.assert_equal(result['error'], 
+                            'unknown extension for volume %s' % \
+                            os.path.join(tempdir, 'out3.txt'))
+    nose.tools.assert_equal(result['timings'], {})
+    result = results[6]
+    nose.tools.assert_equal(result['exit'], 1)
+    nose.tools.assert_equal(result['error'], 'bad options')
+    return
+
+def test_batch_good():
+    dir = manifest([(good, '-v', os.path.join(tempdir, 'out4.nii.gz')), 
+                    (good, )])
+    (ev, results) = run_batch(dir)
+    nose.tools.assert_equal(ev, 0)
+    nose.tools.assert_equal([ results[n]['exit'] for n in (1, 2) ], [0, 0])
+    return
+
+def test_results_exist():
+    """existing results aren't overwritten"""
+    dir = manifest([(good, )])
+    open(os.path.join(dir, 'results'), 'w').write('{"line": 0}\n')
+    (ev, results) = run_batch(dir)
+    nose.tools.assert_equal(ev, 1)
+    nose.tools.assert_equal(open(os.path.join(dir, 'results')).read(), 
+                            '{"line": 0}\n')
+    return
+
+def test_read_manifest():
+    """row options are parsed per row, and others come from the batch 
+    command line"""
+    out = os.path.join(tempdir, 'out.nii.gz')
+    dir = manifest([(good, '-v', out), 
+                    (good, '--batch', 'x'), 
+                    (good, '-S')])
+    args = ndar_unpack.parser.parse_args(['--batch', 
+                                          os.path.join(dir, 'manifest'), 
+                                          '-q', 
+                                          '--threads', '3'])
+    items = ndar_unpack.read_manifest(args)
+    not_allowed = ['--batch, -S, and --version not allowed']
+    nose.tools.assert_equal([ (n, e) for (n, a, e) in items ], 
+                            [(1, []), (2, not_allowed), (3, not_allowed)])
+    item_args = items[0][1]
+    nose.tools.assert_equal(item_args.input, good)
+    nose.tools.assert_equal(item_args.volume, [out])
+    nose.tools.assert_equal(item_args.batch, None)
+    nose.tools.assert_equal((item_args.quiet, item_args.threads), (1, 3))
+    return
+
+# eof
@@ -0,0 +1,210 @@
+import os
+import sys
+import imp
+import time
+import hashlib
+import threading
+import tempfile
+import shutil
+import nose.tools
+import s3_stub
+
+# ndar_unpack is a script, not a module
+sys.dont_write_bytecode = True
+script = os.path.join(os.path.dirname(__file__), '..', 'ndar_unpack')
+ndar_unpack = imp.load_source('ndar_unpack', script)
+
+bucket_name = 'bucket'
+
+def setup():
+    global server, tempdir
+    server = s3_stub.Server()
+    tempdir = tempfile.mkdtemp()
+    ndar_unpack.output_level = ndar_unpack.SILENT
+    return
+
+def teardown():
+    server.stop()
+    shutil.rmtree(tempdir)
+    return
+
+class Cache:
+
+    """a fresh DownloadCache on the stub, fetching objects as 
+    ndar_unpack's main() does"""
+
+    def __init__(self, max_size=1):
+        server.objects = {}
+        server.etags = {}
+        server.requests = []
+        self.dir = tempfile.mkdtemp(dir=tempdir)
+        self.cache = ndar_unpack.DownloadCache(os.path.join(self.dir, 
+                                                            'cache'), 
+                                               max_size)
+        connect = lambda: ndar_unpack.s3_connect('x', 
+                                                 'y', 
+                                                 None, 
+                                                 server.endpoint)
+        self.pool = ndar_unpack.S3ConnectionPool(connect)
+        self.n_gets = 0
+        return
+
+    def put(self, key_name, data):
+        server.objects['%s/%s' % (bucket_name, key_name)] = data
+        return
+
+    def get(self, key_name, validate=False):
+        """get an object through the cache, returning (hit, data)"""
+        url = 's3://%s/%s' % (bucket_name, key_name)
+        if validate:
+            etag = ndar_unpack.s3_head(self.pool, bucket_name, key_name)[1]
+        else:
+            etag = None
+        download = lambda f: ndar_unpack.s3_download(self.pool, 
+                                                     bucket_name, 
+                                                     key_name, 
+                                                     f)
+        (fd, fname) = tempfile.mkstemp(dir=self.dir)
+        os.close(fd)
+        os.unlink(fname)
+        hit = self.cache.get(url, download, fname, etag)
+        data = open(fname, 'rb').read()
+        os.unlink(fname)
+        return (hit, data)
+
+    def gets(self):
+        """return the number of GETs since the last call"""
+        n = len([ r for r in server.requests if r[0] == 'GET' ])
+        (n, self.n_gets) = (n - self.n_gets, n)
+        return n
+
+    def entry(self, key_name):
+        """return the path of the cached copy of an object, or None"""
+        url = 's3://%s/%s' % (bucket_name, key_name)
+        entries = self.cache._entries(hashlib.sha1(url).hexdigest())
+        if not entries:
+            return None
+        return entries[0]
+
+    def lock(self, key_name):
+        url = 's3://%s/%s' % (bucket_name, key_name)
+        return self.cache._lock('%s.lock' % hashlib.sha1(url).hexdigest())
+
+def test_hit():
+    """a hit makes no GET (or any request without validation)"""
+    c = Cache()
+    data = os.urandom(1000)
+    c.put('a', data)
+    nose.tools.assert_equal(c.get('a'), (False, data))
+    nose.tools.assert_true(c.gets() > 0)
+    n_requests = len(server.requests)
+    nose.tools.assert_equal(c.get('a'), (True, data))
+    nose.tools.assert_equal(len(server.requests), n_requests)
+    nose.tools.assert_equal(c.get('a', validate=True), (True, data))
+    nose.tools.assert_equal(c.gets(), 0)
+    stats = c.cache.stats()
+    nose.tools.assert_equal((stats['hits'], stats['misses']), (2, 1))
+    nose.tools.assert_equal((stats['objects'], stats['size']), (1, 1000))
+    return
+
+def test_etag_change():
+    """a changed object is downloaded again when validated, and the old 
+    copy is dropped"""
+    c = Cache()
+    old_data = os.urandom(1000)
+    c.put('a', old_data)
+    c.get('a', validate=True)
+    old_entry = c.entry('a')
+    c.gets()
+    new_data = os.urandom(1000)
+    c.put('a', new_data)
+    # without validation the cached copy is used as it is
+    nose.tools.assert_equal(c.get('a'), (True, old_data))
+    nose.tools.assert_equal(c.get('a', validate=True), (False, new_data))
+    nose.tools.assert_true(c.gets() > 0)
+    nose.tools.assert_false(os.path.exists(old_entry))
+    new_etag = hashlib.md5(new_data).hexdigest()
+    nose.tools.assert_true(c.entry('a').endswith(new_etag))
+    nose.tools.assert_equal(c.get('a', validate=True), (True, new_data))
+    stats = c.cache.stats()
+    nose.tools.assert_equal((stats['hits'], stats['misses']), (2, 2))
+    nose.tools.assert_equal(stats['objects'], 1)
+    return
+
+def test_eviction():
+    """least recently used objects go first once the cache is over its 
+    size, and a hit counts as a use"""
+    c = Cache(max_size=1)
+    for key_name in ('a', 'b', 'c'):
+        c.put(key_name, os.urandom(400 * 1024))
+    c.get('a')
+    c.get('b')
+    # a was used before b
+    os.utime(c.entry('a'), (1000, 1000))
+    os.utime(c.entry('b'), (2000, 2000))
+    nose.tools.assert_equal(c.cache.stats()['evictions'], 0)
+    # now b is the least recently used
+    nose.tools.assert_true(c.get('a')[0])
+    c.get('c')
+    nose.tools.assert_equal(c.entry('b'), None)
+    nose.tools.assert_not_equal(c.entry('a'), None)
+    nose.tools.assert_not_equal(c.entry('c'), None)
+    stats = c.cache.stats()
+    nose.tools.assert_equal(stats['evictions'], 1)
+    nose.tools.assert_equal(stats['objects'], 2)
+    nose.tools.assert_true(stats['size'] <= 1024 * 1024)
+    # b was evicted, so it's a miss again
+    c.gets()
+    nose.tools.assert_false(c.get('b')[0])
+    nose.tools.assert_true(c.gets() > 0)
+    return
+
+def test_eviction_locked():
+    """an object locked by another run isn't evicted"""
+    c = Cache(max_size=1)
+    for key_name in ('a', 'b', 'c'):
+        c.put(key_name, os.urandom(400 * 1024))
+    c.get('a')
+    c.get('b')
+    os.utime(c.entry('a'), (1000, 1000))
+    os.utime(c.entry('b'), (2000, 2000))
+    lock = c.lock('a')
+    try:
+        c.get('c')
+    finally:
+        lock.close()
+    nose.tools.assert_not_equal(c.entry('a'), None)
+    nose.tools.assert_equal(c.entry('b'), None)
+    nose.tools.assert_equal(c.cache.stats()['evictions'], 1)
+    return
+
+def test_lock():
+    """a run waits for the URL's lock, and concurrent runs download an 
+    object once"""
+    c = Cache()
+    data = os.urandom(1000)
+    c.put('a', data)
+    results = []
+    def get():
+        results.append(c.get('a'))
+        return
+    lock = c.lock('a')
+    threads = [ threading.Thread(target=get) for i in xrange(3) ]
+    try:
+        for t in threads:
+            t.start()
+        time.sleep(0.5)
+        nose.tools.assert_equal(results, [])
+        nose.tools.assert_equal(c.gets(), 0)
+    finally:
+        lock.close()
+    for t in threads:
+        t.join()
+    nose.tools.assert_equal(sorted(results), 
+                            [(False, data), (True, data), (True, data)])
+    nose.tools.assert_equal(c.gets(), 1)
+    stats = c.cache.stats()
+    nose.tools.assert_equal((stats['hits'], stats['misses']), (2, 1))
+    return
+
+# eof
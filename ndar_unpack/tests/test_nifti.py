@@ -0,0 +1,155 @@
+import os
+import sys
+import imp
+import gzip
+import struct
+import tempfile
+import shutil
+import numpy
+import nibabel
+import nose.tools
+
+# ndar_unpack is a script, not a module
+sys.dont_write_bytecode = True
+script = os.path.join(os.path.dirname(__file__), '..', 'ndar_unpack')
+ndar_unpack = imp.load_source('ndar_unpack', script)
+
+shape = (4, 5, 6)
+
+def setup():
+    global tempdir
+    tempdir = tempfile.mkdtemp()
+    ndar_unpack.output_level = ndar_unpack.SILENT
+    return
+
+def teardown():
+    shutil.rmtree(tempdir)
+    return
+
+def volume(name, endianness='<'):
+    """write a synthetic int16 volume, returning its file name"""
+    data = numpy.arange(numpy.prod(shape)).reshape(shape).astype(numpy.int16)
+    header = nibabel.Nifti1Header(endianness=endianness)
+    header.set_data_dtype(numpy.int16)
+    image = nibabel.Nifti1Image(data, numpy.diag([2, 3, 4, 1]), header)
+    fname = os.path.join(tempdir, name)
+    nibabel.save(image, fname)
+    return fname
+
+def patch(fname, offset, fmt, value):
+    """change a (little endian) header field in an uncompressed file"""
+    fo = open(fname, 'r+b')
+    fo.seek(offset)
+    fo.write(struct.pack('<%s' % fmt, value))
+    fo.close()
+    return fname
+
+def truncate(fname, n):
+    """remove n bytes from the end of the (uncompressed) data"""
+    if fname.endswith('.gz'):
+        data = gzip.open(fname).read()
+        fo = gzip.open(fname, 'wb')
+    else:
+        data = open(fname, 'rb').read()
+        fo = open(fname, 'wb')
+    fo.write(data[:-n])
+    fo.close()
+    return fname
+
+def check_error(fname, msg):
+    """validate() raises ValueError with a message starting with msg"""
+    vol = ndar_unpack.NIfTI_1(fname)
+    try:
+        vol.validate()
+    except ValueError, exc:
+        nose.tools.assert_true(str(exc).startswith(msg), str(exc))
+    else:
+        raise AssertionError('%s validated' % fname)
+    return
+
+def test_valid():
+    for name in ('valid.nii', 'valid.nii.gz'):
+        vol = ndar_unpack.NIfTI_1(volume(name))
+        vol.validate()
+        nose.tools.assert_equal(vol.dim[:4], (3, ) + shape)
+        nose.tools.assert_equal((vol.datatype, vol.bitpix), (4, 16))
+        nose.tools.assert_equal(vol.vox_offset, 352)
+        nose.tools.assert_equal(vol.byte_order, '<')
+        nose.tools.assert_equal(vol.data_size(), 2 * numpy.prod(shape))
+    return
+
+def test_big_endian():
+    vol = ndar_unpack.NIfTI_1(volume('big.nii', '>'))
+    vol.validate()
+    nose.tools.assert_equal(vol.byte_order, '>')
+    nose.tools.assert_equal((vol.datatype, vol.bitpix), (4, 16))
+    voxels = vol.voxels()
+    nose.tools.assert_equal(voxels.shape, shape)
+    nose.tools.assert_equal(voxels[3, 4, 5], numpy.prod(shape) - 1)
+    return
+
+def test_truncated():
+    check_error(truncate(volume('short.nii'), 1), 'file too short')
+    check_error(truncate(volume('short.nii.gz'), 1), 'file too short')
+    # extra bytes are allowed
+    fname = volume('long.nii')
+    open(fname, 'ab').write('\0' * 10)
+    ndar_unpack.NIfTI_1(fname).validate()
+    return
+
+def test_short_header():
+    fname = os.path.join(tempdir, 'header.nii')
+    open(fname, 'wb').write(open(volume('full.nii'), 'rb').read(300))
+    nose.tools.assert_raises(ValueError, ndar_unpack.NIfTI_1, fname)
+    return
+
+def test_bitpix():
+    fname = patch(volume('bitpix.nii'), 72, 'h', 32)
+    check_error(fname, 'bitpix (32) does not match datatype (4)')
+    return
+
+def test_datatype():
+    fname = patch(volume('datatype.nii'), 70, 'h', 3)
+    check_error(fname, 'unknown datatype 3')
+    return
+
+def test_dim():
+    fname = patch(volume('dim.nii'), 44, 'h', 0)
+    check_error(fname, 'bad dim[2] (0)')
+    return
+
+def test_vox_offset():
+    fname = patch(volume('offset.nii'), 108, 'f', 348)
+    check_error(fname, 'bad vox_offset (348)')
+    # past the end of the data
+    fname = patch(volume('offset_big.nii'), 108, 'f', 1024)
+    check_error(fname, 'file too short')
+    return
+
+def test_write_nii_gz():
+    """.nii to .nii.gz round trip"""
+    fname = volume('round_trip.nii')
+    gz_fname = os.path.join(tempdir, 'round_trip.nii.gz')
+    ndar_unpack.NIfTI_1(fname).write_nii_gz(gz_fname)
+    nose.tools.assert_equal(open(gz_fname, 'rb').read(2), 
+                            ndar_unpack.gzip_magic)
+    nose.tools.assert_equal(gzip.open(gz_fname).read(), 
+                            open(fname, 'rb').read())
+    vol = ndar_unpack.NIfTI_1(gz_fname)
+    vol.validate()
+    nose.tools.assert_true(numpy.array_equal(vol.voxels(), 
+                                             nibabel.load(fname).get_data()))
+    # larger than a chunk
+    chunk_size = ndar_unpack.nifti_chunk_size
+    ndar_unpack.nifti_chunk_size = 100
+    try:
+        gz_fname = os.path.join(tempdir, 'chunks.nii.gz')
+        ndar_unpack.NIfTI_1(fname).write_nii_gz(gz_fname)
+        ndar_unpack.NIfTI_1(gz_fname).validate()
+    finally:
+        ndar_unpack.nifti_chunk_size = chunk_size
+    nose.tools.assert_equal(gzip.open(gz_fname).read(), 
+                            open(fname, 'rb').read())
+    return
+
+# eof
@@ -0,0 +1,124 @@
+import os
+import sys
+import imp
+import hashlib
+import tempfile
+import shutil
+import nose.tools
+import boto.exception
+import s3_stub
+
+# ndar_unpack is a script, not a module
+sys.dont_write_bytecode = True
+script = os.path.join(os.path.dirname(__file__), '..', 'ndar_unpack')
+ndar_unpack = imp.load_source('ndar_unpack', script)
+
+bucket_name = 'bucket'
+key_name = 'a/b.zip'
+path = '%s/%s' % (bucket_name, key_name)
+
+def setup():
+    global server, tempdir
+    server = s3_stub.Server()
+    tempdir = tempfile.mkdtemp()
+    ndar_unpack.output_level = ndar_unpack.SILENT
+    ndar_unpack.s3_part_size = 1
+    ndar_unpack.s3_download_threads = 2
+    return
+
+def teardown():
+    server.stop()
+    shutil.rmtree(tempdir)
+    return
+
+def reset(data):
+    server.objects = {path: data}
+    server.etags = {}
+    server.truncate = []
+    server.replace_after_head = {}
+    server.requests = []
+    return
+
+def random_data(n):
+    return os.urandom(n)
+
+def download():
+    connect = lambda: ndar_unpack.s3_connect('x', 'y', None, server.endpoint)
+    pool = ndar_unpack.S3ConnectionPool(connect)
+    fname = os.path.join(tempdir, 'download')
+    etag = ndar_unpack.s3_download(pool, bucket_name, key_name, fname)
+    return (etag, open(fname, 'rb').read())
+
+def gets():
+    return [ headers for (method, p, headers) in server.requests \
+             if method == 'GET' and p.lstrip('/') == path ]
+
+def range_start(headers):
+    return int(headers['range'].split('=')[1].split('-')[0])
+
+def test_download():
+    data = random_data(2500000)
+    reset(data)
+    (etag, downloaded) = download()
+    assert downloaded == data
+    assert etag == hashlib.md5(data).hexdigest()
+    # three 1 MB parts, each matched to the ETag from the HEAD
+    l = gets()
+    assert sorted([ range_start(h) for h in l ]) == [0, 1048576, 2097152]
+    for h in l:
+        assert h['if-match'] == '"%s"' % etag
+
+def test_if_match():
+    """the object changes during the download"""
+    reset(random_data(2500000))
+    server.replace_after_head[path] = random_data(2500001)
+    try:
+        download()
+    except boto.exception.S3ResponseError, exc:
+        assert exc.status == 412
+    else:
+        raise AssertionError('download of a changed object succeeded')
+
+def test_md5_mismatch():
+    reset(random_data(100000))
+    server.etags[path] = hashlib.md5('other data').hexdigest()
+    nose.tools.assert_raises(ndar_unpack.GeneralError, download)
+
+def test_multipart_etag():
+    """an ETag that isn't an MD5 sum isn't checked"""
+    data = random_data(100000)
+    reset(data)
+    server.etags[path] = hashlib.md5('other data').hexdigest() + '-2'
+    (etag, downloaded) = download()
+    assert downloaded == data
+
+def test_retry():
+    """a part that is cut short is resumed where it left off"""
+    data = random_data(2500000)
+    reset(data)
+    server.truncate = [1000]
+    (etag, downloaded) = download()
+    assert downloaded == data
+    starts = [ range_start(h) for h in gets() ]
+    assert len(starts) == 4
+    resumed = [ s for s in starts if s % 1048576 == 1000 ]
+    assert len(resumed) == 1
+    assert resumed[0] - 1000 in starts
+
+def test_retries_exhausted():
+    reset(random_data(100000))
+    server.truncate = [10] * 10
+    retries = ndar_unpack.s3_download_retries
+    ndar_unpack.s3_download_retries = 1
+    try:
+        nose.tools.assert_raises(ndar_unpack.GeneralError, download)
+    finally:
+        ndar_unpack.s3_download_retries = retries
+    assert len(gets()) == 2
+
+def test_missing():
+    reset('')
+    server.objects = {}
+    nose.tools.assert_raises(ndar_unpack.GeneralError, download)
+
+# eof
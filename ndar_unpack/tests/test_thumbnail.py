@@ -0,0 +1,166 @@
+import os
+import sys
+import imp
+import stat
+import struct
+import tempfile
+import shutil
+import numpy
+import nibabel
+import nose.tools
+
+# ndar_unpack is a script, not a module
+sys.dont_write_bytecode = True
+script = os.path.join(os.path.dirname(__file__), '..', 'ndar_unpack')
+ndar_unpack = imp.load_source('ndar_unpack', script)
+
+# fake FSL tools that log their arguments; slicer writes a PNG signature
+fake_fslreorient2std = """#!/bin/bash 
+echo fslreorient2std "$@" >> "%s" 
+cp "$1" "$2"
+"""
+
+fake_slicer = """#!/bin/bash 
+echo slicer "$@" >> "%s" 
+printf '\\211PNG\\r\\n\\032\\n' > "$3"
+"""
+
+class VolumeData(ndar_unpack.BaseData):
+
+    """data whose conversion gives a volume file we made"""
+
+    format_name = 'test volume'
+
+    def __init__(self, fname):
+        dir = tempfile.mkdtemp(dir=tempdir)
+        os.mkdir(os.path.join(dir, 'output'))
+        ndar_unpack.BaseData.__init__(self, dir, Archive())
+        self.fname = fname
+        return
+
+    def _convert_nii_gz(self):
+        return self.fname
+
+class Archive:
+
+    names = []
+
+def setup():
+    global tempdir, fsl_log, old_path
+    tempdir = tempfile.mkdtemp()
+    ndar_unpack.output_level = ndar_unpack.SILENT
+    fsl_log = os.path.join(tempdir, 'fsl.log')
+    bin_dir = os.path.join(tempdir, 'bin')
+    os.mkdir(bin_dir)
+    for (name, script) in (('fslreorient2std', fake_fslreorient2std), 
+                           ('slicer', fake_slicer)):
+        path = os.path.join(bin_dir, name)
+        fo = open(path, 'w')
+        fo.write(script % fsl_log)
+        fo.close()
+        os.chmod(path, stat.S_IRWXU)
+    old_path = os.environ['PATH']
+    os.environ['PATH'] = '%s:%s' % (bin_dir, old_path)
+    return
+
+def teardown():
+    os.environ['PATH'] = old_path
+    shutil.rmtree(tempdir)
+    return
+
+def fsl_calls():
+    """return the FSL tools run, and reset the log"""
+    if not os.path.exists(fsl_log):
+        return []
+    calls = [ line.split()[0] for line in open(fsl_log) ]
+    os.unlink(fsl_log)
+    return calls
+
+def volume(name, shape=(20, 30, 10), dtype=numpy.int16):
+    """write a synthetic volume with 2 x 1 x 3 mm voxels"""
+    data = numpy.arange(numpy.prod(shape)).reshape(shape).astype(dtype)
+    fname = os.path.join(tempdir, name)
+    nibabel.save(nibabel.Nifti1Image(data, numpy.diag([2, 1, 3, 1])), fname)
+    return fname
+
+def png_size(fname):
+    """return the (width, height) of a PNG"""
+    data = open(fname, 'rb').read()
+    nose.tools.assert_equal(data[:8], '\x89PNG\r\n\x1a\n')
+    nose.tools.assert_equal(data[12:16], 'IHDR')
+    return struct.unpack('>II', data[16:24])
+
+def truncate(fname, n):
+    data = open(fname, 'rb').read()
+    open(fname, 'wb').write(data[:-n])
+    return fname
+
+def test_numpy():
+    data = VolumeData(volume('vol.nii.gz'))
+    path = os.path.join(tempdir, 'numpy.png')
+    nose.tools.assert_equal(data.thumbnail(path), 'numpy')
+    # each slice is resampled to square pixels the size of its smaller 
+    # voxel dimension: sagittal 30 x 30 (1 mm), coronal 20 x 15 (2 mm), 
+    # and axial 40 x 30 (1 mm)
+    nose.tools.assert_equal(png_size(path), (30 + 20 + 40, 30))
+    nose.tools.assert_equal(fsl_calls(), [])
+    nose.tools.assert_equal(data.timings[-1][0], 'thumbnail (numpy)')
+    return
+
+def test_fsl():
+    data = VolumeData(volume('vol.nii.gz'))
+    path = os.path.join(tempdir, 'fsl.png')
+    nose.tools.assert_equal(data.thumbnail(path, 'fsl'), 'fsl')
+    nose.tools.assert_equal(fsl_calls(), ['fslreorient2std', 'slicer'])
+    nose.tools.assert_equal(open(path, 'rb').read(), '\x89PNG\r\n\x1a\n')
+    return
+
+def check_fallback(fname):
+    """'auto' falls back to FSL and 'numpy' raises GeneralError"""
+    data = VolumeData(fname)
+    path = os.path.join(tempdir, 'fallback.png')
+    nose.tools.assert_equal(data.thumbnail(path), 'fsl')
+    nose.tools.assert_equal(fsl_calls(), ['fslreorient2std', 'slicer'])
+    nose.tools.assert_equal(data.timings[-1][0], 'thumbnail (fsl)')
+    nose.tools.assert_raises(ndar_unpack.GeneralError, 
+                             data.thumbnail, 
+                             path, 
+                             'numpy')
+    nose.tools.assert_equal(fsl_calls(), [])
+    return
+
+def test_fallback_short_file():
+    check_fallback(truncate(volume('short.nii'), 1000))
+    return
+
+def test_fallback_bad_header():
+    fname = volume('bad_header.nii')
+    fo = open(fname, 'r+b')
+    # the magic string
+    fo.seek(344)
+    fo.write('xxx\0')
+    fo.close()
+    check_fallback(fname)
+    return
+
+def test_fallback_datatype():
+    check_fallback(volume('complex.nii.gz', dtype=numpy.complex64))
+    return
+
+def test_no_numpy():
+    data = VolumeData(volume('vol.nii.gz'))
+    path = os.path.join(tempdir, 'no_numpy.png')
+    module_numpy = ndar_unpack.numpy
+    ndar_unpack.numpy = None
+    try:
+        nose.tools.assert_equal(data.thumbnail(path), 'fsl')
+        nose.tools.assert_raises(ndar_unpack.GeneralError, 
+                                 data.thumbnail, 
+                                 path, 
+                                 'numpy')
+    finally:
+        ndar_unpack.numpy = module_numpy
+    nose.tools.assert_equal(fsl_calls(), ['fslreorient2std', 'slicer'])
+    return
+
+# eof
@@ -0,0 +1,212 @@
+# See file COPYING distributed with ndar for copyright and license.
+
+# checkpointing for long pipeline jobs; sourced by launch_recon_all and 
+# launch_first_all
+#
+# a job's work is split into stages.  after each stage the work 
+# directory is synced to an S3 checkpoint location, and a retried job 
+# syncs it back and skips the stages that are done.  an interrupted or 
+# failed stage is run again by the job's stage command, which can reuse 
+# what the stage left behind (recon-all -make, for example). 
+#
+# stage markers and timings are kept in <work dir>/ndar_stages:
+#
+#     <stage>.started   the stage has been started
+#     <stage>.done      the stage has finished
+#     timing            stage, start time, seconds, and status (done, 
+#                       failed, or interrupted) for each stage run, 
+#                       including runs in earlier jobs
+#
+# usage:
+#
+#     checkpoint_init <work dir> <S3 checkpoint URL>
+#     checkpoint_restore
+#     trap checkpoint_interrupted USR1 USR2
+#     run_stage <stage> <command> [<argument> ...]
+#     ...
+#     checkpoint_clear
+#
+# SGE sends USR1 when a job reaches its soft time limit, and (if it is 
+# submitted with -notify) USR2 before it kills the job with qdel
+
+checkpoint_init()
+{
+
+    ckpt_dir="$1"
+    # strip trailing /
+    ckpt_url=`echo "$2" | sed 's+/*$++'`
+    ckpt_stage_dir="$ckpt_dir/ndar_stages"
+    ckpt_stage=
+    ckpt_resuming=
+    ckpt_pid=
+    # seconds to wait for an interrupted stage to exit after SIGTERM
+    ckpt_kill_wait=${ckpt_kill_wait:-10}
+
+    mkdir -p "$ckpt_stage_dir"
+
+    return 0
+
+} # end checkpoint_init()
+
+checkpoint_restore()
+{
+
+    echo "restoring checkpoint from $ckpt_url"
+
+    aws s3 sync --quiet "$ckpt_url" "$ckpt_dir"
+    mkdir -p "$ckpt_stage_dir"
+
+    for marker in "$ckpt_stage_dir"/*.done
+    do
+        if [ -f "$marker" ]
+        then
+            echo "    `basename "$marker" .done` is done"
+        fi
+    done
+
+    return 0
+
+} # end checkpoint_restore()
+
+checkpoint_save()
+{
+
+    echo "saving checkpoint to $ckpt_url"
+
+    aws s3 sync --quiet --delete "$ckpt_dir" "$ckpt_url"
+
+} # end checkpoint_save()
+
+checkpoint_clear()
+{
+
+    echo "removing checkpoint $ckpt_url"
+
+    aws s3 rm --quiet --recursive "$ckpt_url"
+
+} # end checkpoint_clear()
+
+stage_done()
+{
+
+    [ -f "$ckpt_stage_dir/$1.done" ]
+
+} # end stage_done()
+
+stage_started()
+{
+
+    [ -f "$ckpt_stage_dir/$1.started" ]
+
+} # end stage_started()
+
+record_stage()
+{
+
+    # record_stage <status>
+
+    end=`date +%s`
+    seconds=$(( end - ckpt_stage_start ))
+    start_date=`date -u -d @$ckpt_stage_start +%Y-%m-%dT%H:%M:%SZ`
+
+    printf '%s\t%s\t%d\t%s\n' \
+           $ckpt_stage $start_date $seconds $1 >> "$ckpt_stage_dir/timing"
+    echo "stage $ckpt_stage: $1 after $seconds s (`date`)"
+
+    return 0
+
+} # end record_stage()
+
+run_stage()
+{
+
+    # run_stage <stage> <command> [<argument> ...]
+    #
+    # the command is run in the background so the signal trap can run 
+    # while we wait for it, and with job control on so it gets its own 
+    # process group (with ID $ckpt_pid) that checkpoint_interrupted can 
+    # kill as a whole; the command is usually a shell function, so 
+    # setsid won't do
+
+    if stage_done $1
+    then
+        echo "stage $1: already done"
+        return 0
+    fi
+
+    ckpt_stage=$1
+    shift
+
+    # the stage command can check $ckpt_resuming to see if an earlier 
+    # job started the stage
+    if stage_started $ckpt_stage
+    then
+        ckpt_resuming=1
+        echo "stage $ckpt_stage: resuming (`date`)"
+    else
+        ckpt_resuming=
+        echo "stage $ckpt_stage: starting (`date`)"
+    fi
+
+    ckpt_stage_start=`date +%s`
+    date > "$ckpt_stage_dir/$ckpt_stage.started"
+
+    set -m
+    "$@" &
+    ckpt_pid=$!
+    set +m
+    if wait $ckpt_pid
+    then
+        ckpt_pid=
+        date > "$ckpt_stage_dir/$ckpt_stage.done"
+        record_stage done
+        checkpoint_save
+        ckpt_stage=
+        return 0
+    fi
+
+    ckpt_pid=
+    record_stage failed
+    checkpoint_save
+    ckpt_stage=
+
+    return 1
+
+} # end run_stage()
+
+checkpoint_interrupted()
+{
+
+    echo 'job is being stopped; saving checkpoint and exiting'
+
+    if [ -n "$ckpt_pid" ]
+    then
+        # the stage's whole process group, which reaches recon-all's 
+        # children and grandchildren as well as the stage's shell 
+        # (set -e is probably on in the caller)
+        kill -TERM -- -$ckpt_pid 2> /dev/null || true
+        wait $ckpt_pid 2> /dev/null || true
+        # give the rest of the group a moment before the checkpoint is 
+        # saved, so nothing is still writing to the work directory
+        n=0
+        while kill -0 -- -$ckpt_pid 2> /dev/null
+        do
+            if [ $n -ge $ckpt_kill_wait ]
+            then
+                kill -KILL -- -$ckpt_pid 2> /dev/null || true
+                break
+            fi
+            sleep 1
+            n=$(( n + 1 ))
+        done
+    fi
+
+    if [ -n "$ckpt_stage" ] ; then record_stage interrupted ; fi
+
+    checkpoint_save
+
+    exit 3
+
+} # end checkpoint_interrupted()
+
+# eof
@@ -0,0 +1,118 @@
+"""submit SGE array jobs
+
+rather than running qsub once per task, the queue_* scripts write the 
+arguments for all the tasks to a manifest (one task per line, arguments 
+separated by tabs) and submit a single array job (qsub -t 1-N).  the 
+launch_* scripts are given --manifest <file> and take their arguments 
+from line $SGE_TASK_ID of the manifest.  launch_structural_qa and 
+launch_time_series_qa can also take several lines per task 
+(--scans-per-task) to share the job setup between scans.
+
+qsub is found on PATH, so a fake qsub can be used for testing.
+"""
+
+import os
+import re
+import time
+import subprocess
+
+# SGE's default max_aj_tasks; larger submissions are split into several 
+# array jobs
+max_array_tasks = 75000
+
+def scale_time(limit, n):
+    """scale an SGE time limit (H:MM:SS) by n"""
+    (h, m, s) = [ int(x) for x in limit.split(':') ]
+    seconds = (h * 3600 + m * 60 + s) * n
+    return '%d:%02d:%02d' % (seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+default_manifest_dir = os.path.join(os.environ.get('HOME', '.'), 'manifests')
+
+class SubmitError(Exception):
+
+    """error submitting a job"""
+
+def write_manifest(fname, tasks):
+    """write a manifest of task arguments (a list of lists)"""
+    fo = open(fname, 'w')
+    try:
+        for task in tasks:
+            task = [ str(arg) for arg in task ]
+            for arg in task:
+                if not arg or '\t' in arg or '\n' in arg:
+                    msg = 'bad argument %s in manifest' % repr(arg)
+                    raise ValueError(msg)
+            fo.write('\t'.join(task) + '\n')
+    finally:
+        fo.close()
+    return
+
+def _job_id(output):
+    # "Your job-array 1234.1-10:1 ("name") has been submitted"
+    mo = re.search('job(?:-array)? (\d+)', output)
+    if not mo:
+        return output.strip()
+    return mo.group(1)
+
+def submit_array(script, 
+                 tasks, 
+                 name, 
+                 max_running=None, 
+                 manifest_dir=default_manifest_dir, 
+                 scans_per_task=1, 
+                 qsub_args=None):
+
+    """submit an array job running script for each of tasks (lists of 
+    arguments) and return a list of (job ID, manifest, number of tasks)
+
+    name is used for the manifest and log file names; if max_running is 
+    given, at most that many array tasks of each job run at once (-tc); 
+    if scans_per_task is more than 1, each array task is given that many 
+    consecutive manifest lines (the script must accept 
+    --scans-per-task); qsub_args are passed to qsub before the script; 
+    raises SubmitError if qsub fails
+    """
+
+    if not tasks:
+        return []
+
+    if not os.path.isdir(manifest_dir):
+        os.makedirs(manifest_dir)
+
+    stamp = time.strftime('%Y%m%d%H%M%S')
+    jobs = []
+    chunk_size = max_array_tasks * scans_per_task
+    for (n, i) in enumerate(xrange(0, len(tasks), chunk_size)):
+        chunk = tasks[i:i+chunk_size]
+        n_array_tasks = (len(chunk) + scans_per_task - 1) // scans_per_task
+        base = '%s.%s.%d.%d.tsv' % (name, stamp, os.getpid(), n)
+        manifest = os.path.join(manifest_dir, base)
+        write_manifest(manifest, chunk)
+        # $JOB_ID and $TASK_ID are expanded by SGE
+        log_base = '$HOME/logs/%s.$JOB_ID.$TASK_ID' % name
+        cmd_args = ['qsub', 
+                    '-t', '1-%d' % n_array_tasks, 
+                    '-N', name, 
+                    '-o', '%s.stdout' % log_base, 
+                    '-e', '%s.stderr' % log_base]
+        if max_running is not None:
+            cmd_args.extend(['-tc', str(max_running)])
+        if qsub_args:
+            cmd_args.extend(qsub_args)
+        cmd_args.extend([script, '--manifest', manifest])
+        if scans_per_task > 1:
+            cmd_args.extend(['--scans-per-task', str(scans_per_task)])
+        try:
+            po = subprocess.Popen(cmd_args, 
+                                  stdout=subprocess.PIPE, 
+                                  stderr=subprocess.PIPE)
+        except OSError, data:
+            raise SubmitError('error running qsub: %s' % str(data))
+        (stdout, stderr) = po.communicate()
+        if po.returncode != 0:
+            raise SubmitError('error in qsub: %s' % stderr.strip())
+        jobs.append((_job_id(stdout), manifest, len(chunk)))
+
+    return jobs
+
+# eof
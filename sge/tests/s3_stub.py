@@ -0,0 +1,186 @@
+"""a local S3 stub for the zip_upload tests
+
+Server takes multipart uploads (initiate, upload part, list parts, 
+complete, and abort) at http://127.0.0.1:<port>/<bucket>/<key> and 
+keeps the completed objects in objects (<bucket>/<key> -> data); 
+uploads maps an upload ID to its key and parts (part number -> data). 
+Faults can be injected: fail_parts maps a part number to the number of 
+times to refuse it.  Requests are recorded as (method, path, query).
+"""
+
+import threading
+import hashlib
+import urlparse
+import re
+import BaseHTTPServer
+import SocketServer
+
+error_fmt = '<Error><Code>%s</Code><Message>%s</Message></Error>'
+
+initiate_fmt = """<?xml version="1.0" encoding="UTF-8"?> 
+<InitiateMultipartUploadResult> 
+<Bucket>%s</Bucket><Key>%s</Key><UploadId>%s</UploadId> 
+</InitiateMultipartUploadResult>"""
+
+complete_fmt = """<?xml version="1.0" encoding="UTF-8"?> 
+<CompleteMultipartUploadResult> 
+<Location>%s</Location><Bucket>%s</Bucket><Key>%s</Key><ETag>"%s"</ETag> 
+</CompleteMultipartUploadResult>"""
+
+list_parts_fmt = """<?xml version="1.0" encoding="UTF-8"?> 
+<ListPartsResult> 
+<Bucket>%s</Bucket><Key>%s</Key><UploadId>%s</UploadId> 
+<IsTruncated>false</IsTruncated> 
+%s 
+</ListPartsResult>"""
+
+part_fmt = """<Part><PartNumber>%d</PartNumber><ETag>"%s"</ETag> 
+<Size>%d</Size></Part>"""
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        return
+
+    def _parse(self):
+        """return (bucket, key, query) and record the request"""
+        parsed = urlparse.urlparse(self.path)
+        query = urlparse.parse_qs(parsed.query, keep_blank_values=True)
+        query = dict([ (name, values[0]) 
+                       for (name, values) in query.iteritems() ])
+        (bucket, key) = parsed.path.lstrip('/').split('/', 1)
+        with self.server.lock:
+            self.server.requests.append((self.command, 
+                                         parsed.path.lstrip('/'), 
+                                         query))
+        return (bucket, key, query)
+
+    def _body(self):
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+    def _respond(self, status, body='', etag=None):
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        if body:
+            self.send_header('Content-Type', 'text/xml')
+        if etag:
+            self.send_header('ETag', '"%s"' % etag)
+        self.end_headers()
+        self.wfile.write(body)
+        return
+
+    def _error(self, status, code):
+        self._respond(status, error_fmt % (code, code))
+        return
+
+    def do_POST(self):
+        (bucket, key, query) = self._parse()
+        body = self._body()
+        if 'uploads' in query:
+            with self.server.lock:
+                self.server.n_uploads += 1
+                upload_id = 'upload%d' % self.server.n_uploads
+                self.server.uploads[upload_id] = ('%s/%s' % (bucket, key), 
+                                                  {})
+            self._respond(200, initiate_fmt % (bucket, key, upload_id))
+            return
+        with self.server.lock:
+            upload = self.server.uploads.pop(query.get('uploadId'), None)
+        if upload is None:
+            self._error(404, 'NoSuchUpload')
+            return
+        (path, parts) = upload
+        part_nums = re.findall(r'<PartNumber>(\d+)</PartNumber>', body)
+        part_nums = [ int(n) for n in part_nums ]
+        if part_nums != sorted(parts):
+            self._error(400, 'InvalidPart')
+            return
+        data = ''.join([ parts[n] for n in part_nums ])
+        self.server.objects[path] = data
+        etag = '%s-%d' % (hashlib.md5(data).hexdigest(), len(part_nums))
+        self._respond(200, complete_fmt % (path, bucket, key, etag))
+        return
+
+    def do_GET(self):
+        (bucket, key, query) = self._parse()
+        with self.server.lock:
+            upload = self.server.uploads.get(query.get('uploadId'))
+        if upload is None:
+            self._error(404, 'NoSuchUpload')
+            return
+        parts = upload[1]
+        part_list = [ part_fmt % (n, hashlib.md5(parts[n]).hexdigest(), 
+                                  len(parts[n])) 
+                      for n in sorted(parts) ]
+        body = list_parts_fmt % (bucket, 
+                                 key, 
+                                 query['uploadId'], 
+                                 '\n'.join(part_list))
+        self._respond(200, body)
+        return
+
+    def do_PUT(self):
+        (bucket, key, query) = self._parse()
+        data = self._body()
+        part_num = int(query.get('partNumber', 0))
+        with self.server.lock:
+            upload = self.server.uploads.get(query.get('uploadId'))
+            fail = self.server.fail_parts.get(part_num, 0)
+            if fail:
+                self.server.fail_parts[part_num] = fail - 1
+        if upload is None:
+            self._error(404, 'NoSuchUpload')
+            return
+        if fail:
+            self._error(403, 'InjectedFault')
+            return
+        upload[1][part_num] = data
+        self._respond(200, etag=hashlib.md5(data).hexdigest())
+        return
+
+    def do_DELETE(self):
+        (bucket, key, query) = self._parse()
+        with self.server.lock:
+            upload = self.server.uploads.pop(query.get('uploadId'), None)
+        if upload is None:
+            self._error(404, 'NoSuchUpload')
+            return
+        self._respond(204)
+        return
+
+class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), Handler)
+        self.objects = {}
+        self.uploads = {}
+        self.n_uploads = 0
+        self.fail_parts = {}
+        self.requests = []
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return
+
+    @property
+    def endpoint(self):
+        return 'http://127.0.0.1:%d' % self.server_address[1]
+
+    def reset(self):
+        self.objects = {}
+        self.uploads = {}
+        self.fail_parts = {}
+        self.requests = []
+        return
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        return
+
+# eof
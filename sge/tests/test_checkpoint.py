@@ -0,0 +1,244 @@
+import os
+import stat
+import time
+import signal
+import tempfile
+import shutil
+import subprocess
+import nose.tools
+
+sge_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+ckpt_url = 's3://bucket/checkpoints/subject'
+
+# a fake aws that keeps S3 in $FAKE_S3_DIR (s3://<bucket>/<key> is 
+# $FAKE_S3_DIR/<bucket>/<key>); only the s3 sync and s3 rm that 
+# checkpoint.sh uses
+fake_aws = """#!/bin/bash
+local_path()
+{
+    case "$1" in
+        s3://*) echo "$FAKE_S3_DIR/${1#s3://}" ;;
+        *) echo "$1" ;;
+    esac
+}
+shift
+cmd=$1
+shift
+opts=
+while [ "${1#--}" != "$1" ] ; do opts="$opts $1" ; shift ; done
+if [ $cmd = sync ]
+then
+    src=`local_path "$1"`
+    dest=`local_path "$2"`
+    if [ ! -d "$src" ] ; then exit 0 ; fi
+    case "$opts" in *--delete*) rm -rf "$dest" ;; esac
+    mkdir -p "$dest"
+    cp -a "$src"/. "$dest"
+elif [ $cmd = rm ]
+then
+    rm -rf `local_path "$1"`
+fi
+"""
+
+# a fake recon-all that logs its arguments and then does what
+# $FAKE_RECON_ALL says: fail, or hang in a grandchild (whose PID it
+# writes to $FAKE_RECON_ALL_PID) until it is killed
+fake_recon_all = """#!/bin/bash
+echo "$*" >> "$FAKE_RECON_ALL_LOG"
+case "$FAKE_RECON_ALL" in
+    fail)
+        exit 1
+        ;;
+    hang)
+        bash -c 'sleep 600 & echo $! > "$FAKE_RECON_ALL_PID" ; wait'
+        ;;
+esac
+exit 0
+"""
+
+# a job like launch_recon_all: a stage that always works and a
+# recon-all stage that is picked up with -make when resumed
+job = """set -e
+. "%s/checkpoint.sh"
+recon_all_stage()
+{
+    if [ $ckpt_resuming ]
+    then
+        recon-all -make $1 -subjid subject
+    else
+        recon-all -$1 -subjid subject
+    fi
+}
+checkpoint_init "$1" %s
+checkpoint_restore
+trap checkpoint_interrupted USR1 USR2
+run_stage unpack touch "$1/subject.nii.gz"
+run_stage autorecon1 recon_all_stage autorecon1
+trap '' USR1 USR2
+echo job finished
+""" % (sge_dir, ckpt_url)
+
+def setup():
+    global tempdir, old_path, job_script
+    tempdir = tempfile.mkdtemp()
+    bin_dir = os.path.join(tempdir, 'bin')
+    os.mkdir(bin_dir)
+    for (name, script) in (('aws', fake_aws), 
+                           ('recon-all', fake_recon_all)):
+        path = os.path.join(bin_dir, name)
+        fo = open(path, 'w')
+        fo.write(script)
+        fo.close()
+        os.chmod(path, stat.S_IRWXU)
+    job_script = os.path.join(tempdir, 'job')
+    fo = open(job_script, 'w')
+    fo.write(job)
+    fo.close()
+    old_path = os.environ['PATH']
+    os.environ['PATH'] = '%s:%s' % (bin_dir, old_path)
+    return
+
+def teardown():
+    os.environ['PATH'] = old_path
+    shutil.rmtree(tempdir)
+    return
+
+class Job:
+
+    """runs of the job with a fresh work directory each time (as on a 
+    new node) and a shared S3"""
+
+    def __init__(self):
+        self.dir = tempfile.mkdtemp(dir=tempdir)
+        self.n_runs = 0
+        self.env = dict(os.environ)
+        self.env['FAKE_S3_DIR'] = os.path.join(self.dir, 's3')
+        self.env['FAKE_RECON_ALL_LOG'] = os.path.join(self.dir, 'log')
+        self.env['FAKE_RECON_ALL_PID'] = os.path.join(self.dir, 'pid')
+        return
+
+    def start(self, recon_all_mode=''):
+        self.n_runs += 1
+        self.work_dir = os.path.join(self.dir, 'work%d' % self.n_runs)
+        os.mkdir(self.work_dir)
+        self.env['FAKE_RECON_ALL'] = recon_all_mode
+        self.output = os.path.join(self.dir, 'output%d' % self.n_runs)
+        fo = open(self.output, 'w')
+        po = subprocess.Popen(['bash', job_script, self.work_dir], 
+                              stdout=fo, 
+                              stderr=subprocess.STDOUT, 
+                              env=self.env)
+        fo.close()
+        return po
+
+    def run(self, recon_all_mode=''):
+        """run the job and return its exit status"""
+        return self.start(recon_all_mode).wait()
+
+    def read(self, name):
+        return open(os.path.join(self.dir, name)).read()
+
+    def recon_all_calls(self):
+        if not os.path.exists(os.path.join(self.dir, 'log')):
+            return []
+        return self.read('log').split('\n')[:-1]
+
+    def checkpoint(self, name):
+        """return the path to a file in the checkpoint"""
+        return os.path.join(self.dir, 
+                            's3', 
+                            ckpt_url[len('s3://'):], 
+                            name)
+
+    def timing(self):
+        """return the (stage, status) pairs from the checkpoint"""
+        fname = self.checkpoint('ndar_stages/timing')
+        lines = open(fname).read().split('\n')[:-1]
+        return [ (l.split('\t')[0], l.split('\t')[3]) for l in lines ]
+
+def wait_for(fname, timeout=10):
+    t0 = time.time()
+    while not os.path.exists(fname) or not open(fname).read():
+        if time.time() - t0 > timeout:
+            raise AssertionError('timed out waiting for %s' % fname)
+        time.sleep(0.05)
+    return
+
+def is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    return True
+
+def test_run():
+    job = Job()
+    nose.tools.assert_equal(job.run(), 0)
+    nose.tools.assert_true('job finished' in job.read('output1'))
+    nose.tools.assert_equal(job.recon_all_calls(), 
+                            ['-autorecon1 -subjid subject'])
+    nose.tools.assert_equal(job.timing(), 
+                            [('unpack', 'done'), ('autorecon1', 'done')])
+    nose.tools.assert_true(os.path.exists(job.checkpoint('subject.nii.gz')))
+    return
+
+def test_resume_failed():
+    """a retried job skips the stages that are done and resumes the 
+    one that failed"""
+    job = Job()
+    nose.tools.assert_equal(job.run('fail'), 1)
+    nose.tools.assert_true(os.path.exists(job.checkpoint('ndar_stages/'
+                                                         'unpack.done')))
+    nose.tools.assert_false(os.path.exists(job.checkpoint('ndar_stages/'
+                                                          'autorecon1.done')))
+    nose.tools.assert_equal(job.run(), 0)
+    output = job.read('output2')
+    nose.tools.assert_true('stage unpack: already done' in output)
+    nose.tools.assert_true('stage autorecon1: resuming' in output)
+    # restored from the checkpoint
+    nose.tools.assert_true(os.path.exists(os.path.join(job.work_dir, 
+                                                       'subject.nii.gz')))
+    nose.tools.assert_equal(job.recon_all_calls(), 
+                            ['-autorecon1 -subjid subject', 
+                             '-make autorecon1 -subjid subject'])
+    nose.tools.assert_equal(job.timing(), 
+                            [('unpack', 'done'), 
+                             ('autorecon1', 'failed'), 
+                             ('autorecon1', 'done')])
+    # a third run has nothing to do
+    nose.tools.assert_equal(job.run(), 0)
+    nose.tools.assert_equal(len(job.recon_all_calls()), 2)
+    return
+
+def test_interrupted():
+    """USR1 kills the whole stage, grandchildren and all, and the 
+    stage is resumed by the next job"""
+    job = Job()
+    po = job.start('hang')
+    wait_for(job.env['FAKE_RECON_ALL_PID'])
+    pid = int(job.read('pid'))
+    nose.tools.assert_true(is_running(pid))
+    os.kill(po.pid, signal.SIGUSR1)
+    try:
+        nose.tools.assert_equal(po.wait(), 3)
+        nose.tools.assert_false(is_running(pid))
+    finally:
+        # don't leave it behind if it wasn't killed
+        if is_running(pid):
+            os.kill(pid, signal.SIGKILL)
+    nose.tools.assert_true('job is being stopped' in job.read('output1'))
+    nose.tools.assert_equal(job.timing(), 
+                            [('unpack', 'done'), 
+                             ('autorecon1', 'interrupted')])
+    nose.tools.assert_equal(job.run(), 0)
+    nose.tools.assert_equal(job.recon_all_calls(), 
+                            ['-autorecon1 -subjid subject', 
+                             '-make autorecon1 -subjid subject'])
+    nose.tools.assert_equal(job.timing(), 
+                            [('unpack', 'done'), 
+                             ('autorecon1', 'interrupted'), 
+                             ('autorecon1', 'done')])
+    return
+
+# eof
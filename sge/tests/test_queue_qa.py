@@ -0,0 +1,129 @@
+import os
+import sys
+import imp
+import sqlite3
+import nose.tools
+
+# queue_qa is a script, not a module
+sys.dont_write_bytecode = True
+script = os.path.join(os.path.dirname(__file__), '..', 'queue_qa')
+queue_qa = imp.load_source('queue_qa', script)
+
+structural = 'MR structural (T1)'
+
+# (image03_id, subjectkey, interview_age, image_file, scan_type)
+image03_rows = [(1, 'NDAR_INV1', 120, 's3://b/ok.zip', structural), 
+                (2, 'NDAR_INV2', 130, 's3://b/fmri.zip', 'fMRI'), 
+                # the same image03 row twice
+                (3, 'NDAR_INV3', 140, 's3://b/dup.zip', structural), 
+                (3, 'NDAR_INV3', 140, 's3://b/dup.zip', structural), 
+                (4, 'NDAR_INV4', 150, 's3://b/done.zip', structural), 
+                (5, 'NDAR_INV5', 160, 's3://b/dti.zip', 'MR diffusion'), 
+                (6, 'NDAR_INV6', 170, 's3://b/null.zip', None), 
+                (7, 'NDAR_INV7', 180, 's3://b/mixed.zip', structural), 
+                (7, 'NDAR_INV7', 180, 's3://b/mixed.zip', 'fMRI'), 
+                (8, 'NDAR_INV8', 190, 's3://b/partial.zip', structural), 
+                (8, 'NDAR_INV8', 190, 's3://b/partial.zip', 'MR diffusion'), 
+                (9, 'NDAR_INV9', 200, 's3://b/subjects.zip', structural), 
+                (10, 'NDAR_INV10', 210, 's3://b/subjects.zip', structural)]
+
+# done.zip twice, so the join mustn't multiply its rows
+qa_rows = [('s3://b/done.zip', ), ('s3://b/done.zip', )]
+
+def setup():
+    global db
+    db = sqlite3.connect(':memory:')
+    db.execute("""CREATE TABLE image03 (image03_id INTEGER, 
+                                        subjectkey TEXT, 
+                                        interview_age INTEGER, 
+                                        image_file TEXT, 
+                                        scan_type TEXT)""")
+    db.execute("CREATE TABLE imaging_qa01 (file_source TEXT)")
+    db.executemany("INSERT INTO image03 VALUES (?, ?, ?, ?, ?)", image03_rows)
+    db.executemany("INSERT INTO imaging_qa01 VALUES (?)", qa_rows)
+    db.commit()
+    return
+
+def teardown():
+    db.close()
+    return
+
+def select_candidates(image_files=None):
+    c = db.cursor()
+    try:
+        (candidates, errors) = queue_qa.select_candidates(c, image_files)
+    finally:
+        c.close()
+    for image_files in errors.itervalues():
+        image_files.sort()
+    return (sorted(candidates), errors)
+
+expected_candidates = [('s3://b/dup.zip', 
+                        'structural', 
+                        ('NDAR_INV3', 140, 3)), 
+                       ('s3://b/fmri.zip', 
+                        'time series', 
+                        ('NDAR_INV2', 130, 2)), 
+                       ('s3://b/ok.zip', 
+                        'structural', 
+                        ('NDAR_INV1', 120, 1))]
+
+def test_all():
+    """--all: files with nothing to QA or already QAed are left out"""
+    (candidates, errors) = select_candidates()
+    nose.tools.assert_equal(candidates, expected_candidates)
+    msg = 'multiple subject key, interview age, image03 id'
+    nose.tools.assert_equal(errors, 
+                            {'multiple QA types': ['s3://b/mixed.zip', 
+                                                   's3://b/partial.zip'], 
+                             msg: ['s3://b/subjects.zip']})
+    return
+
+def test_files():
+    """a list of files: every file is either a candidate or an error"""
+    image_files = sorted(set([ row[3] for row in image03_rows ]))
+    image_files.append('s3://b/none.zip')
+    (candidates, errors) = select_candidates(image_files)
+    nose.tools.assert_equal(candidates, expected_candidates)
+    msg = 'multiple subject key, interview age, image03 id'
+    nose.tools.assert_equal(errors, 
+                            {'in imaging_qa01': ['s3://b/done.zip'], 
+                             'unset or unsupported scan type':
+                                 ['s3://b/dti.zip', 's3://b/null.zip'], 
+                             'multiple QA types': ['s3://b/mixed.zip', 
+                                                   's3://b/partial.zip'], 
+                             msg: ['s3://b/subjects.zip'], 
+                             'not in image03': ['s3://b/none.zip']})
+    return
+
+def test_in_lists():
+    """a long list of files is queried an IN (...) list at a time"""
+    image_files = sorted(set([ row[3] for row in image03_rows ]))
+    expected = select_candidates(image_files)
+    in_list_size = queue_qa.in_list_size
+    queue_qa.in_list_size = 3
+    try:
+        nose.tools.assert_equal(select_candidates(image_files), expected)
+    finally:
+        queue_qa.in_list_size = in_list_size
+    return
+
+def test_synthetic_db():
+    """the --benchmark database goes through the same checks"""
+    synthetic = queue_qa.synthetic_db(1000)
+    c = synthetic.cursor()
+    (candidates, errors) = queue_qa.select_candidates(c)
+    c.execute("""SELECT COUNT(DISTINCT image_file) 
+                   FROM image03 
+                  WHERE image_file NOT IN (SELECT file_source 
+                                             FROM imaging_qa01)""")
+    n_files = c.fetchone()[0]
+    synthetic.close()
+    nose.tools.assert_true(candidates)
+    n_errors = sum([ len(l) for l in errors.itervalues() ])
+    nose.tools.assert_true(len(candidates) + n_errors <= n_files)
+    for (image_file, qa_type, subject) in candidates:
+        nose.tools.assert_true(qa_type in ('structural', 'time series'))
+    return
+
+# eof
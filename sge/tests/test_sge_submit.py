@@ -0,0 +1,221 @@
+import os
+import stat
+import tempfile
+import shutil
+import subprocess
+import nose.tools
+import sge_submit
+
+sge_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# a fake qsub that records its arguments (one per line, with a blank 
+# line after each call) and fails if its -N argument is "fail"
+fake_qsub = """#!/bin/bash
+printf '%%s\\n' "$@" >> "%s"
+echo >> "%s"
+n=`cat "%s.n" 2> /dev/null || echo 100`
+echo $(( n + 1 )) > "%s.n"
+if [ "$4" = fail ] ; then echo 'qsub: bad job' >&2 ; exit 1 ; fi
+echo "Your job-array $n.1-10:1 (\\"$4\\") has been submitted"
+"""
+
+def setup():
+    global tempdir, qsub_log, old_path
+    tempdir = tempfile.mkdtemp()
+    qsub_log = os.path.join(tempdir, 'qsub.log')
+    bin_dir = os.path.join(tempdir, 'bin')
+    os.mkdir(bin_dir)
+    qsub = os.path.join(bin_dir, 'qsub')
+    fo = open(qsub, 'w')
+    fo.write(fake_qsub % ((qsub_log, ) * 4))
+    fo.close()
+    os.chmod(qsub, stat.S_IRWXU)
+    old_path = os.environ['PATH']
+    os.environ['PATH'] = '%s:%s' % (bin_dir, old_path)
+    return
+
+def teardown():
+    os.environ['PATH'] = old_path
+    shutil.rmtree(tempdir)
+    return
+
+def qsub_calls():
+    """return the argument lists of the qsub calls, and reset the log"""
+    if not os.path.exists(qsub_log):
+        return []
+    calls = open(qsub_log).read().split('\n\n')[:-1]
+    os.unlink(qsub_log)
+    return [ call.split('\n') for call in calls ]
+
+def tasks(n):
+    return [ ['NDAR_INV%d' % i, 120, i, 's3://bucket/%d.zip' % i] \
+             for i in xrange(n) ]
+
+def manifest_dir():
+    return tempfile.mkdtemp(dir=tempdir)
+
+def test_submit():
+    jobs = sge_submit.submit_array('/ndar/sge/launch_basic_check', 
+                                   tasks(3), 
+                                   'basic_check', 
+                                   5, 
+                                   manifest_dir())
+    nose.tools.assert_equal(len(jobs), 1)
+    (job_id, manifest, n_tasks) = jobs[0]
+    nose.tools.assert_true(job_id.isdigit())
+    nose.tools.assert_equal(n_tasks, 3)
+    lines = open(manifest).read().split('\n')
+    nose.tools.assert_equal(lines[0], 'NDAR_INV0\t120\t0\ts3://bucket/0.zip')
+    nose.tools.assert_equal(len(lines), 4)
+    nose.tools.assert_equal(lines[3], '')
+    log_base = '$HOME/logs/basic_check.$JOB_ID.$TASK_ID'
+    nose.tools.assert_equal(qsub_calls(), [['-t', '1-3', 
+                                            '-N', 'basic_check', 
+                                            '-o', log_base + '.stdout', 
+                                            '-e', log_base + '.stderr', 
+                                            '-tc', '5', 
+                                            '/ndar/sge/launch_basic_check', 
+                                            '--manifest', manifest]])
+    return
+
+def test_split():
+    """submissions over max_array_tasks are split"""
+    max_array_tasks = sge_submit.max_array_tasks
+    sge_submit.max_array_tasks = 3
+    try:
+        jobs = sge_submit.submit_array('launch', 
+                                       tasks(7), 
+                                       'split', 
+                                       manifest_dir=manifest_dir())
+    finally:
+        sge_submit.max_array_tasks = max_array_tasks
+    nose.tools.assert_equal([ n for (job_id, m, n) in jobs ], [3, 3, 1])
+    nose.tools.assert_equal(len(set([ m for (job_id, m, n) in jobs ])), 3)
+    nose.tools.assert_equal(len(set([ j for (j, m, n) in jobs ])), 3)
+    calls = qsub_calls()
+    nose.tools.assert_equal([ call[1] for call in calls ], 
+                            ['1-3', '1-3', '1-1'])
+    # no -tc without max_running
+    nose.tools.assert_false('-tc' in calls[0])
+    return
+
+def test_scans_per_task():
+    jobs = sge_submit.submit_array('launch', 
+                                   tasks(7), 
+                                   'qa', 
+                                   manifest_dir=manifest_dir(), 
+                                   scans_per_task=3, 
+                                   qsub_args=['-l', 's_rt=1:30:00'])
+    nose.tools.assert_equal(jobs[0][2], 7)
+    call = qsub_calls()[0]
+    nose.tools.assert_equal(call[1], '1-3')
+    nose.tools.assert_equal(call[-7:], ['-l', 's_rt=1:30:00', 
+                                        'launch', 
+                                        '--manifest', jobs[0][1], 
+                                        '--scans-per-task', '3'])
+    return
+
+def test_errors():
+    nose.tools.assert_equal(sge_submit.submit_array('launch', [], 'none'), [])
+    nose.tools.assert_raises(sge_submit.SubmitError, 
+                             sge_submit.submit_array, 
+                             'launch', 
+                             tasks(1), 
+                             'fail', 
+                             manifest_dir=manifest_dir())
+    qsub_calls()
+    path = os.environ['PATH']
+    os.environ['PATH'] = tempdir
+    try:
+        nose.tools.assert_raises(sge_submit.SubmitError, 
+                                 sge_submit.submit_array, 
+                                 'launch', 
+                                 tasks(1), 
+                                 'missing', 
+                                 manifest_dir=manifest_dir())
+    finally:
+        os.environ['PATH'] = path
+    return
+
+def test_bad_manifest():
+    fname = os.path.join(tempdir, 'bad.tsv')
+    for arg in ('', 'a\tb', 'a\nb'):
+        nose.tools.assert_raises(ValueError, 
+                                 sge_submit.write_manifest, 
+                                 fname, 
+                                 [['x', arg]])
+    return
+
+def test_scale_time():
+    nose.tools.assert_equal(sge_submit.scale_time('0:30:00', 3), '1:30:00')
+    nose.tools.assert_equal(sge_submit.scale_time('1:00:01', 2), '2:00:02')
+    return
+
+def parse_manifest(script, end, manifest, task_id, *args):
+    """run the manifest handling at the top of a launch script (through 
+    the first "fi" at the start of a line) followed by end, returning 
+    (exit status, output lines)"""
+    fo = open(os.path.join(sge_dir, script))
+    lines = []
+    for line in fo:
+        if line.startswith('#'):
+            continue
+        lines.append(line)
+        if line.rstrip('\n') == 'fi':
+            break
+    fo.close()
+    code = ''.join(lines) + end
+    env = dict(os.environ)
+    env['SGE_TASK_ID'] = str(task_id)
+    args = ['bash', '-c', code, script, '--manifest', manifest] + list(args)
+    po = subprocess.Popen(args, 
+                          stdout=subprocess.PIPE, 
+                          stderr=subprocess.PIPE, 
+                          env=env)
+    (stdout, stderr) = po.communicate()
+    return (po.returncode, stdout.split('\n')[:-1])
+
+def test_launch_manifest():
+    """a launch script gets the arguments of its manifest line"""
+    manifest = os.path.join(tempdir, 'launch.tsv')
+    tasks = [['NDAR_INV1', 120, 1, 's3://bucket/a b.zip', 's3://thumbs/'], 
+             ['NDAR_INV2', 130, 2, 's3://bucket/c.zip', 's3://thumbs/']]
+    sge_submit.write_manifest(manifest, tasks)
+    end = 'printf "%s\\n" "$@"\n'
+    for (i, task) in enumerate(tasks):
+        (rv, output) = parse_manifest('launch_basic_check', 
+                                      end, 
+                                      manifest, 
+                                      i + 1)
+        nose.tools.assert_equal(rv, 0)
+        nose.tools.assert_equal(output, [ str(arg) for arg in task ])
+    (rv, output) = parse_manifest('launch_basic_check', end, manifest, 3)
+    nose.tools.assert_equal(rv, 1)
+    return
+
+def test_launch_manifest_scans():
+    """a QA launch script gets its scans per task from the manifest"""
+    manifest = os.path.join(tempdir, 'scans.tsv')
+    tasks = [ ['s3://bucket/%d.zip' % i, 'x'] for i in xrange(5) ]
+    sge_submit.write_manifest(manifest, tasks)
+    end = 'printf "%s\\n" "${scans[@]}"\n'
+    expected = { 1: tasks[0:2], 2: tasks[2:4], 3: tasks[4:5] }
+    for (task_id, task_scans) in expected.iteritems():
+        (rv, output) = parse_manifest('launch_structural_qa', 
+                                      end, 
+                                      manifest, 
+                                      task_id, 
+                                      '--scans-per-task', 
+                                      '2')
+        nose.tools.assert_equal(rv, 0)
+        nose.tools.assert_equal(output, [ '\t'.join(s) for s in task_scans ])
+    (rv, output) = parse_manifest('launch_structural_qa', 
+                                  end, 
+                                  manifest, 
+                                  4, 
+                                  '--scans-per-task', 
+                                  '2')
+    nose.tools.assert_equal(rv, 1)
+    return
+
+# eof
@@ -0,0 +1,188 @@
+import os
+import sys
+import imp
+import zlib
+import zipfile
+import StringIO
+import tempfile
+import shutil
+import subprocess
+import nose.tools
+import s3_stub
+
+# zip_upload is a script, not a module
+sys.dont_write_bytecode = True
+script = os.path.join(os.path.dirname(__file__), '..', 'zip_upload')
+zip_upload = imp.load_source('zip_upload', script)
+
+bucket_name = 'bucket'
+
+def setup():
+    global server, tempdir, subj_dir, contents
+    server = s3_stub.Server()
+    tempdir = tempfile.mkdtemp()
+    subj_dir = os.path.join(tempdir, 'subj')
+    # name -> data; text compresses, the random data doesn't
+    text = ''.join([ 'line %d\n' % i for i in xrange(50000) ])
+    contents = {'subj/scripts/recon-all.log': text, 
+                'subj/mri/orig.nii.gz': os.urandom(100000), 
+                'subj/mri/T1.mgz': zlib.compress(text), 
+                'subj/stats/aseg.stats': text[:1000], 
+                'subj/empty': ''}
+    for (name, data) in contents.iteritems():
+        path = os.path.join(tempdir, name)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        open(path, 'wb').write(data)
+    os.mkdir(os.path.join(subj_dir, 'tmp'))
+    return
+
+def teardown():
+    server.stop()
+    shutil.rmtree(tempdir)
+    return
+
+def connect():
+    return zip_upload.s3_connect('x', 'y', None, server.endpoint)
+
+def upload(key_name, part_size=64*1024, n_threads=3, level=6):
+    """zip subj_dir to the stub as zip_upload does; returns the writer"""
+    writer = zip_upload.MultipartWriter(connect, 
+                                        bucket_name, 
+                                        key_name, 
+                                        part_size, 
+                                        n_threads)
+    compressor = zip_upload.Compressor(2)
+    zs = zip_upload.ZipStream(writer, 
+                              compressor, 
+                              level, 
+                              zip_upload.default_store_suffixes, 
+                              4)
+    try:
+        for (path, name, st) in zip_upload.walk(subj_dir):
+            zs.add(path, name, st)
+        zs.close()
+        writer.close()
+    except:
+        writer.abort()
+        raise
+    finally:
+        compressor.close()
+    return writer
+
+def uploaded(key_name):
+    data = server.objects['%s/%s' % (bucket_name, key_name)]
+    return zipfile.ZipFile(StringIO.StringIO(data))
+
+def part_puts():
+    return [ int(query['partNumber'])
+             for (method, path, query) in server.requests
+             if method == 'PUT' ]
+
+def test_upload():
+    """the upload is a good zip file, sent in several parts"""
+    server.reset()
+    writer = upload('subj.zip')
+    nose.tools.assert_true(writer.n_parts > 2)
+    nose.tools.assert_equal(sorted(part_puts()), 
+                            range(1, writer.n_parts + 1))
+    methods = [ r[0] for r in server.requests ]
+    nose.tools.assert_equal((methods[0], methods[-1]), ('POST', 'POST'))
+    nose.tools.assert_equal(server.uploads, {})
+    zf = uploaded('subj.zip')
+    nose.tools.assert_equal(zf.testzip(), None)
+    files = [ zi.filename for zi in zf.infolist()
+              if not zi.filename.endswith('/') ]
+    nose.tools.assert_equal(sorted(files), sorted(contents))
+    nose.tools.assert_equal(sorted(set(zf.namelist()) - set(files)), 
+                            ['subj/', 'subj/mri/', 'subj/scripts/', 
+                             'subj/stats/', 'subj/tmp/'])
+    for (name, data) in contents.iteritems():
+        nose.tools.assert_equal(zf.read(name), data, name)
+    # already compressed files are stored
+    for name in ('subj/mri/orig.nii.gz', 'subj/mri/T1.mgz'):
+        nose.tools.assert_equal(zf.getinfo(name).compress_type, 
+                                zipfile.ZIP_STORED)
+    info = zf.getinfo('subj/scripts/recon-all.log')
+    nose.tools.assert_equal(info.compress_type, zipfile.ZIP_DEFLATED)
+    nose.tools.assert_true(info.compress_size < info.file_size)
+    return
+
+def test_blocks():
+    """a file deflated in several blocks is one deflate stream"""
+    server.reset()
+    block_size = zip_upload.block_size
+    zip_upload.block_size = 4096
+    try:
+        upload('blocks.zip')
+    finally:
+        zip_upload.block_size = block_size
+    zf = uploaded('blocks.zip')
+    nose.tools.assert_equal(zf.testzip(), None)
+    name = 'subj/scripts/recon-all.log'
+    nose.tools.assert_equal(zf.read(name), contents[name])
+    return
+
+def test_one_part():
+    """an upload smaller than the part size is one part"""
+    server.reset()
+    writer = upload('one.zip', part_size=10*1024*1024, level=0)
+    nose.tools.assert_equal(writer.n_parts, 1)
+    nose.tools.assert_equal(part_puts(), [1])
+    zf = uploaded('one.zip')
+    nose.tools.assert_equal(zf.testzip(), None)
+    info = zf.getinfo('subj/scripts/recon-all.log')
+    nose.tools.assert_equal(info.compress_type, zipfile.ZIP_STORED)
+    return
+
+def test_part_retry():
+    """a failed part upload is retried"""
+    server.reset()
+    server.fail_parts = {2: 1}
+    writer = upload('retry.zip')
+    nose.tools.assert_equal(part_puts().count(2), 2)
+    nose.tools.assert_equal(len(part_puts()), writer.n_parts + 1)
+    nose.tools.assert_equal(uploaded('retry.zip').testzip(), None)
+    return
+
+def test_part_failure():
+    """a part that fails part_tries times aborts the upload"""
+    server.reset()
+    server.fail_parts = {2: 100}
+    part_tries = zip_upload.part_tries
+    zip_upload.part_tries = 1
+    try:
+        nose.tools.assert_raises(zip_upload.ZipUploadError, 
+                                 upload, 
+                                 'failed.zip')
+    finally:
+        zip_upload.part_tries = part_tries
+    nose.tools.assert_equal(server.requests[-1][0], 'DELETE')
+    nose.tools.assert_equal(server.uploads, {})
+    nose.tools.assert_equal(server.objects, {})
+    return
+
+def test_script():
+    """the script, with --s3-endpoint"""
+    server.reset()
+    env = dict(os.environ)
+    env['AWS_ACCESS_KEY_ID'] = 'x'
+    env['AWS_SECRET_ACCESS_KEY'] = 'y'
+    po = subprocess.Popen([sys.executable, 
+                           script, 
+                           '--s3-endpoint', server.endpoint, 
+                           '--workers', '2', 
+                           subj_dir, 
+                           's3://%s/script.zip' % bucket_name], 
+                          stdout=subprocess.PIPE, 
+                          stderr=subprocess.PIPE, 
+                          env=env)
+    (stdout, stderr) = po.communicate()
+    nose.tools.assert_equal(po.returncode, 0, stderr)
+    nose.tools.assert_true('in 1 parts' in stdout)
+    zf = uploaded('script.zip')
+    nose.tools.assert_equal(zf.testzip(), None)
+    nose.tools.assert_equal(len(zf.namelist()), len(contents) + 5)
+    return
+
+# eof
@@ -68,8 +68,12 @@ def ObjectNotFoundError(NDARError):
     def __str__(self):
         return 'Object not found: %s' % self.object
 
-def _get_file_type(fname):
-    """Return the type of a file."""
+def _get_file_type(fname, fo=None):
+    """Return the type of a file.
+
+    If fo is given, it is an open file object for the file (which need not 
+    be seekable) and is read instead of fname.
+    """
     if fname.endswith('.nii.gz') or fname.endswith('.nii'):
         return 'NIfTI-1'
     if fname.endswith('.png'):
@@ -82,10 +86,13 @@ def _get_file_type(fname):
         return 'NRRD'
     if fname.endswith('.HEAD') or fname.endswith('.BRIK'):
         return 'AFNI'
-    with open(fname) as fo:
-        fo.seek(128)
-        if fo.read(4) == 'DICM':
-            return 'DICOM'
+    if fo is None:
+        with open(fname) as fo:
+            leading_bytes = fo.read(132)
+    else:
+        leading_bytes = fo.read(132)
+    if leading_bytes[128:] == 'DICM':
+        return 'DICOM'
     return 'other'
 
 class _BaseImage(object):
@@ -95,6 +102,10 @@ class _BaseImage(object):
     def __init__(self, attrs=None):
         self._clean_on_del = True
         self._tempdir = None
+        # members of the source ZIP file (None if the source isn't a ZIP 
+        # file) and those that have been extracted; see path()
+        self._zip_members = None
+        self._extracted = set()
         self.nifti_1 = None
         self.nifti_1_gz = None
         self.afni = None
@@ -485,11 +496,22 @@ class _BaseImage(object):
                       'JPEG': [], 
                       'other': []}
         if self.source.endswith('.zip'):
+            # classify the files straight from the zip file; they are 
+            # extracted by path() as they are needed
             zf = zipfile.ZipFile(self._temp_source)
-            zf.extractall('%s/unpacked' % self._tempdir)
-            for fname in os.listdir('%s/unpacked' % self._tempdir):
-                full_path = '%s/unpacked/%s' % (self._tempdir, fname)
-                self.files[_get_file_type(full_path)].append(fname)
+            try:
+                self._zip_members = set()
+                for fname in zf.namelist():
+                    if fname.endswith('/'):
+                        continue
+                    self._zip_members.add(fname)
+                    fo = zf.open(fname)
+                    try:
+                        self.files[_get_file_type(fname, fo)].append(fname)
+                    finally:
+                        fo.close()
+            finally:
+                zf.close()
         else:
             file_type = _get_file_type(self._temp_source)
             self.files[file_type].append(self._source_base)
@@ -529,6 +551,8 @@ class _BaseImage(object):
         """Clean up temporary files."""
         shutil.rmtree(self._tempdir)
         self._tempdir = None
+        self._zip_members = None
+        self._extracted = set()
         self.files = None
         self.nifti_1 = None
         self.nifti_1_gz = None
@@ -539,7 +563,35 @@ class _BaseImage(object):
         return
 
     def path(self, fname):
-        """Return the full path to a single file."""
+        """Return the full path to a single file.
+
+        Files are extracted from a ZIP source as they are needed.  Files 
+        that go together are extracted together: asking for one DICOM 
+        file extracts the whole series and asking for a .HEAD or .BRIK 
+        (or its base name) extracts the pair.
+        """
+        if self._zip_members is not None and fname not in self._extracted:
+            if fname in self.files['DICOM']:
+                names = self.files['DICOM']
+            elif fname in self.files['AFNI']:
+                # the base name of a .HEAD/.BRIK pair
+                names = [fname+'.HEAD', fname+'.BRIK']
+            elif fname[-5:] in ('.HEAD', '.BRIK') \
+                 and fname[:-5] in self.files['AFNI']:
+                names = [fname[:-5]+'.HEAD', fname[:-5]+'.BRIK']
+            elif fname in self._zip_members:
+                names = [fname]
+            else:
+                names = []
+            names = [ name for name in names if name not in self._extracted ]
+            if names:
+                zf = zipfile.ZipFile(self._temp_source)
+                try:
+                    for name in names:
+                        zf.extract(name, '%s/unpacked' % self._tempdir)
+                finally:
+                    zf.close()
+                self._extracted.update(names)
         return '%s/unpacked/%s' % (self._tempdir, fname)
 
 class Image(_BaseImage):
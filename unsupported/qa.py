@@ -5,6 +5,29 @@ import os
 import subprocess
 import nipype.pipeline.engine as np_pe
 import nipype.interfaces.fsl as np_fsl
+import nipype.interfaces.utility as np_util
+
+def structural_stats(in_file, outskin_mask_file, brain_mask_file, seg_file):
+
+    """compute the fslstats -R -r -m -s -v values of in_file for the 
+    external (outside the outer skin mask), brain, csf, gm, and wm masks, 
+    reading each volume once
+
+    the values are written to <class>.stats in the current directory by 
+    ndar_structural_qa.write_stats() (from ndar_backend), as 
+    run_structural_qa writes them; returns the list of .stats files
+
+    this runs as a nipype Function node, so it must do its own imports
+    """
+
+    import os
+    import ndar_structural_qa
+
+    return ndar_structural_qa.write_stats(in_file, 
+                                          outskin_mask_file, 
+                                          brain_mask_file, 
+                                          seg_file, 
+                                          os.getcwd())
 
 class StructuralQAWorkflow(np_pe.Workflow):
 
@@ -25,48 +48,19 @@ class StructuralQAWorkflow(np_pe.Workflow):
         fast.inputs.img_type = 1
         self.connect(bet, 'out_file', fast, 'in_files')
 
-        generate_external = np_pe.Node(interface=np_fsl.ImageMaths(), 
-                                       name='generate_external')
-        generate_external.inputs.op_string = '-sub 1 -mul -1'
-        self.connect(bet, 'outskin_mask_file', generate_external, 'in_file')
-
-        generate_csf = np_pe.Node(interface=np_fsl.ImageMaths(), name='generate_csf')
-        generate_csf.inputs.op_string = '-thr 1 -uthr 1 -bin'
-        self.connect(fast, 'tissue_class_map', generate_csf, 'in_file')
-
-        generate_gm = np_pe.Node(interface=np_fsl.ImageMaths(), name='generate_gm')
-        generate_gm.inputs.op_string = '-thr 2 -uthr 2 -bin'
-        self.connect(fast, 'tissue_class_map', generate_gm, 'in_file')
-
-        generate_wm = np_pe.Node(interface=np_fsl.ImageMaths(), name='generate_wm')
-        generate_wm.inputs.op_string = '-thr 3 -uthr 3 -bin'
-        self.connect(fast, 'tissue_class_map', generate_wm, 'in_file')
-
-        external_stats = np_pe.Node(interface=np_fsl.ImageStats(), 
-                                    name='external_stats')
-        external_stats.inputs.op_string = '-k %s -R -r -m -s -v'
-        self.connect(reorient, 'out_file', external_stats, 'in_file')
-        self.connect(generate_external, 'out_file', external_stats, 'mask_file')
-
-        brain_stats = np_pe.Node(interface=np_fsl.ImageStats(), name='brain_stats')
-        brain_stats.inputs.op_string = '-k %s -R -r -m -s -v'
-        self.connect(reorient, 'out_file', brain_stats, 'in_file')
-        self.connect(bet, 'mask_file', brain_stats, 'mask_file')
-
-        csf_stats = np_pe.Node(interface=np_fsl.ImageStats(), name='csf_stats')
-        csf_stats.inputs.op_string = '-k %s -R -r -m -s -v'
-        self.connect(reorient, 'out_file', csf_stats, 'in_file')
-        self.connect(generate_csf, 'out_file', csf_stats, 'mask_file')
-
-        gm_stats = np_pe.Node(interface=np_fsl.ImageStats(), name='gm_stats')
-        gm_stats.inputs.op_string = '-k %s -R -r -m -s -v'
-        self.connect(reorient, 'out_file', gm_stats, 'in_file')
-        self.connect(generate_gm, 'out_file', gm_stats, 'mask_file')
-
-        wm_stats = np_pe.Node(interface=np_fsl.ImageStats(), name='wm_stats')
-        wm_stats.inputs.op_string = '-k %s -R -r -m -s -v'
-        self.connect(reorient, 'out_file', wm_stats, 'in_file')
-        self.connect(generate_wm, 'out_file', wm_stats, 'mask_file')
+        # one pass over the volume for all five tissue classes, in place 
+        # of fslmaths and five runs of fslstats
+        stats_function = np_util.Function(input_names=['in_file', 
+                                                       'outskin_mask_file', 
+                                                       'brain_mask_file', 
+                                                       'seg_file'], 
+                                          output_names=['stats_files'], 
+                                          function=structural_stats)
+        stats = np_pe.Node(interface=stats_function, name='stats')
+        self.connect(reorient, 'out_file', stats, 'in_file')
+        self.connect(bet, 'outskin_mask_file', stats, 'outskin_mask_file')
+        self.connect(bet, 'mask_file', stats, 'brain_mask_file')
+        self.connect(fast, 'tissue_class_map', stats, 'seg_file')
 
         return
 
@@ -59,6 +59,14 @@ def test_dicom_2():
             assert not v
     assert os.path.exists(i.path('i1616037.MRDC.160'))
 
+def test_dicom_lazy_extraction():
+    i = ndar.Image('test_data/s1615890.zip')
+    unpacked = os.path.join(i._tempdir, 'unpacked')
+    assert len(i.files['DICOM']) == 166
+    assert not os.listdir(unpacked)
+    i.path('i1616037.MRDC.160')
+    assert len(os.listdir(unpacked)) == 166
+
 def test_s3_bad_keys():
     path = 's3://NDAR_Central/submission_9709/T0177-1-1/NDARBF372RNH-DWI.nrrd'
     ak = 'bogus'
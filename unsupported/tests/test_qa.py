@@ -0,0 +1,116 @@
+import os
+import tempfile
+import shutil
+import mock
+import numpy
+import nibabel
+import nose.tools
+import nipype.pipeline.engine as np_pe
+import nipype.interfaces.utility as np_util
+import qa
+import utils
+
+def setup():
+    global tempdir
+    tempdir = tempfile.mkdtemp()
+    return
+
+def teardown():
+    shutil.rmtree(tempdir)
+    return
+
+def save(data, name):
+    fname = os.path.join(tempdir, name)
+    nibabel.save(nibabel.Nifti1Image(data, numpy.diag([2, 2, 2, 1])), fname)
+    return fname
+
+def volumes(shape=(10, 10, 10)):
+    """return the volume, outer skin mask, brain mask, and label map"""
+    rnd = numpy.random.RandomState(0)
+    vol = rnd.uniform(0, 100, shape).astype(numpy.float32)
+    outskin = numpy.zeros(shape[:3], numpy.uint8)
+    outskin[2:8, 2:8, 2:8] = 1
+    brain = numpy.zeros(shape[:3], numpy.uint8)
+    brain[3:7, 3:7, 3:7] = 1
+    seg = numpy.zeros(shape[:3], numpy.uint8)
+    seg[3:7, 3:7, 3:7] = rnd.randint(1, 4, (4, 4, 4))
+    return (save(vol, 'vol.nii.gz'), 
+            save(outskin, 'outskin.nii.gz'), 
+            save(brain, 'brain.nii.gz'), 
+            save(seg, 'seg.nii.gz'))
+
+class Image:
+
+    subjectkey = 'NDAR_INV00000000'
+    src_subject_id = 'subject'
+    interview_date = '01/01/2000'
+    interview_age = 120
+    gender = 'F'
+    image_file = 's3://bucket/image.zip'
+
+def test_store_structural_qa():
+    """store the results of a workflow run"""
+    in_files = volumes()
+    stats_function = np_util.Function(input_names=['in_file', 
+                                                   'outskin_mask_file', 
+                                                   'brain_mask_file', 
+                                                   'seg_file'], 
+                                      output_names=['stats_files'], 
+                                      function=qa.structural_stats)
+    stats = np_pe.Node(interface=stats_function, name='stats')
+    stats.inputs.in_file = in_files[0]
+    stats.inputs.outskin_mask_file = in_files[1]
+    stats.inputs.brain_mask_file = in_files[2]
+    stats.inputs.seg_file = in_files[3]
+    workflow = np_pe.Workflow(name='structural_qa', base_dir=tempdir)
+    workflow.add_nodes([stats])
+    g = workflow.run()
+    with mock.patch('MySQLdb.connect') as connect:
+        utils.store_structural_qa(Image(), g, 'host', 'user', 'pw', 'db')
+    execute = connect.return_value.cursor.return_value.execute
+    (query, params) = execute.call_args[0]
+    nose.tools.assert_equal(params[:6], ('NDAR_INV00000000', 
+                                         'subject', 
+                                         '01/01/2000', 
+                                         120, 
+                                         'F', 
+                                         's3://bucket/image.zip'))
+    vol = nibabel.load(in_files[0]).get_data()
+    brain = nibabel.load(in_files[2]).get_data() != 0
+    outskin = nibabel.load(in_files[1]).get_data()
+    # brain_voxels and brain_volume (2 mm voxels)
+    nose.tools.assert_equal(params[20:22], (64, 512))
+    # brain_mean
+    nose.tools.assert_almost_equal(params[18], vol[brain].mean(), places=4)
+    # external_voxels
+    nose.tools.assert_equal(params[12], 1000 - 216)
+    # snr = brain mean / external std
+    snr = vol[brain].mean() / vol[outskin != 1].std(ddof=1)
+    nose.tools.assert_almost_equal(params[-1], snr, places=4)
+    connect.return_value.commit.assert_called_once_with()
+    return
+
+def test_structural_stats_4d():
+    """a single-frame 4-D volume is taken as 3-D"""
+    in_files = volumes((10, 10, 10, 1))
+    cwd = os.getcwd()
+    os.chdir(tempdir)
+    try:
+        stats_files = qa.structural_stats(*in_files)
+    finally:
+        os.chdir(cwd)
+    nose.tools.assert_equal([ os.path.basename(f) for f in stats_files ], 
+                            ['external.stats', 
+                             'brain.stats', 
+                             'csf.stats', 
+                             'gm.stats', 
+                             'wm.stats'])
+    return
+
+def test_structural_stats_multiframe():
+    """a volume with several frames is rejected"""
+    in_files = volumes((10, 10, 10, 3))
+    nose.tools.assert_raises(ValueError, qa.structural_stats, *in_files)
+    return
+
+# eof
@@ -4,6 +4,7 @@ attr_value, HTMLTable, and BIRNParser are taken from the
 INCF one-click data sharing project: https://github.com/incf/one_click
 """
 
+import os
 import math
 import xml.dom.minidom
 import HTMLParser
@@ -237,16 +238,24 @@ def store_structural_qa(image, graph,
     val_types = ('min', 'max', 'robust_min', 'robust_max', 
                  'mean', 'std', 'voxels', 'volume')
 
-    for tissue in ('brain', 'csf', 'gm', 'wm', 'external'):
-        for node in graph.nodes():
-            if node.name == '%s_stats' % tissue:
-                val_list = []
-                for v in node.result.outputs.out_stat:
-                    if math.isnan(v):
-                        val_list.append(None)
-                    else:
-                        val_list.append(v)
-                break
+    # the stats node writes <tissue>.stats for each tissue class (see 
+    # qa.structural_stats())
+    for node in graph.nodes():
+        if node.name == 'stats':
+            stats_files = node.result.outputs.stats_files
+            break
+    else:
+        raise ValueError('no stats node in the workflow graph')
+
+    for fname in stats_files:
+        tissue = os.path.basename(fname)[:-len('.stats')]
+        val_list = []
+        for v in open(fname).readline().split():
+            v = float(v)
+            if math.isnan(v):
+                val_list.append(None)
+            else:
+                val_list.append(v)
         vals[tissue] = dict(zip(val_types, val_list))
 
     try: